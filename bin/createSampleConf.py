@@ -50,6 +50,20 @@ def main():
     else:
         conf.read_dict(d)
 
+    try:
+        d = cmiputil.session.getDefaultConf()
+    except AttributeError:
+        pass
+    else:
+        conf.read_dict(d)
+
+    try:
+        d = cmiputil.download.getDefaultConf()
+    except AttributeError:
+        pass
+    else:
+        conf.read_dict(d)
+
     try:
         d = cmiputil.convoc.getDefaultConf()
     except AttributeError:
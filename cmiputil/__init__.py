@@ -7,5 +7,14 @@ from . import esgfdatainfo
 from . import dds
 from . import timer
 from . import braceexpand
+from . import cache
+from . import session
+from . import syncstate
+from . import jsonstream
+from . import resultstore
+from . import replica
+from . import ratelimit
+from . import metrics
+from . import download
 
 __version__ = '0.9.1'
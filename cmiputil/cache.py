@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Persistent on-disk cache.
+
+:class:`DiskCache` is a simple key-value store kept in one `SQLite`_
+file, used to cache responses from ESGF services, such as search
+results of :class:`esgfsearch.ESGFSearch`.
+
+Each entry may expire after `ttl` seconds since it was stored, and the
+total size of entries is limited by `max_size` bytes.  If the total
+size exceeds the limit, least recently used entries are evicted.
+
+Keys are strings, values are bytes.  Use :func:`makeKey` to make a
+key from an URL and query parameters.
+
+Example:
+
+    >>> from cmiputil import cache
+    >>> c = cache.DiskCache('/tmp/cmiputil-cache.sqlite', ttl=3600)
+    >>> key = cache.makeKey('http://esgf-node.llnl.gov/esg-search/search',
+    ...                     {'source_id': 'MIROC6', 'limit': 10})
+    >>> c.put(key, b'{"response": {}}')
+    >>> c.get(key)
+    b'{"response": {}}'
+
+.. _SQLite: https://docs.python.org/3/library/sqlite3.html
+
+"""
+__author__ = 'T.Inoue'
+__credits__ = 'Copyright (c) 2019 RIST'
+__version__ = 'v20190714'
+__date__ = '2019/07/14'
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+
+#: Number of entries read at once to be evicted.
+_evict_batch = 100
+
+
+class CacheMissError(Exception):
+    "Requested entry is not found in the cache."
+    pass
+
+
+class DiskCache():
+    """
+    Persistent key-value cache with TTL and LRU eviction.
+
+    Args:
+        file (path-like): SQLite database file, created if not exists.
+        ttl (float): entries expire after `ttl` seconds since stored,
+                     ``None`` means never expire.
+        max_size (int): maximum total size of values in bytes,
+                        ``None`` means unlimited.
+
+    Attributes:
+        file (Path): SQLite database file
+        ttl (float): time to live of entries in seconds
+        max_size (int): maximum total size of values in bytes
+
+    Instances are thread-safe.
+    """
+    _debug = False
+
+    @classmethod
+    def _enable_debug(cls):
+        cls._debug = True
+
+    @classmethod
+    def _disable_debug(cls):
+        cls._debug = True
+
+    def __init__(self, file, ttl=None, max_size=None):
+        self.file = Path(file).expanduser()
+        self.ttl = ttl
+        self.max_size = max_size
+
+        self.file.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.file), timeout=30,
+                                   check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS entries ('
+                ' key TEXT PRIMARY KEY,'
+                ' value BLOB,'
+                ' size INTEGER,'
+                ' created REAL,'
+                ' accessed REAL)')
+            # covers both the total size and the LRU order, so that
+            # eviction does not read values.
+            self._db.execute(
+                'CREATE INDEX IF NOT EXISTS entries_accessed'
+                ' ON entries (accessed, size)')
+
+        if self._debug:
+            print(f'dbg:DiskCache():file:{self.file}, ttl:{self.ttl}, '
+                  f'max_size:{self.max_size}')
+
+    def get(self, key, stale=False):
+        """
+        Get the value for `key`.
+
+        Args:
+            key (str): key
+            stale (bool): return expired entry also.
+
+        Returns:
+            bytes: value, or ``None`` if `key` is not found or expired.
+        """
+        now = time.time()
+        with self._lock, self._db:
+            row = self._db.execute(
+                'SELECT value, created FROM entries WHERE key = ?',
+                (key,)).fetchone()
+            if row is None:
+                return None
+            value, created = row
+            if (self.ttl is not None and now - created > self.ttl
+                    and not stale):
+                if self._debug:
+                    print(f'dbg:DiskCache.get():expired:{key}')
+                return None
+            self._db.execute(
+                'UPDATE entries SET accessed = ? WHERE key = ?', (now, key))
+        return value
+
+    def put(self, key, value):
+        """
+        Store `value` for `key`, and evict least recently used entries
+        if the total size exceeds :attr:`max_size`.
+
+        Args:
+            key (str): key
+            value (bytes): value
+        """
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)',
+                (key, value, len(value), now, now))
+            if self.max_size is not None:
+                self._evict()
+
+    def invalidate(self, key=None):
+        """
+        Remove the entry for `key`, or all entries if `key` is ``None``.
+        """
+        with self._lock, self._db:
+            if key is None:
+                self._db.execute('DELETE FROM entries')
+            else:
+                self._db.execute('DELETE FROM entries WHERE key = ?', (key,))
+
+    def expire(self):
+        """
+        Remove all expired entries.
+        """
+        if self.ttl is None:
+            return
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM entries WHERE created < ?',
+                             (time.time() - self.ttl,))
+
+    @property
+    def size(self):
+        """
+        Total size of values in bytes.
+
+        :type: int
+        """
+        with self._lock:
+            res = self._db.execute(
+                'SELECT TOTAL(size) FROM entries').fetchone()[0]
+        return int(res)
+
+    def _evict(self):
+        # must be called with the lock held, in a transaction.
+        total = self._db.execute(
+            'SELECT TOTAL(size) FROM entries').fetchone()[0]
+        evicted = 0
+        while total > self.max_size:
+            rows = self._db.execute(
+                'SELECT key, size FROM entries ORDER BY accessed LIMIT ?',
+                (_evict_batch,)).fetchall()
+            if not rows:
+                break
+            keys = []
+            for key, size in rows:
+                if total <= self.max_size:
+                    break
+                keys.append((key,))
+                total -= size
+            self._db.executemany('DELETE FROM entries WHERE key = ?', keys)
+            evicted += len(keys)
+        if evicted and self._debug:
+            print(f'dbg:DiskCache._evict():evicted {evicted} entries')
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute(
+                'SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def close(self):
+        """
+        Close the database.
+        """
+        with self._lock:
+            self._db.close()
+
+
+def makeKey(url, params=None):
+    """
+    Make a cache key from `url` and query parameters `params`.
+
+    `params` is canonicalized, that is, the order of keys, types of
+    values and whitespaces around comma-separated values do not affect
+    the result.
+
+    Args:
+        url (str): base URL
+        params (dict): query parameters
+
+    Returns:
+        str: key
+
+    Examples:
+        >>> a = makeKey('http://a/search', {'x': 'p, q', 'limit': 10})
+        >>> b = makeKey('http://a/search', {'limit': '10', 'x': 'p,q'})
+        >>> a == b
+        True
+    """
+    if params is None:
+        params = {}
+    canon = sorted(
+        (k, ','.join(v.strip() for v in str(val).split(',')))
+        for k, val in params.items())
+    text = json.dumps([url, canon])
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+if (__name__ == '__main__'):
+    import doctest
+    doctest.testmod()
@@ -170,7 +170,34 @@ class Conf(configparser.ConfigParser):
 
                 [ESGFSearch]
                 search_service = http://esgf-node.llnl.gov/esg-search/
+                projection = True
+                extra_fields =
+                sync_file = ~/.cache/cmiputil/sync.sqlite
+                index_nodes =
+                federation = merge
                 aggregate = True
+                stages = search, catalog, dds, local
+                page_size = 1000
+                max_workers = 8
+                max_workers_per_node = 2
+                files_batch = 20
+                split_limit = 10000
+                select_replica = False
+                probe_ttl = 600
+                keep_raw = True
+                dds_policy = all
+
+                [ESGFSearch.cache]
+                enable = False
+                file = ~/.cache/cmiputil/esgfsearch.sqlite
+                ttl = 86400
+                max_size = 256
+                offline = False
+
+                [ESGFSearch.catalog_cache]
+                enable = False
+                file = ~/.cache/cmiputil/catalog.sqlite
+                max_size = 64
 
                 [ESGFSearch.keywords]
                 replica = false
@@ -36,6 +36,21 @@ notation (see also 'Example' section below)::
     ds.tas  # Grid('tas, arrary=Var(tas, ...), maps={'time':..., 'lat':..., 'lon':...})
     ds.tas.array.arr[0]  # Arr('time', 8412)
 
+Size of data
+------------
+
+:class:`Var` and :class:`Grid` have ``shape`` and ``nbytes``, and
+:class:`Struct` has ``nbytes``, computed from *arr* and the size of
+*btype* in :data:`btype_nbytes`, so that you can estimate the size of
+data before any download::
+
+    ds.tas.shape    # (8412, 160, 320)
+    ds.tas.nbytes   # bytes of tas and its maps
+    ds.tas.hyperslabBytes({'time': slice(0, 12)})  # first 12 steps only
+
+Variables of *btype* without fixed size (``String`` and ``Url``) and
+:class:`Sequence` are not counted.
+
 
 .. _OpenDAP UserGuide: https://opendap.github.io/documentation/UserGuideComprehensive.html#DDS
 
@@ -222,6 +237,19 @@ class BType(enum.Enum):
     Url = 'Url'
 
 
+#: Bytes of one value of each :class:`BType`, ``None`` if not fixed.
+btype_nbytes = {
+    BType.Byte: 1,
+    BType.Int16: 2,
+    BType.Int32: 4,
+    BType.UInt32: 4,
+    BType.Float32: 4,
+    BType.Float64: 8,
+    BType.String: None,
+    BType.Url: None,
+}
+
+
 class SType(enum.Enum):
     """
     Values for :attr:`Struct.stype`
@@ -459,6 +487,21 @@ class Struct(Decl):
         """
         return self.text_formatted(indent=0, linebreak=False)
 
+    @property
+    def nbytes(self):
+        """
+        Bytes of data of all declarations.
+        """
+        return self.hyperslabBytes()
+
+    def hyperslabBytes(self, hyperslab=None):
+        """
+        Bytes of data of all declarations in `hyperslab`, see
+        :meth:`Var.hyperslabShape`.
+        """
+        return _sumBytes(d.hyperslabBytes(hyperslab)
+                         for d in (self.decl or {}).values())
+
 
 class Dataset(Struct):
     """
@@ -517,6 +560,12 @@ class Sequence(Struct):
         if text:
             super().__init__(text=text)
 
+    def hyperslabBytes(self, hyperslab=None):
+        """
+        Always ``None``, since the number of rows is not known by DDS.
+        """
+        return None
+
 
 class Grid(Struct):
     """
@@ -672,6 +721,36 @@ class Grid(Struct):
         """
         return self.text_formatted(indent=0, linebreak=False)
 
+    @property
+    def shape(self):
+        """
+        Shape of ARRAY, see :attr:`Var.shape`.
+        """
+        return self.array.shape
+
+    @property
+    def nbytes(self):
+        """
+        Bytes of data of ARRAY and MAPS.
+        """
+        return self.hyperslabBytes()
+
+    def hyperslabShape(self, hyperslab=None):
+        """
+        Shape of ARRAY in `hyperslab`, see :meth:`Var.hyperslabShape`.
+        """
+        return self.array.hyperslabShape(hyperslab)
+
+    def hyperslabBytes(self, hyperslab=None):
+        """
+        Bytes of data of ARRAY and MAPS in `hyperslab`, see
+        :meth:`Var.hyperslabShape`.  MAPS are selected by the same
+        `hyperslab`, as OPeNDAP servers do.
+        """
+        return _sumBytes(
+            [self.array.hyperslabBytes(hyperslab)] +
+            [d.hyperslabBytes(hyperslab) for d in (self.maps or {}).values()])
+
 
 class Var(Decl):
     """
@@ -784,6 +863,66 @@ class Var(Decl):
         """
         return self.text_formatted()
 
+    @property
+    def shape(self):
+        """
+        Lengths of dimensions, ``()`` for a scalar.
+        """
+        return self.hyperslabShape()
+
+    @property
+    def nbytes(self):
+        """
+        Bytes of data, ``None`` if the size of *btype* is not fixed.
+        """
+        return self.hyperslabBytes()
+
+    def hyperslabShape(self, hyperslab=None):
+        """
+        Lengths of dimensions in `hyperslab`.
+
+        Args:
+            hyperslab (dict): ``{dimension name: selection}``, where
+                selection is an index (int), a :class:`slice`, a tuple
+                of arguments of :class:`slice`, or a :class:`range`
+                clipped to the dimension.  Dimensions not in
+                `hyperslab` are selected entirely.
+
+        Returns:
+            tuple(int): shape
+
+        Examples:
+
+            >>> v = Var(text='Float32 tas[time = 8412][lat = 160][lon = 320];')
+            >>> v.shape
+            (8412, 160, 320)
+            >>> v.hyperslabShape({'time': slice(-12, None), 'lat': 0,
+            ...                   'lon': (0, 320, 2)})
+            (12, 1, 160)
+            >>> v.hyperslabBytes({'time': range(8400, 8424)})
+            2457600
+        """
+        hyperslab = hyperslab or {}
+        res = []
+        for a in _arrList(self.arr):
+            if a.name in hyperslab:
+                res.append(len(select_indices(hyperslab[a.name], a.val)))
+            else:
+                res.append(a.val)
+        return tuple(res)
+
+    def hyperslabBytes(self, hyperslab=None):
+        """
+        Bytes of data in `hyperslab`, see :meth:`.hyperslabShape`.
+        ``None`` if the size of *btype* is not fixed.
+        """
+        size = btype_nbytes.get(self.btype)
+        if size is None:
+            return None
+        for n in self.hyperslabShape(hyperslab):
+            size *= n
+        return size
+
 
 class Arr():
     """
@@ -1043,6 +1182,60 @@ def parse_arrdecls(text):
         return None
 
 
+def select_indices(sel, size):
+    """
+    Indices selected by `sel` along a dimension of length `size`.
+
+    Args:
+        sel: an index (int), a :class:`slice`, a tuple of arguments of
+             :class:`slice`, or a :class:`range`.
+        size (int): length of the dimension
+
+    Returns:
+        range: selected indices in ascending order, within the dimension.
+
+    Examples:
+        >>> select_indices(slice(-3, None), 10)
+        range(7, 10)
+        >>> select_indices((None, None, -4), 10)
+        range(1, 10, 4)
+        >>> select_indices(range(8, 14), 10)
+        range(8, 10)
+    """
+    if isinstance(sel, range):
+        if sel.step < 0:
+            sel = sel[::-1]
+        sel = sel[_firstIndex(sel, 0):_firstIndex(sel, size)]
+        return range(sel[0], sel[-1] + 1, sel.step) if sel else range(0)
+    if isinstance(sel, tuple):
+        sel = slice(*sel)
+    if isinstance(sel, slice):
+        return select_indices(range(*sel.indices(size)), size)
+    if isinstance(sel, int):
+        if sel < 0:
+            sel += size
+        return range(sel, sel + 1) if 0 <= sel < size else range(0)
+    raise TypeError(f'selection={sel} is invalid type: {type(sel)}')
+
+
+def _arrList(arr):
+    # `arr` of Var as a list.
+    if arr is None:
+        return []
+    return arr if type(arr) is list else [arr]
+
+
+def _firstIndex(r, x):
+    # Position of the first item >= `x` in range `r` of positive step.
+    k = -((r.start - x) // r.step)
+    return min(max(k, 0), len(r))
+
+
+def _sumBytes(values):
+    # Sum of bytes, ignoring None.
+    return sum(v for v in values if v is not None)
+
+
 # for debug use...
 _sample1 = '''
 Dataset {
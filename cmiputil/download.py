@@ -0,0 +1,577 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Parallel and resumable download of files of search results, via
+``HTTPServer`` of data nodes, into the local data store.
+
+:class:`Downloader` downloads files of
+:class:`esgfdatainfo.ESGFDataInfo` instances, given by their file
+records (``files`` attribute, see
+:meth:`esgfdatainfo.ESGFDataInfo.setFiles`), to the DRS directory of
+each dataset under `base_dir`, that is, where
+:meth:`esgfsearch.ESGFSearch.findLocalFiles` finds them.  Usually this
+is done by :meth:`esgfsearch.ESGFSearch.download`.
+
+Files are downloaded by ``max_workers`` threads in total, and at most
+``max_per_host`` files at once from one data node.  Waiting files are
+started round-robin over data nodes, so that a busy node does not
+delay the others.
+
+Each file is requested in chunks of ``chunk_size`` bytes by HTTP
+``Range`` requests, via `session` given to :class:`Downloader` (the
+shared :class:`session.Session` by default), so that timeouts, retries
+and rate limiting of the session apply to each chunk.  A chunk failing on the way is requested again from the byte
+where it stopped.
+
+Resuming and checksums
+----------------------
+
+A file is written to ``<filename>.part`` in the same directory first,
+and renamed to ``<filename>`` atomically when completed and verified,
+so that ``<filename>`` is never a broken one.  If the download is
+interrupted, ``<filename>.part`` is kept, and the next download
+resumes from its end.  Servers not supporting ``Range`` requests send
+the whole file instead.
+
+The checksum (``checksum_type`` of ``SHA256`` or ``MD5``) of the file
+record is computed while the file is written, and the file is
+discarded if it does not match.  Files already existing with the
+matching size and checksum are skipped, without any request.
+
+Report
+------
+
+:meth:`Downloader.download` returns a report, a dict as below:
+
+- ``files``: list of :data:`FileResult` of each file,
+- ``downloaded``, ``skipped``, ``failed``: number of files,
+- ``bytes``: bytes transferred,
+- ``seconds``: elapsed time,
+- ``throughput``: ``bytes`` per second,
+- ``hosts``: ``{host: {'files', 'bytes', 'seconds', 'throughput'}}``,
+  where ``seconds`` is from the start of the first file to the end of
+  the last file from that host.
+
+Requests are also recorded to :mod:`metrics`, as of stage
+``download``.
+
+Example:
+
+    >>> from cmiputil import esgfsearch, download
+    >>> es = esgfsearch.ESGFSearch()
+    >>> es.doSearch({'source_id': 'MIROC6', 'experiment_id': 'historical',
+    ...              'variable_id': 'tas', 'table_id': 'Amon',
+    ...              'variant_label': 'r1i1p1f1'}, stages=('search', 'files'))
+    >>> report = download.Downloader().download(es.datainfo, '/data')
+    >>> report['failed']
+    0
+
+Config File
+===========
+
+This module reads in config file, section below;
+
+- [Download]
+
+    ``max_workers`` (int):
+         maximum number of files downloaded at once
+
+    ``max_per_host`` (int):
+         maximum number of files downloaded at once from one host
+
+    ``chunk_size`` (int):
+         bytes requested by one ``Range`` request
+
+    ``verify`` (bool):
+         verify checksums of files, or not
+
+"""
+__author__ = 'T.Inoue'
+__credits__ = 'Copyright (c) 2019 RIST'
+__version__ = 'v20190714'
+__date__ = '2019/07/14'
+
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import deque, namedtuple
+from contextlib import contextmanager
+from pathlib import Path
+from pprint import pprint
+from urllib.parse import urlparse
+
+import urllib3
+
+from cmiputil import config, drs, metrics, session
+
+#: Default configuration of [Download] section.
+download_default = {
+    'max_workers': 4,
+    'max_per_host': 2,
+    'chunk_size': 16 * 1024 * 1024,
+    'verify': True,
+}
+
+#: Suffix of files being downloaded.
+part_suffix = '.part'
+
+#: File to be downloaded.
+#:
+#: - ``url`` (str): ``HTTPServer`` URL, ``None`` if not provided.
+#: - ``path`` (Path): destination
+#: - ``size`` (int): size in bytes, ``None`` if unknown.
+#: - ``checksum`` (str): checksum, ``None`` if unknown.
+#: - ``checksum_type`` (str): such as ``SHA256``
+DownloadTask = namedtuple('DownloadTask', ('url', 'path', 'size', 'checksum',
+                                           'checksum_type'))
+
+#: Result of one file.
+#:
+#: - ``url`` (str), ``path`` (Path): the same as :data:`DownloadTask`
+#: - ``status`` (str): ``downloaded``, ``skipped`` or ``failed``
+#: - ``bytes`` (int): bytes transferred
+#: - ``start``, ``end`` (float): by :func:`time.monotonic`
+#: - ``error`` (str): error message if failed, or ``None``.
+FileResult = namedtuple('FileResult', ('url', 'path', 'status', 'bytes',
+                                       'start', 'end', 'error'))
+
+#: Size of blocks to read responses and files.
+_read_size = 65536
+
+_content_range_pat = re.compile(r'bytes\s+(\d+)-(\d+)/(\d+|\*)')
+
+
+class DownloadError(Exception):
+    "Failed to download a file."
+    pass
+
+
+class Downloader():
+    """
+    Parallel and resumable downloader.
+
+    If `conf` is given, it must be a :class:`config.Conf` instance and
+    `conffile` is ignored.  Otherwise `conffile` is read, treated as
+    the same as :class:`config.Conf`.
+
+    Args:
+        conffile (path-like): config file
+        conf (config.Conf): config already read
+        session (session.Session): session of requests, ``None``
+                                   means the shared one.
+
+    Attributes:
+        session (session.Session): session of requests, or ``None``
+        max_workers (int): maximum number of files downloaded at once
+        max_per_host (int): maximum number of files downloaded at once
+                            from one host
+        chunk_size (int): bytes requested by one ``Range`` request
+        verify (bool): verify checksums of files, or not
+        base_dir (str): default root of the local data store, from
+                        ``cmip6_data_dir`` in config file.
+    """
+    _debug = False
+
+    @classmethod
+    def _enable_debug(cls):
+        cls._debug = True
+
+    @classmethod
+    def _disable_debug(cls):
+        cls._debug = True
+
+    def __init__(self, conffile="", conf=None, session=None):
+        if conf is None:
+            conf = config.Conf(conffile)
+        self.session = session
+
+        sect = 'Download'
+        d = download_default
+        self.max_workers = conf.getint(
+            sect, 'max_workers', fallback=d['max_workers'])
+        self.max_per_host = conf.getint(
+            sect, 'max_per_host', fallback=d['max_per_host'])
+        self.chunk_size = conf.getint(
+            sect, 'chunk_size', fallback=d['chunk_size'])
+        self.verify = conf.getboolean(sect, 'verify', fallback=d['verify'])
+        try:
+            self.base_dir = conf.commonSection['cmip6_data_dir']
+        except (KeyError, AttributeError):
+            self.base_dir = None
+
+        if self._debug:
+            print('dbg:Downloader():')
+            pprint({k: v for k, v in vars(self).items()
+                    if not k.startswith('_')})
+
+    def tasks(self, datainfo, base_dir=None):
+        """
+        Files to be downloaded for search results.
+
+        Files are placed in the DRS directory of each dataset under
+        `base_dir`, by :meth:`esgfdatainfo.ESGFDataInfo.drsLocation`,
+        or by :meth:`drs.DRS.dirName` if attributes are missing.  The
+        same file of several datasets, such as replicas, is downloaded
+        once.
+
+        Args:
+            datainfo (list(esgfdatainfo.ESGFDataInfo)): search results,
+                whose ``files`` are set.
+            base_dir (path-like): root of the local data store, ``None``
+                means :attr:`.base_dir`.
+
+        Returns:
+            list(DownloadTask): files
+
+        Raises:
+            ValueError: ``files`` of any of `datainfo` is not set.
+        """
+        if base_dir is None:
+            base_dir = self.base_dir
+        base_dir = Path(base_dir or '').expanduser()
+
+        res = {}
+        for dinfo in datainfo:
+            if not dinfo.isSet('files'):
+                raise ValueError('file records are not set: '
+                                 f'{dinfo.get("id")}')
+            loc = dinfo.drsLocation()
+            if loc is None:
+                dname = drs.DRS(**dinfo.managedAttribs).dirName(
+                    prefix=base_dir, allow_asterisk=False)
+            else:
+                dname = base_dir.joinpath(*loc[0])
+            for f in dinfo.files:
+                path = Path(dname, f['filename'])
+                if path not in res:
+                    res[path] = DownloadTask(f['http_url'], path, f['size'],
+                                             f['checksum'],
+                                             f['checksum_type'])
+        return list(res.values())
+
+    def download(self, datainfo, base_dir=None):
+        """
+        Download files of search results.
+
+        Failure of a file does not stop the others, see ``failed`` and
+        ``files`` of the report.
+
+        Args:
+            datainfo (list(esgfdatainfo.ESGFDataInfo)): search results,
+                whose ``files`` are set.
+            base_dir (path-like): root of the local data store, ``None``
+                means :attr:`.base_dir`.
+
+        Returns:
+            dict: report, see **Report** section above.
+        """
+        return self.fetch(self.tasks(datainfo, base_dir))
+
+    def fetch(self, tasks):
+        """
+        Download `tasks`, a list of :data:`DownloadTask`.
+
+        Returns:
+            dict: report, see **Report** section above.
+        """
+        t0 = time.monotonic()
+        results = _runPerHost(tasks, self._fetchOne, self.max_workers,
+                              self.max_per_host)
+        return report(results, time.monotonic() - t0)
+
+    def _fetchOne(self, task):
+        # Download one file, returns FileResult.
+        t0 = time.monotonic()
+        nbytes = [0]
+        try:
+            with metrics.stage('download'):
+                status = self._fetch(task, nbytes)
+            error = None
+        except Exception as e:
+            if self._debug:
+                print(f'dbg:Downloader._fetchOne():{task.url}:', e)
+            status, error = 'failed', str(e)
+        return FileResult(task.url, task.path, status, nbytes[0], t0,
+                          time.monotonic(), error)
+
+    def _fetch(self, task, nbytes):
+        # Download one file, counting bytes transferred in nbytes[0].
+        # Returns the status.
+        path = Path(task.path)
+        if path.exists() and self._matches(path, task):
+            return 'skipped'
+        if not task.url:
+            raise DownloadError(f'no HTTPServer URL: {path.name}')
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        part = _Part(path.with_name(path.name + part_suffix),
+                     lambda: self._hasher(task), nbytes)
+        size = task.size
+        failures = 0
+        with part.open(size):
+            while size is None or part.offset < size:
+                start = part.offset
+                try:
+                    size, whole = self._getChunk(task.url, part, size)
+                except urllib3.exceptions.HTTPError as e:
+                    # resumed from where it stopped.
+                    failures += 1
+                    if failures > self._getSession().retries:
+                        raise DownloadError(f'failed: {e}')
+                    continue
+                if whole:
+                    break
+                if part.offset == start:
+                    raise DownloadError(f'no data from {start} bytes')
+                failures = 0
+            offset = part.offset
+
+        if task.size is not None and offset != task.size:
+            raise DownloadError(f'size mismatch: {offset} != {task.size}')
+        if part.hasher is not None and (part.hasher.hexdigest().lower() !=
+                                        task.checksum.lower()):
+            part.path.unlink()
+            raise DownloadError(f'{task.checksum_type} mismatch')
+        os.replace(part.path, path)
+        return 'downloaded'
+
+    def _getSession(self):
+        # Session given to the constructor, or the shared one.
+        if self.session is None:
+            return session.getSession()
+        return self.session
+
+    def _getChunk(self, url, part, size):
+        # Request a chunk from the end of `part` and write it.  Returns
+        # the size of the file, and the whole file is sent or not.
+        offset = part.offset
+        end = offset + self.chunk_size - 1
+        if size is not None:
+            end = min(end, size - 1)
+        r = self._getSession().request(
+            'GET', url, headers={'Range': f'bytes={offset}-{end}'},
+            preload_content=False)
+        try:
+            whole = False
+            if r.status == 206:
+                crange = r.headers.get('Content-Range', '')
+                m = _content_range_pat.match(crange)
+                if not m or int(m.group(1)) != offset:
+                    raise DownloadError(f'invalid Content-Range: {crange}')
+                if m.group(3) != '*':
+                    size = int(m.group(3))
+            elif r.status == 200:
+                # Range is not supported, sent from the beginning.
+                whole = True
+                part.reset()
+            elif r.status == 416 and size is None:
+                return offset, True
+            else:
+                raise DownloadError(f'Bad Status: {r.status}')
+
+            for data in r.stream(_read_size):
+                part.write(data)
+        finally:
+            r.release_conn()
+        return (part.offset if whole else size), whole
+
+    def _hasher(self, task):
+        # hashlib object for the checksum of `task`, None if not
+        # verified.
+        if not (self.verify and task.checksum and task.checksum_type):
+            return None
+        try:
+            return hashlib.new(task.checksum_type.lower())
+        except ValueError:
+            if self._debug:
+                print(f'dbg:Downloader:unknown checksum_type:'
+                      f'{task.checksum_type}')
+            return None
+
+    def _matches(self, path, task):
+        # Existing file `path` is the same as `task` or not.
+        if task.size is not None and path.stat().st_size != task.size:
+            return False
+        hasher = self._hasher(task)
+        if hasher is None:
+            return task.size is not None
+        _hashFile(path, hasher)
+        return hasher.hexdigest().lower() == task.checksum.lower()
+
+
+class _Part():
+    # `<filename>.part` being downloaded, with the checksum computed
+    # as written.  Bytes written are counted in nbytes[0].
+
+    def __init__(self, path, new_hasher, nbytes):
+        self.path = path
+        self.hasher = new_hasher()
+        self._new_hasher = new_hasher
+        self._nbytes = nbytes
+        self._file = None
+
+    @contextmanager
+    def open(self, size):
+        # Open to append, or to write from the beginning if longer
+        # than `size`.
+        offset = self.path.stat().st_size if self.path.exists() else 0
+        if size is not None and offset > size:
+            offset = 0
+        if offset and self.hasher is not None:
+            _hashFile(self.path, self.hasher)
+        with open(self.path, 'r+b' if offset else 'wb') as self._file:
+            self._file.seek(offset)
+            yield self
+
+    @property
+    def offset(self):
+        return self._file.tell()
+
+    def write(self, data):
+        self._file.write(data)
+        self._nbytes[0] += len(data)
+        if self.hasher is not None:
+            self.hasher.update(data)
+
+    def reset(self):
+        # Discard written data.
+        self._file.seek(0)
+        self._file.truncate()
+        self.hasher = self._new_hasher()
+
+
+def report(results, seconds):
+    """
+    Summarize `results` of files downloaded in `seconds`.
+
+    Args:
+        results (list(FileResult)): results of files
+        seconds (float): elapsed time
+
+    Returns:
+        dict: report, see **Report** section above.
+
+    Example:
+
+        >>> res = [FileResult('http://a/1.nc', None, 'downloaded', 300, 0, 2, None),
+        ...        FileResult('http://a/2.nc', None, 'skipped', 0, 0, 0, None),
+        ...        FileResult('http://b/3.nc', None, 'downloaded', 100, 1, 2, None)]
+        >>> r = report(res, 2.0)
+        >>> r['downloaded'], r['bytes'], r['throughput']
+        (2, 400, 200.0)
+        >>> r['hosts']['b']
+        {'files': 1, 'bytes': 100, 'seconds': 1, 'throughput': 100.0}
+    """
+    res = {'files': list(results)}
+    for status in ('downloaded', 'skipped', 'failed'):
+        res[status] = sum(1 for r in results if r.status == status)
+    res['bytes'] = sum(r.bytes for r in results)
+    res['seconds'] = seconds
+    res['throughput'] = res['bytes'] / seconds if seconds > 0 else None
+
+    hosts = {}
+    for r in results:
+        if r.status == 'skipped':
+            continue
+        hosts.setdefault(_host(r.url), []).append(r)
+    res['hosts'] = {}
+    for host, rs in hosts.items():
+        nbytes = sum(r.bytes for r in rs)
+        span = max(r.end for r in rs) - min(r.start for r in rs)
+        res['hosts'][host] = {
+            'files': len(rs),
+            'bytes': nbytes,
+            'seconds': span,
+            'throughput': nbytes / span if span > 0 else None}
+    return res
+
+
+def _runPerHost(tasks, func, max_workers, max_per_host):
+    # Call `func` with each of `tasks` in `max_workers` threads, at
+    # most `max_per_host` at once for the same host, started
+    # round-robin over hosts.  Returns results in order of `tasks`.
+    queues = {}
+    for i, task in enumerate(tasks):
+        queues.setdefault(_host(task.url), deque()).append(i)
+    hosts = deque(queues)
+    active = dict.fromkeys(queues, 0)
+    results = [None] * len(tasks)
+    cond = threading.Condition()
+
+    def _next():
+        # index of the next task, None if no task is left.
+        with cond:
+            while hosts:
+                for n in range(len(hosts)):
+                    host = hosts[0]
+                    hosts.rotate(-1)
+                    if active[host] < max_per_host:
+                        i = queues[host].popleft()
+                        if not queues[host]:
+                            hosts.remove(host)
+                        active[host] += 1
+                        return i
+                cond.wait()
+            return None
+
+    def _worker():
+        while True:
+            i = _next()
+            if i is None:
+                return
+            try:
+                results[i] = func(tasks[i])
+            finally:
+                with cond:
+                    active[_host(tasks[i].url)] -= 1
+                    cond.notify_all()
+
+    workers = [threading.Thread(target=_worker)
+               for n in range(max(1, min(max_workers, len(tasks))))]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return results
+
+
+def _hashFile(path, hasher):
+    # Update `hasher` by contents of `path`.
+    with open(path, 'rb') as f:
+        for data in iter(lambda: f.read(_read_size), b''):
+            hasher.update(data)
+
+
+def _host(url):
+    # host (and port) of `url`, empty if None.
+    return urlparse(url or '').netloc
+
+
+def getDefaultConf():
+    """
+    Return default values for config file.
+
+    Intended to be called before :meth:`config.writeConf`
+
+    Example:
+        >>> from cmiputil import download, config
+        >>> conf = config.Conf(None)   #  to create brank config
+        >>> d = download.getDefaultConf()
+        >>> conf.read_dict(d)
+        >>> print(conf)
+        [Download]
+        max_workers = 4
+        max_per_host = 2
+        chunk_size = 16777216
+        verify = True
+        <BLANKLINE>
+        <BLANKLINE>
+    """
+    return {'Download': dict(download_default)}
+
+
+if (__name__ == '__main__'):
+    import doctest
+    doctest.testmod()
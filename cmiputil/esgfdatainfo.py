@@ -42,22 +42,130 @@ Example:
 Actually, doing search as above is done by
 :class:`esgfsearch.ESGFSearch`.
 
+Asynchronous API
+----------------
+
+:meth:`ESGFDataInfo.aresolve` and :meth:`ESGFDataInfo.aget_dds` are
+coroutines, counterparts of :meth:`ESGFDataInfo.getDataURL` and
+:meth:`ESGFDataInfo.getDDS` for `asyncio`_, via
+:meth:`session.Session.arequest` of the shared session.  They can be
+cancelled, and each request is limited by `timeout`, if given.
+
+.. _asyncio: https://docs.python.org/3/library/asyncio.html
+
+Catalog reader
+--------------
+
+OPeNDAP catalogs (THREDDS catalog XML) are read by a built-in reader,
+incrementally as the response arrives, keeping only services and
+datasets with ``urlPath``.  Services of each dataset are resolved,
+including compound and inherited ones, as `siphon`_ does.  If the
+reader fails to parse a catalog, :meth:`ESGFDataInfo.getDataURL` falls
+back to `siphon`_, if installed.
+
+.. _siphon: https://www.unidata.ucar.edu/software/siphon/
+
+Catalog cache
+-------------
+
+Since a version of CMIP6 dataset never changes, URLs obtained from its
+OPeNDAP catalog can be cached on disk, by :func:`setCatalogCache`,
+keyed by ``cat_url`` and ``version``.  Then :meth:`ESGFDataInfo.getDataURL`
+and :meth:`ESGFDataInfo.aresolve` of known datasets send no request.
+Entries never expire, but are evicted in the least recently used order
+if the total size exceeds the limit of the cache.  Use
+:meth:`ESGFDataInfo.invalidateCatalog` to remove the entry of one
+dataset.  The cache can also be given to each instance by
+`catalog_cache` of the constructor, as :class:`esgfsearch.ESGFSearch`
+does by ``[ESGFSearch.catalog_cache]`` section of config file.
+
+Network accesses
+----------------
+
+Requests are issued via `session` given to the constructor, and
+failures are recorded to `monitor`, see :mod:`replica`.  If not given,
+the shared ones, :func:`session.getSession` and
+:func:`replica.getMonitor`, are used.  :class:`esgfsearch.ESGFSearch`
+gives its own to search results, so that instances of it do not
+affect each other.
+
+DDS policy
+----------
+
+DDS of files of one dataset are almost the same, differ only in the
+length of the time dimension.  So :meth:`ESGFDataInfo.getDDS` and
+:meth:`ESGFDataInfo.aget_dds` request DDS according to `dds_policy`
+given to the constructor, one of :data:`dds_policies`:
+
+- ``all``: DDS of the aggregation and of every file are requested.
+- ``aggregate-only``: only DDS of the aggregation is requested, and
+  DDS of each file is inferred from it, by the ``time_range`` in the
+  filename.
+- ``first+last``: DDS of the aggregation, of the first and of the last
+  file are requested, and the others are inferred.
+
+Inferred DDS is a copy of the aggregation DDS, with the time dimension
+shortened to the number of time steps of the file, estimated from the
+``time_range`` of all files and the length of the aggregation.  Files
+whose DDS cannot be inferred, such as without ``time_range``, are
+requested.  Only files not requested by the policy are inferred; DDS
+of a file failed to be requested is left ``None``.
+
+DDS obtained are also memorized by URL in the dict `dds_memo` given to
+the constructor, so that the same DDS is not requested twice.
+:class:`esgfsearch.ESGFSearch` gives its own :attr:`dds_memo` to search
+results, and clears it at the start of
+:meth:`esgfsearch.ESGFSearch.resolve`.
+
+Replicas
+--------
+
+Other copies of the same dataset on other data nodes can be set by
+:meth:`ESGFDataInfo.setReplicas`, usually by
+:meth:`esgfsearch.ESGFSearch.selectReplicas`.  If accessing the
+OPeNDAP catalog fails, :meth:`ESGFDataInfo.getDataURL` and
+:meth:`ESGFDataInfo.aresolve` try replicas in turn, and ``cat_url``
+and ``data_node`` are replaced by those of the replica used.  See
+:mod:`replica`.
+
 """
+import asyncio
+import json
 import re
+import time
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
 from collections.abc import MutableMapping
+from datetime import date
 from pprint import pprint
+from urllib.parse import urljoin, urlparse
 
-import urllib3
-from siphon.catalog import TDSCatalog
-
-from cmiputil import drs, dds
+from cmiputil import cache, drs, dds, metrics, replica, session
 
 __author__ = 'T.Inoue'
 __credits__ = 'Copyright (c) 2019 RIST'
 __version__ = 'v20190619'
 __date__ = '2019/06/19'
 
-_http = None
+#: :class:`session.Session` instance that siphon is set up to use.
+_siphon_session = None
+
+#: :class:`cache.DiskCache` instance for catalogs, see :func:`setCatalogCache`.
+_catalog_cache = None
+
+#: Policies of requesting DDS, see :meth:`ESGFDataInfo.getDDS`.
+dds_policies = ('all', 'aggregate-only', 'first+last')
+
+#: Size of chunks to read OPeNDAP catalogs.
+_chunk_size = 65536
+
+#: <time_range> at the end of a filename.
+_time_range_pat = re.compile(r'_(\d{4,14})-(\d{4,14})(?:-clim)?\.nc$')
+
+
+class CatalogError(Exception):
+    "Failed to get or parse OPeNDAP catalog."
+    pass
 
 
 class ESGFDataInfo(MutableMapping):
@@ -71,13 +179,120 @@ class ESGFDataInfo(MutableMapping):
     Since this class inherits MutableMapping ABC, you can access an
     instance of this class as *mapping*, such as ``datainfo['source_id']``.
 
+    Attributes in :attr:`lazyAttribs` are resolved on first access, by
+    calling the corresponding method, so that you pay for network
+    access only when you use them.  The ``in`` operator and
+    :meth:`.get` do not resolve them.  `aggregate` and `base_dir` given
+    to the constructor are used as the default arguments of these
+    methods.
+
+    To hold many search results in memory, attributes in
+    :attr:`managedAttribNames` and :attr:`slotAttribNames` are kept in
+    slots, and the other fields of the search result are kept as
+    their original JSON text, decoded on first access to any of them.
+    If `keep_raw` given to the constructor is ``False``, they are
+    dropped.  Attributes set later other than these are kept in a
+    dict.
+
     Attributes:
         cat_url: URL of OPeNDAP catalog
         data_url: URL of dataset
+        agg_dds: DDS of aggregated dataset
+        mf_dds: DDS of each file of dataset
         local_files: Paths of local file corresponding to the search result.
+        files: file records obtained by file-level search, see
+               :meth:`.setFiles`
+        replicas: other copies of this dataset, see :meth:`.setReplicas`
+        estimated_bytes: estimated bytes of data, see
+                         :meth:`.estimateBytes`
     """
     _debug = False
 
+    #: Names of useful global attributes, see :attr:`managedAttribs`.
+    managedAttribNames = (
+        'data_node',
+        # 'dataset_id',
+        'id',
+        'instance_id',
+        'master_id',
+        'number_of_aggregations',
+        'number_of_files',
+        'title',
+        'type',
+        'url',
+        'version',
+        'mip_era',
+        'activity_drs',
+        'activity_id',
+        'institution_id',
+        'source_id',
+        'experiment_id',
+        'member_id',
+        'table_id',
+        'variable_id',
+        'variant_label',
+        'grid_label',
+        'sub_experiment_id'
+    )
+
+    #: Attributes set by search and by this class, other than
+    #: :attr:`managedAttribNames`, kept in slots.
+    slotAttribNames = (
+        'replica',
+        'latest',
+        'retracted',
+        'size',
+        'index_node',
+        '_timestamp',
+        'cat_url',
+        'data_url',
+        'agg_data_url',
+        'mf_data_url',
+        'files',
+        'agg_dds',
+        'mf_dds',
+        'local_files',
+    )
+
+    #: Private attributes, not visible as mapping, and their defaults.
+    _privateDefaults = {
+        '_aggregate': True,
+        '_base_dir': None,
+        '_keep_raw': True,
+        '_dds_policy': 'all',
+        '_replicas': (),
+        '_extra': None,
+        '_raw': None,
+        '_session': None,
+        '_monitor': None,
+        '_cat_cache': None,
+        '_dds_memo': None,
+    }
+
+    # Private attributes not pickled nor copied, shared with others.
+    _sharedAttribs = ('_session', '_monitor', '_cat_cache', '_dds_memo')
+
+    #: Private attributes, not visible as mapping.
+    _privateAttribs = frozenset(_privateDefaults)
+
+    # Slots are in alphabetical order, that is the order of fields in
+    # search results, to keep the order of mapping.
+    __slots__ = tuple(sorted(set(managedAttribNames + slotAttribNames))) + (
+        tuple(_privateDefaults))
+
+    # Names kept in slots, to tell them from methods and properties.
+    _slotNames = frozenset(__slots__)
+
+    #: Attributes resolved on first access, and the method to do so.
+    lazyAttribs = {
+        'data_url': 'getDataURL',
+        'agg_data_url': 'getDataURL',
+        'mf_data_url': 'getDataURL',
+        'agg_dds': 'getDDS',
+        'mf_dds': 'getDDS',
+        'local_files': 'findLocalFile',
+    }
+
     @classmethod
     def _enable_debug(cls):
         cls._debug = True
@@ -90,17 +305,49 @@ class ESGFDataInfo(MutableMapping):
     # def debug(cls):
     #     return cls._debug
 
-    def __init__(self, attribs={}):
+    def __init__(self, attribs={}, aggregate=None, base_dir=None,
+                 keep_raw=True, dds_policy=None, session=None,
+                 monitor=None, catalog_cache=None, dds_memo=None):
         """
         Args:
             attribs (dict): attributes to be set, see :meth:`.setFrom`:.
+            aggregate (bool): default for :meth:`.getDataURL`
+            base_dir (path-like): default for :meth:`.findLocalFile`
+            keep_raw (bool): keep fields of `attribs` not in slots, or
+                             drop them.
+            dds_policy (str): default for :meth:`.getDDS`
+            session (session.Session): session of requests, ``None``
+                means the shared one.
+            monitor (replica.NodeMonitor): failures of data nodes are
+                recorded to, ``None`` means the shared one.
+            catalog_cache (cache.DiskCache): cache of catalogs, ``None``
+                means the one set by :func:`setCatalogCache`, and
+                ``False`` disables it.
+            dds_memo (dict): DDS obtained are memorized to, keyed by
+                URL, ``None`` means not memorized.
 
         """
+        if aggregate is not None:
+            self._aggregate = aggregate
+        if session is not None:
+            self._session = session
+        if monitor is not None:
+            self._monitor = monitor
+        if catalog_cache is not None:
+            self._cat_cache = catalog_cache
+        if dds_memo is not None:
+            self._dds_memo = dds_memo
+        if base_dir is not None:
+            self._base_dir = base_dir
+        if dds_policy is not None:
+            self._dds_policy = dds_policy
+        if not keep_raw:
+            self._keep_raw = False
         self.setFrom(attribs)
 
         if self._debug:
             print('dbg:ESGFDataInfo.__init__():')
-            pprint(vars(self))
+            pprint(dict(self))
 
     def setFrom(self, attribs):
         """
@@ -109,13 +356,17 @@ class ESGFDataInfo(MutableMapping):
         Args:
             attribs (dict): attributes to be set.
 
+        Fields not in slots are kept as JSON text, or dropped, see
+        above.
         """
-        # flatten list, except `url`
+        rest = {}
         for a, v in attribs.items():
-            if type(v) is list and len(v) == 1:
-                if (a != 'url'):
-                    v = v[0]
-            setattr(self, a, v)
+            if a in self._slotNames and a not in self._privateAttribs:
+                setattr(self, a, _flatten(a, v))
+            elif self._keep_raw:
+                rest[a] = v
+        if rest:
+            self._setRest(rest)
 
         # extract THREDDS URL
         # if hasattr(self, 'url'):
@@ -137,68 +388,240 @@ class ESGFDataInfo(MutableMapping):
     @property
     def managedAttribs(self):
         """dict of useful global attributes."""
-        attributes = [
-            'data_node',
-            # 'dataset_id',
-            'id',
-            'instance_id',
-            'master_id',
-            'number_of_aggregations',
-            'number_of_files',
-            'title',
-            'type',
-            'url',
-            'version',
-            'mip_era',
-            'activity_drs',
-            'activity_id',
-            'institution_id',
-            'source_id',
-            'experiment_id',
-            'member_id',
-            'table_id',
-            'variable_id',
-            'variant_label',
-            'grid_label',
-            'sub_experiment_id'
-        ]
-
-        return {a: self[a] for a in attributes if a in self}
-
-    def getDataURL(self, aggregate):
+        return {a: self[a] for a in self.managedAttribNames if a in self}
+
+    def isSet(self, key):
+        """
+        Return ``True`` if attribute `key` is set, without resolving
+        lazy attributes.
+        """
+        if key in self._slotNames:
+            try:
+                object.__getattribute__(self, key)
+            except AttributeError:
+                return False
+            return True
+        return key in (self._extras() or {})
+
+    def _setRest(self, rest):
+        # Keep fields `rest` not in slots as JSON text, if possible.
+        if self._raw is None and self._extra is None:
+            try:
+                self._raw = json.dumps(rest, separators=(',', ':')).encode()
+                return
+            except (TypeError, ValueError):
+                pass
+        for a, v in rest.items():
+            setattr(self, a, _flatten(a, v))
+
+    def _extras(self):
+        # dict of attributes not in slots, decoding JSON text if any.
+        extra = self._extra
+        if self._raw is not None:
+            decoded = {a: _flatten(a, v)
+                       for a, v in json.loads(self._raw.decode()).items()}
+            decoded.update(extra or {})
+            extra = decoded
+            object.__setattr__(self, '_extra', extra)
+            object.__setattr__(self, '_raw', None)
+        return extra
+
+    def getDataURL(self, aggregate=None):
         """
         Get URL(s) of dataset by accessing the OPeNDAP Catalog.
 
-        Results are set as :attr:`.data_url`
+        Results are set as :attr:`.data_url`, ``agg_data_url`` and
+        ``mf_data_url``.
 
         Args:
             aggregate (bool): retrieve aggregated dataset, or not.
+                If ``None``, `aggregate` given to the constructor.
         """
-        try:
-            cat = TDSCatalog(self.cat_url)
-        except Exception as e:
-            print('Error in siphon.TDSCatalog():', e.args)
-            raise
+        if aggregate is None:
+            aggregate = self._aggregate
+        error = None
+        catalog_cache = self._catalogCache()
+        sess = self._getSession()
+        for dinfo in self._copies():
+            urls = _cachedCatalog(catalog_cache, dinfo, sess)
+            if urls is not None:
+                break
+            try:
+                with metrics.stage('catalog'):
+                    urls = _readCatalog(dinfo.cat_url, sess)
+            except Exception as e:
+                print('Error in reading catalog:', e.args)
+                self._getMonitor().fail(dinfo.get('data_node'))
+                error = error or e
+                continue
+            _storeCatalog(catalog_cache, dinfo, urls)
+            break
+        else:
+            raise error
+
+        self._useCopy(dinfo)
+        self._setDataURL(urls[0], urls[1], aggregate)
+
+    async def aresolve(self, aggregate=None, timeout=None):
+        """
+        Get URL(s) of dataset by accessing the OPeNDAP Catalog,
+        asynchronously.
+
+        This is a coroutine, counterpart of :meth:`.getDataURL`.
+
+        Args:
+            aggregate (bool): retrieve aggregated dataset, or not.
+                If ``None``, `aggregate` given to the constructor.
+            timeout (float): timeout in seconds of the request.
+
+        Raises:
+            CatalogError: failed to get the catalog.
+
+        Replicas are tried in turn as :meth:`.getDataURL`, but timeout
+        is not recovered by replicas.
+        """
+        if aggregate is None:
+            aggregate = self._aggregate
+        error = None
+        catalog_cache = self._catalogCache()
+        sess = self._getSession()
+        for dinfo in self._copies():
+            urls = _cachedCatalog(catalog_cache, dinfo, sess)
+            if urls is not None:
+                break
+            try:
+                with metrics.stage('catalog'):
+                    r = await sess.arequest(
+                        'GET', dinfo.cat_url, timeout=timeout)
+                if (r.status != 200):
+                    print('Bad Status:', r.status)
+                    raise CatalogError(f'status {r.status}: {dinfo.cat_url}')
+                urls = _parseCatalog(r.data, dinfo.cat_url)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                raise
+            except Exception as e:
+                self._getMonitor().fail(dinfo.get('data_node'))
+                error = error or e
+                continue
+            _storeCatalog(catalog_cache, dinfo, urls)
+            break
+        else:
+            raise error
+
+        self._useCopy(dinfo)
+        self._setDataURL(urls[0], urls[1], aggregate)
+
+    def setReplicas(self, replicas):
+        """
+        Set other copies of this dataset on other data nodes, tried in
+        turn if accessing the OPeNDAP catalog fails.
+
+        Args:
+            replicas (list(ESGFDataInfo)): copies, in order of
+                                            preference.
+        """
+        self._replicas = tuple(replicas)
+
+    @property
+    def replicas(self):
+        """Other copies of this dataset, see :meth:`.setReplicas`."""
+        return list(self._replicas)
+
+    def invalidateCatalog(self):
+        """
+        Remove cached URLs of this dataset and its replicas from the
+        catalog cache, see **Catalog cache** section above.
+
+        URLs already set to this instance are kept.
+        """
+        catalog_cache = self._catalogCache()
+        if catalog_cache is None:
+            return
+        for dinfo in self._copies():
+            key = _catalogKey(dinfo)
+            if key is not None:
+                catalog_cache.invalidate(key)
+
+    def _getSession(self):
+        # Session given to the constructor, or the shared one.
+        if self._session is None:
+            return session.getSession()
+        return self._session
 
-        self.agg_data_url = (cat.base_tds_url + _getServiceBase(cat.services) +
-                             cat.datasets[-1].url_path)  # Is this universal ?
+    def _getMonitor(self):
+        # NodeMonitor given to the constructor, or the shared one.
+        if self._monitor is None:
+            return replica.getMonitor()
+        return self._monitor
 
-        self.mf_data_url = [
-            x.access_urls['OpenDAPServer'] for x in cat.datasets.values()
-            if 'OpenDAPServer' in x.access_urls
-        ]
-        self.mf_data_url.sort()
+    def _catalogCache(self):
+        # Catalog cache given to the constructor, or the one set by
+        # setCatalogCache(), None if disabled.
+        if self._cat_cache is None:
+            return _catalog_cache
+        if self._cat_cache is False:
+            return None
+        return self._cat_cache
+
+    def _copies(self):
+        # This and replicas, in order to be tried.
+        return (self,) + self._replicas
+
+    def _useCopy(self, dinfo):
+        # Take location of the copy `dinfo` the catalog is obtained from.
+        if dinfo is self:
+            return
+        self.cat_url = dinfo.cat_url
+        if 'data_node' in dinfo:
+            self.data_node = dinfo.data_node
+
+    def _setDataURL(self, agg_data_url, mf_data_url, aggregate):
+        self.agg_data_url = agg_data_url
+        self.mf_data_url = sorted(mf_data_url)
 
         if aggregate:
             self.data_url = self.agg_data_url
         else:
             self.data_url = self.mf_data_url
 
-    def getDDS(self):
+    def setFiles(self, docs):
+        """
+        Set file records from results of file-level search (with
+        ``type=File``), done by :meth:`esgfsearch.ESGFSearch.searchFiles`.
+
+        Results are set as ``files``, a list of dict sorted by
+        ``filename``, and ``mf_data_url``.  If `aggregate` given to the
+        constructor is ``False``, :attr:`.data_url` is also set.
+
+        Args:
+            docs (list(dict)): search results of files in this dataset.
+
+        Each of ``files`` has keys ``filename``, ``size``,
+        ``checksum``, ``checksum_type``, ``opendap_url`` and
+        ``http_url``.  URLs not provided are ``None``.
+        """
+        self.files = sorted((_fileRecord(doc) for doc in docs),
+                            key=lambda f: f['filename'] or '')
+        self.mf_data_url = sorted(
+            f['opendap_url'] for f in self.files if f['opendap_url'])
+        if not self._aggregate:
+            self.data_url = self.mf_data_url
+
+    def getDDS(self, policy=None):
         """
         Get OPeNDAP DDS (Dataset Descriptor Structure).
 
-        Must be called after :meth:`.getDataURL`.
+        Results are set as ``agg_dds`` and ``mf_dds``.  If
+        :meth:`.getDataURL` has not been called, it is called
+        implicitly.
+
+        Args:
+            policy (str): one of :data:`dds_policies`, see **DDS
+                policy** section above.  If ``None``, `dds_policy`
+                given to the constructor.
+
+        Raises:
+            ValueError: invalid `policy` is given.
 
         Example of DDS::
 
@@ -222,29 +645,295 @@ class ESGFDataInfo(MutableMapping):
 
 
         """
-        self.agg_dds = _getDDS(self.agg_data_url)
+        policy = self._ddsPolicy(policy)
+        sess = self._getSession()
+        memo = self._dds_memo
+        agg_dds = _getDDS(self.agg_data_url, sess, memo)
+        got = {url: _getDDS(url, sess, memo)
+               for url in self._ddsTargets(policy)}
+        mf_dds = _inferDDS(agg_dds, self.mf_data_url, got)
+        mf_dds = [_getDDS(url, sess, memo)
+                  if (d is None and url not in got) else d
+                  for url, d in zip(self.mf_data_url, mf_dds)]
+
+        self.agg_dds = agg_dds
+        self.mf_dds = mf_dds
+
+    async def aget_dds(self, timeout=None, policy=None):
+        """
+        Get OPeNDAP DDS asynchronously.
+
+        This is a coroutine, counterpart of :meth:`.getDDS`.  DDS of
+        the aggregation and of files by the policy are requested
+        concurrently.  If URLs are not obtained yet, :meth:`.aresolve`
+        is awaited first.
+
+        Args:
+            timeout (float): timeout in seconds of each request.
+            policy (str): the same as :meth:`.getDDS`
+        """
+        policy = self._ddsPolicy(policy)
+        if not self.isSet('agg_data_url'):
+            await self.aresolve(timeout=timeout)
+
+        targets = self._ddsTargets(policy)
+        urls = [self.agg_data_url] + targets
+        sess = self._getSession()
+        memo = self._dds_memo
+        res = await asyncio.gather(*(_agetDDS(url, sess, memo, timeout)
+                                     for url in urls))
+        got = dict(zip(targets, res[1:]))
+        mf_dds = _inferDDS(res[0], self.mf_data_url, got)
+
+        rest = [url for url, d in zip(self.mf_data_url, mf_dds)
+                if d is None and url not in got]
+        got = dict(zip(rest, await asyncio.gather(
+            *(_agetDDS(url, sess, memo, timeout) for url in rest))))
+        self.agg_dds = res[0]
+        self.mf_dds = [got[url] if url in got else d
+                       for url, d in zip(self.mf_data_url, mf_dds)]
+
+    def _ddsPolicy(self, policy):
+        # Check `policy` of DDS, None means the default.
+        if policy is None:
+            policy = self._dds_policy
+        if policy not in dds_policies:
+            raise ValueError(f'invalid DDS policy: "{policy}"')
+        return policy
+
+    def _ddsTargets(self, policy):
+        # URLs of files whose DDS are requested by `policy`.
+        urls = list(self.mf_data_url)
+        if policy == 'all':
+            return urls
+        elif policy == 'first+last':
+            return list(dict.fromkeys(urls[:1] + urls[-1:]))
+        return []
+
+    def estimateBytes(self, aggregate=None, variables=None, hyperslab=None):
+        """
+        Estimate bytes of data to be transferred via OPeNDAP, from
+        DDS, before any download.
+
+        If DDS has not been obtained, :meth:`.getDDS` is called
+        implicitly.
+
+        Args:
+            aggregate (bool): estimate from DDS of the aggregation, or
+                the sum of DDS of each file.  If ``None``, `aggregate`
+                given to the constructor.
+            variables (list(str)): names of variables to be requested,
+                ``None`` means all of them.
+            hyperslab (dict): ``{dimension name: selection}`` to be
+                requested, see :meth:`dds.Var.hyperslabShape`.  For
+                files, selection of ``time`` is of the aggregation,
+                that is, of files concatenated in order.
 
-        self.mf_dds = [_getDDS(url) for url in self.mf_data_url]
+        Returns:
+            int: estimated bytes, not including variables of
+            ``String`` and ``Url``, files without DDS, and the
+            overhead of the protocol.
+
+        Example:
+
+            >>> d = ESGFDataInfo({'id': 'a|node'})
+            >>> d.agg_dds = dds.parse_dataset(
+            ...     'Dataset { Float32 tas[time = 120][lat = 10]; } a;')
+            >>> d.estimateBytes(aggregate=True)
+            4800
+            >>> d.estimateBytes(aggregate=True, hyperslab={'time': 0})
+            40
+        """
+        if aggregate is None:
+            aggregate = self._aggregate
+        if aggregate:
+            return _estimateBytes(self.agg_dds, variables, hyperslab)
+
+        hyperslab = dict(hyperslab or {})
+        sel = hyperslab.pop('time', None)
+        mf_dds = [d for d in self.mf_dds if d is not None]
+        if sel is not None:
+            sel = dds.select_indices(
+                sel, sum(_timeLength(d) or 0 for d in mf_dds))
+        res = 0
+        offset = 0
+        for d in mf_dds:
+            if sel is not None:
+                # indices of this file, clipped by dds.
+                hyperslab['time'] = range(sel.start - offset,
+                                          sel.stop - offset, sel.step)
+            res += _estimateBytes(d, variables, hyperslab)
+            offset += _timeLength(d) or 0
+        return res
+
+    @property
+    def estimated_bytes(self):
+        """
+        Estimated bytes of all data of this dataset, by
+        :meth:`.estimateBytes` with default arguments.
+        """
+        return self.estimateBytes()
 
-    def findLocalFile(self, base_dir):
+    def findLocalFile(self, base_dir=None):
         """
         Find local (pre-downloaded) files corresponds to the search
         result.
 
+        Results are set as ``local_files``.
+
         See **Local data store** section in :mod:`esgfsearch`.
 
+        Args:
+            base_dir (path-like): root of the local data store.
+                If ``None``, `base_dir` given to the constructor.
+        """
+        if base_dir is None:
+            base_dir = self._base_dir
+
+        t0 = time.monotonic()
+        try:
+            d = drs.DRS(**self.managedAttribs)
+            dname = d.dirName(prefix=base_dir)
+            fname = str(d.fileName())
+            self.local_files = list(dname.glob(fname))
+        except Exception:
+            self._getSession().getMetrics().record(
+                'local', 'local', time.monotonic() - t0, error=True)
+            raise
+        self._getSession().getMetrics().record('local', 'local',
+                                               time.monotonic() - t0)
+
+    def drsLocation(self):
         """
+        DRS directory of files of this dataset, and the pattern of
+        their filenames, from attributes, without validation by
+        :class:`drs.DRS`.
 
-        d = drs.DRS(**self.managedAttribs)
-        dname = d.dirName(prefix=base_dir)
-        fname = str(d.fileName())
-        self.local_files = list(dname.glob(fname))
+        The first one of multi-valued attributes is used, as
+        :class:`drs.DRS` does, and ``activity_drs`` is preferred to
+        ``activity_id``.
+
+        Returns:
+            tuple: ``(directory, pattern)``, where ``directory`` is a
+            tuple of its components (str) and ``pattern`` is for
+            :func:`fnmatch.fnmatchcase`.  ``None`` if attributes
+            necessary are missing.
+
+        Example:
+
+            >>> d = ESGFDataInfo({
+            ...     'mip_era': 'CMIP6', 'activity_drs': ['CMIP'],
+            ...     'institution_id': 'MIROC', 'source_id': 'MIROC6',
+            ...     'experiment_id': 'historical', 'variant_label': 'r1i1p1f1',
+            ...     'table_id': 'Amon', 'variable_id': 'tas',
+            ...     'grid_label': 'gn', 'version': 'v20181212'})
+            >>> dname, pattern = d.drsLocation()
+            >>> '/'.join(dname)
+            'CMIP6/CMIP/MIROC/MIROC6/historical/r1i1p1f1/Amon/tas/gn/v20181212'
+            >>> pattern
+            'tas_Amon_MIROC6_historical_r1i1p1f1_gn_*.nc'
+        """
+        def _get(attr):
+            v = self.get(attr)
+            if type(v) is list:
+                v = v[0] if v else None
+            return v
+
+        attrs = {a: _get(a) for a in drs.DRS.dirnameAttribs}
+        attrs['activity_id'] = _get('activity_drs') or attrs['activity_id']
+        if not attrs['member_id']:
+            variant, subexp = _get('variant_label'), _get('sub_experiment_id')
+            if variant and subexp and subexp != 'none':
+                attrs['member_id'] = f'{subexp}-{variant}'
+            else:
+                attrs['member_id'] = variant
+        if not all(attrs.values()):
+            return None
+        dname = tuple(attrs[a] for a in drs.DRS.dirnameAttribs)
+        fname = '_'.join(attrs[a] for a in drs.DRS.filenameAttribs)
+        if attrs['table_id'] == 'fx':
+            return dname, fname + '.nc'
+        return dname, fname + '_*.nc'
+
+    def __getattr__(self, key):
+        # Called only if `key` is not set yet, return defaults of
+        # private attributes, attributes not in slots, or resolve lazy
+        # attributes.
+        try:
+            return self._privateDefaults[key]
+        except KeyError:
+            pass
+        if key.startswith('__'):
+            raise AttributeError(key)
+        extra = self._extras()
+        if extra and key in extra:
+            return extra[key]
+        try:
+            method = self.lazyAttribs[key]
+        except KeyError:
+            raise AttributeError(
+                f"'{self.__class__.__name__}' object has no attribute '{key}'")
+        if self._debug:
+            print(f'dbg:ESGFDataInfo:resolving {key} by {method}()')
+        getattr(self, method)()
+        return object.__getattribute__(self, key)
+
+    def __setattr__(self, key, value):
+        if key in self._slotNames:
+            object.__setattr__(self, key, value)
+        else:
+            extra = self._extras()
+            if extra is None:
+                extra = {}
+                object.__setattr__(self, '_extra', extra)
+            extra[key] = value
+
+    def __delattr__(self, key):
+        if key in self._slotNames:
+            object.__delattr__(self, key)
+        else:
+            try:
+                del (self._extras() or {})[key]
+            except KeyError:
+                raise AttributeError(key)
+
+    def __getstate__(self):
+        # For pickle and copy, without resolving lazy attributes.  A
+        # copy uses the shared session, monitor and catalog cache, and
+        # no DDS memo.
+        return {k: object.__getattribute__(self, k)
+                for k in ESGFDataInfo.__slots__
+                if k not in self._sharedAttribs and self.isSet(k)}
+
+    def __setstate__(self, state):
+        for k, v in state.items():
+            object.__setattr__(self, k, v)
 
     def __getitem__(self, key):
-        if hasattr(self, key):
-            return getattr(self, key)
+        if key in self._slotNames:
+            if key not in self._privateAttribs:
+                try:
+                    return getattr(self, key)
+                except AttributeError:
+                    pass
         else:
-            raise KeyError(key)
+            extra = self._extras()
+            if extra and key in extra:
+                return extra[key]
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        # Without resolving lazy attributes.
+        return key not in self._privateAttribs and self.isSet(key)
+
+    def get(self, key, default=None):
+        """
+        Return the value for `key` if set, else `default`.  Attributes
+        in :attr:`lazyAttribs` are not resolved.
+        """
+        if key in self:
+            return self[key]
+        return default
 
     def __setitem__(self, key, value):
         if type(key) == str:
@@ -253,7 +942,7 @@ class ESGFDataInfo(MutableMapping):
             raise TypeError(key, type(key))
 
     def __delitem__(self, key):
-        if hasattr(self, key):
+        if key in self:
             delattr(self, key)
         else:
             raise KeyError(key)
@@ -262,14 +951,271 @@ class ESGFDataInfo(MutableMapping):
         raise NotImplementedError
 
     def __iter__(self):
-        return self.__dict__.__iter__()
+        slots = [k for k in ESGFDataInfo.__slots__
+                 if k not in self._privateAttribs and self.isSet(k)]
+        return iter(slots + list(self._extras() or {}))
 
     def __str__(self):
-        res = {k: getattr(self, k) for k in self.__dict__}
+        res = {k: getattr(self, k) for k in self}
         return str(res)
 
     def __len__(self):
-        return len(self.__dict__)
+        return sum(1 for k in self)
+
+
+def _flatten(attr, value):
+    # Flatten list of one element, except `url`.
+    if type(value) is list and len(value) == 1 and attr != 'url':
+        return value[0]
+    return value
+
+
+def _fileRecord(doc):
+    # Make a file record from one result of file-level search.
+    def _first(v):
+        return v[0] if (type(v) is list and v) else v
+
+    size = _first(doc.get('size'))
+    res = {
+        'filename': _first(doc.get('title')),
+        'size': None if size is None else int(size),
+        'checksum': _first(doc.get('checksum')),
+        'checksum_type': _first(doc.get('checksum_type')),
+        'opendap_url': None,
+        'http_url': None,
+    }
+    for l in doc.get('url', []):
+        (url, mime, service) = l.split('|')
+        if (service == 'OPENDAP'):
+            # URL of OPeNDAP html form, strip it.
+            res['opendap_url'] = re.sub(r'\.html$', '', url)
+        elif (service == 'HTTPServer'):
+            res['http_url'] = url
+    return res
+
+
+def setCatalogCache(catalog_cache):
+    """
+    Set :class:`cache.DiskCache` instance to cache URLs obtained from
+    OPeNDAP catalogs, ``None`` to disable.
+
+    Entries of the cache should not expire, that is, ``ttl`` of
+    `catalog_cache` should be ``None``.
+    """
+    global _catalog_cache
+    _catalog_cache = catalog_cache
+
+
+def getCatalogCache():
+    """
+    Return :class:`cache.DiskCache` instance set by
+    :func:`setCatalogCache`, or ``None``.
+    """
+    return _catalog_cache
+
+
+def _catalogKey(dinfo):
+    # Key of the catalog cache, None if not cacheable.
+    version = dinfo.get('version')
+    if not version or 'cat_url' not in dinfo:
+        return None
+    return cache.makeKey(dinfo.cat_url, {'version': version})
+
+
+def _cachedCatalog(catalog_cache, dinfo, sess):
+    # URLs of `dinfo` from `catalog_cache`, as
+    # (agg_data_url, mf_data_url, service_base), or None.  A hit is
+    # recorded to metrics of session `sess`.
+    if catalog_cache is None:
+        return None
+    key = _catalogKey(dinfo)
+    if key is None:
+        return None
+    data = catalog_cache.get(key)
+    if data is None:
+        return None
+    sess.getMetrics().record('catalog', urlparse(dinfo.cat_url).netloc,
+                             nbytes=len(data), cache_hit=True)
+    d = json.loads(data.decode())
+    return d['agg_data_url'], d['mf_data_url'], d['service_base']
+
+
+def _storeCatalog(catalog_cache, dinfo, urls):
+    # Store URLs of `dinfo` obtained from the catalog to `catalog_cache`.
+    if catalog_cache is None:
+        return
+    key = _catalogKey(dinfo)
+    if key is None:
+        return
+    agg_data_url, mf_data_url, service_base = urls
+    catalog_cache.put(key, json.dumps(
+        {'agg_data_url': agg_data_url, 'mf_data_url': mf_data_url,
+         'service_base': service_base}).encode())
+
+
+def _readCatalog(url, sess):
+    # Get URLs of the aggregation and of each file, and the base URL
+    # of OPeNDAP service, by _CatalogReader via session `sess`, or by
+    # siphon if failed to parse and siphon is installed.
+    r = sess.request('GET', url, preload_content=False)
+    try:
+        if (r.status != 200):
+            print('Bad Status:', r.status)
+            raise CatalogError(f'status {r.status}: {url}')
+        reader = _CatalogReader(url)
+        try:
+            for chunk in r.stream(_chunk_size):
+                reader.feed(chunk)
+            return reader.close()
+        except CatalogError as e:
+            if _importSiphon() is None:
+                raise
+            print('Falling back to siphon:', e.args)
+    finally:
+        r.release_conn()
+    return _siphonCatalog(url, sess)
+
+
+def _parseCatalog(data, url):
+    # Get URLs of the aggregation and of each file, and the base URL
+    # of OPeNDAP service, from THREDDS catalog XML `data`, obtained
+    # from `url`.
+    reader = _CatalogReader(url)
+    reader.feed(data)
+    return reader.close()
+
+
+class _CatalogReader():
+    # Incremental reader of THREDDS catalog XML obtained from `url`.
+    # Feed chunks of XML by feed(), then get URLs of the aggregation
+    # and of each file, and the base URL of OPeNDAP service by close().
+
+    def __init__(self, url):
+        self.url = url
+        self._parser = ET.XMLPullParser(events=('start', 'end'))
+        self._services = {}       # name -> (type, base, [children])
+        self._service_stack = []
+        self._datasets = []       # frames of datasets with urlPath
+        self._dataset_stack = []  # frames of datasets being read
+        self._inherited = False   # in <metadata inherited="true">
+        self._first_opendap = None
+
+    def feed(self, data):
+        try:
+            self._parser.feed(data)
+        except ET.ParseError as e:
+            raise CatalogError(f'invalid catalog: {self.url}: {e}')
+        self._read()
+
+    def close(self):
+        try:
+            self._parser.close()
+        except ET.ParseError as e:
+            raise CatalogError(f'invalid catalog: {self.url}: {e}')
+        self._read()
+        return self._result()
+
+    def _read(self):
+        for event, el in self._parser.read_events():
+            tag = el.tag.rsplit('}', 1)[-1]
+            if event == 'start':
+                self._start(tag, el)
+            else:
+                self._end(tag, el)
+
+    def _start(self, tag, el):
+        if tag == 'service':
+            name = el.get('name')
+            stype = el.get('serviceType', '').lower()
+            self._services[name] = (stype, el.get('base', ''), [])
+            if self._service_stack:
+                self._services[self._service_stack[-1]][2].append(name)
+            self._service_stack.append(name)
+            if stype == 'opendap' and self._first_opendap is None:
+                self._first_opendap = el.get('base', '')
+        elif tag == 'dataset':
+            parent = self._dataset_stack[-1] if self._dataset_stack else {}
+            frame = {'path': el.get('urlPath'),
+                     'service': el.get('serviceName'),
+                     'inherited': parent.get('inherited')}
+            self._dataset_stack.append(frame)
+            if frame['path']:
+                self._datasets.append(frame)
+        elif tag == 'access' and self._dataset_stack:
+            frame = self._dataset_stack[-1]
+            if frame['path'] is None and el.get('urlPath'):
+                frame['path'] = el.get('urlPath')
+                self._datasets.append(frame)
+            if el.get('serviceName') and el.get('urlPath') == frame['path']:
+                frame['service'] = el.get('serviceName')
+        elif tag == 'metadata':
+            self._inherited = (el.get('inherited') == 'true')
+
+    def _end(self, tag, el):
+        if tag == 'service':
+            self._service_stack.pop()
+        elif tag == 'serviceName' and self._dataset_stack:
+            frame = self._dataset_stack[-1]
+            name = (el.text or '').strip()
+            if self._inherited:
+                frame['inherited'] = name
+            elif frame['service'] is None:
+                frame['service'] = name
+        elif tag == 'metadata':
+            self._inherited = False
+        elif tag == 'dataset':
+            self._dataset_stack.pop()
+            el.clear()
+        elif tag == 'property':
+            el.clear()
+
+    def _opendapBase(self, name, depth=0):
+        # Base of OPeNDAP service in service `name`, or None.
+        if name not in self._services or depth > 8:
+            return None
+        stype, base, children = self._services[name]
+        if stype == 'opendap':
+            return base
+        for child in children:
+            res = self._opendapBase(child, depth + 1)
+            if res is not None:
+                return res
+        return None
+
+    def _result(self):
+        if self._first_opendap is None or not self._datasets:
+            raise CatalogError(f'no OPeNDAP dataset in catalog: {self.url}')
+        u = urlparse(self.url)
+        server = u.scheme + '://' + u.netloc
+        service_base = urljoin(server, self._first_opendap)
+
+        agg_data_url = service_base + self._datasets[-1]['path']
+        mf_data_url = []
+        for frame in self._datasets:
+            if not frame['path'].endswith('.nc'):
+                continue
+            name = frame['service'] or frame['inherited']
+            base = (self._first_opendap if name is None
+                    else self._opendapBase(name))
+            if base is not None:
+                mf_data_url.append(urljoin(server, base) + frame['path'])
+        return agg_data_url, mf_data_url, service_base
+
+
+def _siphonCatalog(url, sess):
+    # Get URLs of the aggregation and of each file, and the base URL
+    # of OPeNDAP service, via siphon.
+    cat = _getCatalog(url, sess)
+    service_base = cat.base_tds_url + _getServiceBase(cat.services)
+
+    agg_data_url = (service_base +
+                    cat.datasets[-1].url_path)  # Is this universal ?
+
+    mf_data_url = [
+        x.access_urls['OpenDAPServer'] for x in cat.datasets.values()
+        if 'OpenDAPServer' in x.access_urls
+    ]
+    return agg_data_url, mf_data_url, service_base
 
 
 def _getServiceBase(services):
@@ -285,22 +1231,208 @@ def _getServiceBase(services):
             return _getServiceBase(s.services)
 
 
-def _getDDS(url):
-    global _http
+def _getCatalog(url, sess):
+    # Get TDSCatalog, via session `sess`.  The session of siphon is
+    # global, so it is set up again if `sess` is another one.
+    global _siphon_session
+
+    siphon_catalog, siphon_http_util = _importSiphon()
+    if sess is not _siphon_session:
+        adapter = sess.requestsAdapter()
+        siphon_http_util.session_manager.set_session_options(
+            adapters=OrderedDict([('https://', adapter),
+                                  ('http://', adapter)]))
+        _siphon_session = sess
+
+    return siphon_catalog.TDSCatalog(url)
 
-    if not _http:
-        _http = urllib3.PoolManager()
 
-    r = _http.request('GET', url + '.dds')
+def _importSiphon():
+    # `siphon` is imported here since it is needed only as a fallback
+    # of _CatalogReader.  None if not installed.
+    try:
+        from siphon import catalog, http_util
+    except ImportError:
+        return None
+    return catalog, http_util
+
+
+def _getDDS(url, sess, memo=None):
+    result = _memoDDS(url, sess, memo)
+    if result is not None:
+        return result
+    with metrics.stage('dds'):
+        r = sess.request('GET', url + '.dds')
     if (r.status == 200):
         text = r.data.decode()
         result = dds.parse_dataset(text)
+        if memo is not None:
+            memo[url] = result
+    else:
+        result = None
+
+    return result
+
+
+async def _agetDDS(url, sess, memo=None, timeout=None):
+    result = _memoDDS(url, sess, memo)
+    if result is not None:
+        return result
+    with metrics.stage('dds'):
+        r = await sess.arequest('GET', url + '.dds', timeout=timeout)
+    if (r.status == 200):
+        result = dds.parse_dataset(r.data.decode())
+        if memo is not None:
+            memo[url] = result
     else:
         result = None
 
     return result
 
 
+def _memoDDS(url, sess, memo):
+    # DDS of `url` obtained already and memorized in `memo`, or None.
+    # A hit is recorded to metrics of session `sess`.
+    if memo is None:
+        return None
+    result = memo.get(url)
+    if result is not None:
+        sess.getMetrics().record('dds', urlparse(url).netloc,
+                                 cache_hit=True)
+    return result
+
+
+def _inferDDS(agg_dds, urls, got):
+    # DDS of each file of `urls`, taken from `got` ({url: DDS}), or
+    # inferred from the aggregation DDS `agg_dds` if not requested.
+    # None if neither, and if failed to be requested.
+    res = [got.get(url) for url in urls]
+    todo = {i for i, url in enumerate(urls) if url not in got}
+    if not todo or agg_dds is None:
+        return res
+
+    total = _timeLength(agg_dds)
+    if total is None:
+        if len(urls) == 1:
+            # not aggregated in time, the same as the only file.
+            res[0] = _withTimeLength(agg_dds, None, _fileName(urls[0]))
+        return res
+
+    # time steps not in DDS obtained are split into the others,
+    # including ones failed to be requested.
+    unknown = [i for i, d in enumerate(res) if d is None]
+    known = sum(_timeLength(d) or 0 for d in res if d is not None)
+    counts = _splitTime(total - known,
+                        [_timeRange(urls[i]) for i in unknown])
+    if counts is None:
+        return res
+    for i, n in zip(unknown, counts):
+        if i in todo:
+            res[i] = _withTimeLength(agg_dds, n, _fileName(urls[i]))
+    return res
+
+
+def _fileName(url):
+    return url.rsplit('/', 1)[-1]
+
+
+def _timeRange(url):
+    # (start, end) of <time_range> in the filename of `url`, or None.
+    m = _time_range_pat.search(url)
+    return m.groups() if m else None
+
+
+def _timeIndex(text):
+    # Position of time `text` of <time_range> on a linear axis, by
+    # the resolution of `text`, or None if invalid.
+    try:
+        if len(text) == 4:
+            return int(text)
+        if len(text) == 6:
+            return int(text[:4]) * 12 + int(text[4:6])
+        day = date(int(text[:4]), int(text[4:6]), int(text[6:8])).toordinal()
+        if len(text) == 8:
+            return day
+        return (day * 1440 + int(text[8:10]) * 60 + int(text[10:12] or 0))
+    except ValueError:
+        return None
+
+
+def _splitTime(total, ranges):
+    # Split `total` time steps into files with <time_range> `ranges`,
+    # in proportion to their length, or None if not possible.  Years,
+    # months and days are counted inclusively.  For finer resolution,
+    # the interval of time steps is estimated so that the sum is
+    # `total`.
+    if total <= 0 or not ranges or None in ranges:
+        return None
+    if len({len(t) for r in ranges for t in r}) != 1:
+        return None
+    spans = [(_timeIndex(a), _timeIndex(b)) for a, b in ranges]
+    if any(a is None or b is None or b < a for a, b in spans):
+        return None
+
+    if len(ranges[0][0]) <= 8:
+        weights = [b - a + 1 for a, b in spans]
+    else:
+        if total <= len(spans):
+            return None
+        step = sum(b - a for a, b in spans) / (total - len(spans))
+        if not step:
+            return None
+        weights = [(b - a) / step + 1 for a, b in spans]
+
+    # largest remainder method, so that the sum is `total`.
+    scale = total / sum(weights)
+    exact = [w * scale for w in weights]
+    res = [int(x) for x in exact]
+    order = sorted(range(len(res)), key=lambda i: res[i] - exact[i])
+    for i in order[:total - sum(res)]:
+        res[i] += 1
+    return res
+
+
+def _arrs(decl):
+    # All of dds.Arr in `decl`, recursively.
+    if isinstance(decl, dds.Grid):
+        yield from _arrs(decl.array)
+        for d in decl.maps.values():
+            yield from _arrs(d)
+    elif isinstance(decl, dds.Struct):
+        for d in (decl.decl or {}).values():
+            yield from _arrs(d)
+    elif isinstance(decl, dds.Var) and decl.arr:
+        yield from (decl.arr if type(decl.arr) is list else [decl.arr])
+
+
+def _timeLength(ds):
+    # Length of `time` dimension of DDS `ds`, or None.
+    for a in _arrs(ds):
+        if a.name == 'time':
+            return a.val
+    return None
+
+
+def _estimateBytes(ds, variables, hyperslab):
+    # Bytes of `variables` in `hyperslab` of DDS `ds`.
+    if ds is None:
+        return 0
+    if variables is None:
+        return ds.hyperslabBytes(hyperslab)
+    return sum(ds.decl[v].hyperslabBytes(hyperslab) or 0
+               for v in variables if v in (ds.decl or {}))
+
+
+def _withTimeLength(ds, n, name):
+    # Copy of DDS `ds` named `name`, with `time` dimension of length `n`.
+    res = dds.parse_dataset(ds.text)
+    for a in _arrs(res):
+        if a.name == 'time':
+            a.val = n
+    res.name = name
+    return res
+
+
 if (__name__ == '__main__'):
     import doctest
     doctest.testmod()
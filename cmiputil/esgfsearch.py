@@ -18,6 +18,9 @@ follows;
 
 All dataset URLs found are stored as the :attr:`.data_urls` attribute.
 
+If you want to process search results as they arrive, instead of
+waiting for all of them, use :meth:`.iterSearch` (see below).
+
 
 .. _ESGF RESTful API:
    https://earthsystemcog.org/projects/cog/esgf_search_restful_api
@@ -65,6 +68,271 @@ In case you choose not to use aggregation, netCDF4 (and the datatype
 that use it as a backend) can open multifile as a single dataset, as
 shown in above example.
 
+Stages
+------
+
+:meth:`.doSearch` consists of stages below:
+
+- ``search``: search via RESTful API,
+- ``files``: file-level search, see below,
+- ``catalog``: get dataset URLs from OPeNDAP catalog,
+- ``dds``: get DDS of dataset and of each file,
+- ``local``: find local files.
+
+You can select stages to be done by ``stages`` argument or by
+``stages`` in config file, such as
+``es.doSearch(params, stages=('search', 'catalog'))`` if you want only
+URLs.  Stages not done are done on first access to the corresponding
+attributes of :class:`esgfdatainfo.ESGFDataInfo`, such as
+``data_url``, ``agg_dds``, ``mf_dds`` and ``local_files``, so that you
+pay only for what you use.
+
+Size of data to be transferred via OPeNDAP is estimated from DDS by
+:attr:`.estimated_bytes`, or by
+:meth:`esgfdatainfo.ESGFDataInfo.estimateBytes` for some variables or
+a hyperslab, so that too large requests can be rejected before any
+download.
+
+File-level search
+-----------------
+
+Instead of accessing the OPeNDAP catalog of each dataset, URLs and
+other information of each file can be obtained from the search service
+itself, by searching with ``type=File`` and ``dataset_id`` of datasets
+found.  This is done by :meth:`.searchFiles`, or the ``files`` stage,
+for ``files_batch`` datasets per one request, and sets ``files``,
+``mf_data_url`` and, if :attr:`.aggregate` is ``False``, ``data_url``
+of each :class:`esgfdatainfo.ESGFDataInfo`.  Each element of
+``files`` is a dict with keys below:
+
+- ``filename``, ``size``, ``checksum``, ``checksum_type``,
+- ``opendap_url``: OPeNDAP URL of the file,
+- ``http_url``: URL for downloading the file via HTTPServer.
+
+Since this removes one catalog access per dataset, set ``stages =
+search, files, dds, local`` and ``aggregate = False`` in config file
+if you do not need aggregated datasets.  Note that URLs of aggregated
+datasets are still obtained from the catalog.
+
+Paging
+------
+
+ESGF search service returns search results *page by page*, up to
+``limit`` results per one request.  :meth:`.iterSearch` requests pages
+in turn with increasing ``offset`` and yields
+:class:`esgfdatainfo.ESGFDataInfo` instances as each page arrives, so
+the memory usage is bounded by the page size, set by ``page_size`` in
+config file (see below).  The total number of search results is set as
+:attr:`.numFound` after the first page is received::
+
+    >>> es = esgfsearch.ESGFSearch()
+    >>> for dinfo in es.iterSearch(params):
+    ...     print(es.numFound, dinfo.instance_id)
+
+:meth:`.doSearch` also uses this method, so it is no longer truncated
+at ``limit``.
+
+Each page is not read at once, but decoded incrementally by
+:mod:`jsonstream` as it arrives, so that the peak memory usage is
+about one search result, not the whole page.  Note that if the cache
+is enabled, the whole page is kept in memory to be stored.
+
+If you need only the number of search results and/or values of some
+facets, for example to estimate the size of a search, use
+:meth:`.countFacets`, that retrieves no search result itself.
+
+Query splitting
+---------------
+
+Facets may have multiple values separated by comma, such as
+``{'experiment_id': 'piControl, abrupt-4xCO2'}``, which are sent as
+one query.  A broad query like this may find too many results to be
+retrieved by one query.  :meth:`.splitSearch` (and so
+:meth:`.doSearch`) plans sub-queries by :meth:`.planQueries`, that
+counts search results by :meth:`.countFacets` and splits such facets
+into groups of values, each of which finds at most ``split_limit``
+results, only as far as needed.  Sub-queries are requested
+concurrently, at most ``max_workers`` at once, and results are merged
+in order of sub-queries and deduplicated by ``instance_id``::
+
+    >>> es.planQueries({'experiment_id': 'piControl, abrupt-4xCO2',
+    ...                 'variable_id': 'tas, pr'})   # doctest: +SKIP
+    [{..., 'experiment_id': 'piControl', 'variable_id': 'tas, pr'},
+     {..., 'experiment_id': 'abrupt-4xCO2', 'variable_id': 'tas, pr'}]
+
+If a query has no multi-valued facet, it is not split and no extra
+request is sent.  Otherwise one request counting search results is
+sent first, that retrieves no search result itself, and the query is
+not split if it finds at most ``split_limit`` results.
+
+Replicas
+--------
+
+If replicas are allowed (``replica`` keyword is not ``false``), the
+same dataset may be found on several data nodes.  By setting
+``select_replica = True`` in config file, :meth:`.doSearch` calls
+:meth:`.selectReplicas` after the search, that probes data nodes by
+``HEAD`` requests, and keeps only the fastest live copy of each
+dataset in :attr:`.datainfo`.  Other copies are tried in turn if the
+catalog of the selected one can not be accessed.  Probed latency and
+health of data nodes are cached for ``probe_ttl`` seconds.  See
+:mod:`replica`.
+
+Metrics
+-------
+
+Every request and each stage are recorded to :attr:`.metrics`, a
+:class:`metrics.Metrics` instance, with counters of requests, bytes,
+retries, errors and cache hits, and percentiles of latency, per stage
+and per host.  Export them as a dict or JSON, or add a hook called
+for each request::
+
+    >>> es.metrics.addHook(print)
+    >>> es.doSearch(params)
+    >>> print(es.metrics.toJSON(indent=2))
+
+Concurrency
+-----------
+
+After the search, :meth:`.doSearch` accesses OPeNDAP catalog, DDS and
+local files for each search result.  These are done concurrently by
+a pool of worker threads, at most ``max_workers`` at once in total and
+at most ``max_workers_per_node`` at once for one ``data_node``, so
+as not to flood a single data node.  Order of :attr:`.datainfo` is
+kept as the order of search results.
+
+Field projection
+----------------
+
+Each search result from the search service has dozens of fields, but
+only a few of them are used.  By default, :meth:`.iterSearch` (and so
+:meth:`.doSearch`) requests only fields in
+:attr:`esgfdatainfo.ESGFDataInfo.managedAttribNames`,
+:data:`fields_required` and ``extra_fields`` in config file, via the
+``fields`` keyword.  This reduces the size of responses and memory
+usage much.
+
+If you want all fields, set ``projection = False`` in config file, or
+give ``fields`` keyword explicitly, such as ``{'fields': '*'}``, as
+`params`.
+
+Multiple index nodes
+--------------------
+
+If two or more search services are set by ``index_nodes`` in config
+file, :meth:`.iterSearch` (and so :meth:`.doSearch`) queries all of
+them in parallel, instead of ``search_service``.  How to treat results
+depends on ``federation``:
+
+- ``merge``: wait for all of index nodes, and merge results.  Index
+  nodes that fail are skipped.
+- ``first``: use results from the index node that completes first.
+  Slower nodes are not waited for, and stop requesting further pages.
+
+In both cases, results are deduplicated by ``instance_id``, preferring
+the original (not replica) copy, then the copy from the index node that
+responded faster.  Copies on other data nodes are set as its replicas,
+see **Replicas** above.  Since all results are collected before yielded,
+memory usage is not bounded by the page size in this case.
+
+Incremental search
+------------------
+
+If you repeat the same search periodically, use :meth:`.doSync`
+instead of :meth:`.doSearch`.  It remembers datasets found by the last
+search in a state file (``sync_file`` in config file), requests only
+datasets changed since then, and returns sets of ``instance_id`` of
+datasets added, updated, retracted and superseded.  Only added or
+updated datasets are set as :attr:`.datainfo` and their catalogs, DDS
+and local files are accessed::
+
+    >>> res = es.doSync(params)
+    >>> res.added
+    {'CMIP6.CMIP.MIROC.MIROC6.historical.r1i1p1f1.Amon.tas.gn.v20181212'}
+
+Saving results
+--------------
+
+Search results can be saved to a file by :meth:`.saveResults`, and
+loaded back by :meth:`.loadResults`, without searching again.  The
+file is a compact `SQLite`_ database, see :mod:`resultstore`.  Only
+attributes already obtained are saved, and you can load only datasets
+matching some facets::
+
+    >>> es.doSearch(params)                                # doctest: +SKIP
+    >>> es.saveResults('results.sqlite')                   # doctest: +SKIP
+    >>> es2 = esgfsearch.ESGFSearch()
+    >>> es2.loadResults('results.sqlite',
+    ...                 facets={'variant_label': 'r1i1p1f1'})  # doctest: +SKIP
+
+.. _SQLite: https://docs.python.org/3/library/sqlite3.html
+
+Asynchronous API
+----------------
+
+For `asyncio`_ applications, :meth:`.asearch`, :meth:`.aresolve` and
+:meth:`.asearchFiles` are coroutines, counterparts of
+:meth:`.doSearch`, :meth:`.resolve` and :meth:`.searchFiles`, which do
+not block the event loop.  All requests share one pool of connections
+of :attr:`.session` (see :meth:`session.Session.arequest`,
+that requires `aiohttp`_).  They can be cancelled, for example by
+:func:`asyncio.wait_for`, and `timeout` limits each request::
+
+    >>> import asyncio
+    >>> async def main():
+    ...     es = esgfsearch.ESGFSearch()
+    ...     await asyncio.wait_for(es.asearch(params, timeout=30), 600)
+    ...     await es.session.aclose()
+    ...     return es.data_urls
+    >>> asyncio.run(main())
+
+Unlike :meth:`.iterSearch`, each page is read at once, and pages after
+the first one are requested concurrently.
+
+.. _asyncio: https://docs.python.org/3/library/asyncio.html
+.. _aiohttp: https://docs.aiohttp.org/
+
+HTTP session
+------------
+
+All network accesses of one instance, to the search service, OPeNDAP
+catalogs, DDS and data nodes, share its :attr:`.session`, a
+:class:`session.Session` instance created from the config file, which
+keeps connections alive and applies timeouts and retries.  It is given
+to search results and :class:`download.Downloader` with
+:attr:`.monitor`, :attr:`.catalog_cache` and :attr:`.dds_memo`, so that
+instances do not affect each other.  See :mod:`session` for the details
+and ``[Session]`` section of config file.
+
+Cache
+-----
+
+Responses from the search service can be cached on disk, by setting
+``enable = True`` in ``[ESGFSearch.cache]`` section of config file
+(see below).  Cache entries are keyed by the canonicalized query
+parameters and the URL of the search service, expire after ``ttl``
+seconds, and least recently used entries are evicted if the total size
+exceeds ``max_size`` MiB.  See :mod:`cache` for details.
+
+If ``offline`` is ``True``, by config file or the argument of
+:class:`ESGFSearch`, responses are served only from the cache,
+regardless of ``ttl``, and :exc:`cache.CacheMissError` is raised if
+not found.  Note that this affects only accesses to the search
+service, not to data nodes.
+
+Catalog cache
+-------------
+
+URLs obtained from OPeNDAP catalogs can also be cached on disk, by
+setting ``enable = True`` in ``[ESGFSearch.catalog_cache]`` section of
+config file.  Since a version of dataset never changes, entries are
+keyed by ``cat_url`` and ``version``, and never expire, so the
+``catalog`` stage of known datasets sends no request.  Least recently
+used entries are evicted if the total size exceeds ``max_size`` MiB.
+Use :meth:`esgfdatainfo.ESGFDataInfo.invalidateCatalog` to remove the
+entry of a dataset, or ``es.catalog_cache.invalidate()`` to remove
+all.  See :mod:`esgfdatainfo`.
+
 Config File
 ===========
 
@@ -80,9 +348,89 @@ This module reads in config file, sections below;
     ``search_service`` (str):
         the base URL of the search service at an ESGF Index Node
 
+    ``projection`` (bool):
+         request only necessary fields or not
+
+    ``extra_fields`` (str):
+         comma-separated list of fields requested in addition to the
+         necessary ones
+
+    ``sync_file`` (str):
+         state file for incremental search by :meth:`.doSync`
+
+    ``index_nodes`` (str):
+         comma-separated list of search services to be queried in
+         parallel, instead of ``search_service``
+
+    ``federation`` (str):
+         ``merge`` or ``first``, see above
+
     ``aggregate`` (bool):
          retrieve OPeNDAP aggregated datasets or not
 
+    ``stages`` (str):
+         comma-separated list of stages done by :meth:`.doSearch`,
+         see below
+
+    ``page_size`` (int):
+         number of search results requested at once
+
+    ``max_workers`` (int):
+         maximum number of concurrent accesses to data nodes
+
+    ``max_workers_per_node`` (int):
+         maximum number of concurrent accesses to one data node
+
+    ``files_batch`` (int):
+         number of datasets per one request of file-level search
+
+    ``split_limit`` (int):
+         maximum number of search results of one sub-query, see
+         above.  ``0`` disables query splitting.
+
+    ``select_replica`` (bool):
+         select the fastest replica of each dataset or not, see above
+
+    ``probe_ttl`` (float):
+         probed latency and health of data nodes expire after this
+         seconds
+
+    ``keep_raw`` (bool):
+         keep fields of search results other than necessary ones or
+         not, see :class:`esgfdatainfo.ESGFDataInfo`
+
+    ``dds_policy`` (str):
+         ``all``, ``aggregate-only`` or ``first+last``, DDS of which
+         files are requested, see :mod:`esgfdatainfo`
+
+- [ESGFSearch.cache]
+
+    ``enable`` (bool):
+         use cache for responses from the search service or not
+
+    ``file`` (str):
+         cache database file
+
+    ``ttl`` (int):
+         cache entries expire after this seconds
+
+    ``max_size`` (int):
+         maximum total size of cache entries in MiB
+
+    ``offline`` (bool):
+         serve only from cache
+
+- [ESGFSearch.catalog_cache]
+
+    ``enable`` (bool):
+         cache URLs obtained from OPeNDAP catalogs or not
+
+    ``file`` (str):
+         cache database file
+
+    ``max_size`` (int):
+         maximum total size of cache entries in MiB
+
 - [ESGFSearch.keywords] : keyword parameters of RESTful API
 
 - [ESGFSearch.facets] : facet parameters of RESTful API
@@ -91,6 +439,7 @@ This module reads in config file, sections below;
 Warning:
   Currently `format`, `limit`, `type` keywords are not configurable.
   Even if you specify them in your config file, they will be overriden.
+  Use ``page_size`` instead of `limit`.
 
 Local files
 ===========
@@ -107,6 +456,17 @@ use local files instead of downloading them.
 Do not forget to set :attr:`.base_dir` attribute or `cmip6_data_dir`
 in config file as the root of this directory structure.
 
+Local files of all search results are found at once by
+:meth:`.findLocalFiles`, also done by :meth:`.doSearch`.  Instead of
+globbing the directory of each result separately, it lists each
+directory needed once, top-down from :attr:`.base_dir`, and skips
+subtrees that do not exist.  So a large data store on a shared
+filesystem is accessed much less.
+
+Files of search results can be downloaded into this directory
+structure by :meth:`.download`, in parallel and resuming interrupted
+ones, see :mod:`download`.
+
 
 After :meth:`.doSearch()` in above example, ``es.local_files`` is set as below if they are exists::
 
@@ -120,12 +480,21 @@ __credits__ = 'Copyright (c) 2019 RIST'
 __version__ = 'v20190714'
 __date__ = '2019/07/14'
 
+import asyncio
 import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from fnmatch import fnmatchcase
+from pathlib import Path
 from pprint import pprint
+from urllib.parse import urlparse
 
-import urllib3
-
-from cmiputil import config, drs, esgfdatainfo
+from cmiputil import (cache, config, download, drs, esgfdatainfo,
+                      jsonstream, metrics, replica, resultstore, session,
+                      syncstate)
 
 
 #: OPeNDAP Catalog URL not found
@@ -144,6 +513,8 @@ class ESGFSearch():
 
     Args:
         conffile (path-like): configure file
+        offline (bool): serve search results only from cache,
+                        overrides config file if not ``None``.
 
     Attributes:
         conf: :class:`config.Conf` instance
@@ -152,9 +523,48 @@ class ESGFSearch():
                         ``http://esgf-node.llnl.gov/esg-search/``
         service_type: service type for RESTful API.
                       currently only ``search`` is allowed.
+        projection (bool): request only necessary fields or not
+        extra_fields (list(str)): fields requested in addition to the
+                                  necessary ones
+        sync_file (str): state file for :meth:`.doSync`
+        index_nodes (list(str)): search services of multiple index
+                                 nodes to be queried in parallel
+        federation (str): ``merge`` or ``first``, how to treat results
+                          from :attr:`index_nodes`
         aggregate (bool): get aggregated URL if ``TRUE``
         params: dict for keyword parameters and facet parameters for RESTful API
         base_dir (str): base(root) path for local data directory structure
+        stages (tuple(str)): stages done by :meth:`.doSearch`, see
+                             :meth:`.resolve`
+        page_size (int): number of search results requested at once
+        max_workers (int): maximum number of concurrent accesses
+        max_workers_per_node (int): maximum number of concurrent
+                                    accesses to one data node
+        files_batch (int): number of datasets per one request of
+                           :meth:`.searchFiles`
+        split_limit (int): maximum number of search results of one
+                           sub-query, see :meth:`.planQueries`
+        select_replica (bool): do :meth:`.selectReplicas` in
+                               :meth:`.doSearch` or not
+        keep_raw (bool): keep fields of search results not in slots of
+                         :class:`esgfdatainfo.ESGFDataInfo` or not
+        dds_policy (str): DDS of which files are requested, one of
+                          :data:`esgfdatainfo.dds_policies`
+        session: :class:`session.Session` instance, shared by all
+                 network accesses of this instance
+        monitor: :class:`replica.NodeMonitor` instance, for latency and
+                 health of data nodes
+        metrics: :class:`metrics.Metrics` instance, shared by all
+                 network accesses
+        cache: :class:`cache.DiskCache` instance, or ``None`` if
+               cache is disabled
+        catalog_cache: :class:`cache.DiskCache` instance for OPeNDAP
+                       catalogs, or ``None`` if disabled
+        dds_memo (dict): DDS obtained by search results, keyed by URL,
+                         cleared by :meth:`.resolve`
+        offline (bool): serve search results only from cache
+        numFound (int): number of search results, set after the first
+                        page is received by :meth:`.iterSearch`
     """
     _debug = False
 
@@ -170,15 +580,20 @@ class ESGFSearch():
     # def debug(cls):
     #     return cls._debug
 
-    def __init__(self, conffile=""):
+    def __init__(self, conffile="", offline=None):
 
         if self._debug:
             config.Conf._enable_debug()
             drs.DRS._enable_debug()
             esgfdatainfo.ESGFDataInfo._enable_debug()
+            session.Session._enable_debug()
 
         self.conf = config.Conf(conffile)
 
+        self.metrics = metrics.Metrics()
+        self.session = session.Session(conf=self.conf, metrics=self.metrics)
+        self.dds_memo = {}
+
         try:
             self.search_service = self.conf['ESGFSearch']['search_service']
         except KeyError:
@@ -189,16 +604,128 @@ class ESGFSearch():
         except KeyError:
             self.service_type = service_type_default
 
+        try:
+            self.projection = self.conf['ESGFSearch'].getboolean(
+                'projection')
+        except KeyError:
+            self.projection = None
+        if self.projection is None:
+            self.projection = projection_default
+
+        try:
+            self.extra_fields = [
+                f.strip()
+                for f in self.conf['ESGFSearch']['extra_fields'].split(',')
+                if f.strip()]
+        except KeyError:
+            self.extra_fields = []
+
+        try:
+            self.sync_file = self.conf['ESGFSearch']['sync_file']
+        except KeyError:
+            self.sync_file = sync_file_default
+
+        try:
+            self.index_nodes = [
+                n.strip()
+                for n in self.conf['ESGFSearch']['index_nodes'].split(',')
+                if n.strip()]
+        except KeyError:
+            self.index_nodes = []
+
+        try:
+            self.federation = self.conf['ESGFSearch']['federation']
+        except KeyError:
+            self.federation = federation_default
+        if self.federation not in ('merge', 'first'):
+            raise ValueError(f'invalid federation: "{self.federation}"')
+
         try:
             self.aggregate = self.conf['ESGFSearch'].getboolean('aggregate')
         except KeyError:
             self.aggregate = aggregate_default
 
+        try:
+            self.stages = tuple(
+                st.strip()
+                for st in self.conf['ESGFSearch']['stages'].split(',')
+                if st.strip())
+        except KeyError:
+            self.stages = stages_default
+
+        try:
+            self.page_size = self.conf['ESGFSearch'].getint('page_size')
+        except KeyError:
+            self.page_size = None
+        if not self.page_size:
+            self.page_size = page_size_default
+
+        try:
+            self.max_workers = self.conf['ESGFSearch'].getint('max_workers')
+        except KeyError:
+            self.max_workers = None
+        if not self.max_workers:
+            self.max_workers = max_workers_default
+
+        try:
+            self.max_workers_per_node = self.conf['ESGFSearch'].getint(
+                'max_workers_per_node')
+        except KeyError:
+            self.max_workers_per_node = None
+        if not self.max_workers_per_node:
+            self.max_workers_per_node = max_workers_per_node_default
+
+        try:
+            self.files_batch = self.conf['ESGFSearch'].getint('files_batch')
+        except KeyError:
+            self.files_batch = None
+        if not self.files_batch:
+            self.files_batch = files_batch_default
+
+        try:
+            self.split_limit = self.conf['ESGFSearch'].getint('split_limit')
+        except KeyError:
+            self.split_limit = None
+        if self.split_limit is None:
+            self.split_limit = split_limit_default
+
+        try:
+            self.select_replica = self.conf['ESGFSearch'].getboolean(
+                'select_replica')
+        except KeyError:
+            self.select_replica = None
+        if self.select_replica is None:
+            self.select_replica = select_replica_default
+
+        try:
+            probe_ttl = self.conf['ESGFSearch'].getfloat('probe_ttl')
+        except KeyError:
+            probe_ttl = None
+        if probe_ttl is None:
+            probe_ttl = replica.probe_ttl_default
+        self.monitor = replica.NodeMonitor(probe_ttl, session=self.session)
+
+        try:
+            self.keep_raw = self.conf['ESGFSearch'].getboolean('keep_raw')
+        except KeyError:
+            self.keep_raw = None
+        if self.keep_raw is None:
+            self.keep_raw = keep_raw_default
+
+        try:
+            self.dds_policy = self.conf['ESGFSearch']['dds_policy']
+        except KeyError:
+            self.dds_policy = dds_policy_default
+        if self.dds_policy not in esgfdatainfo.dds_policies:
+            raise ValueError(f'invalid dds_policy: "{self.dds_policy}"')
+
         try:
             self.params = dict(self.conf['ESGFSearch.keywords'].items())
         except KeyError:
             self.params = {}
         self.params.update(keywords_non_configurable)
+        # `limit` of each request is set by the paging, see page_size.
+        self.params.pop('limit', None)
 
         try:
             self.params.update(dict(self.conf['ESGFSearch.facets'].items()))
@@ -210,16 +737,24 @@ class ESGFSearch():
         except (KeyError, AttributeError):
             self.base_dir = None
 
+        self.setCache(offline)
+        self.setCatalogCache()
+
+        self.numFound = None
+
         if self._debug:
             print('dbg:ESGFSearch():')
             pprint(vars(self))
 
-    def doSearch(self, params=None, base_url=None):
+    def doSearch(self, params=None, base_url=None, stages=None):
         """
         Do search via ESGF RESTful API.
 
         Search results are stored to the :attr:`.datainfo` attributes
         as a list of :class:`esgfdatainfo.ESGFDataInfo` instances.
+        Queries with multi-valued facets are split into sub-queries
+        by :meth:`.splitSearch`.  If :attr:`select_replica` is
+        ``True``, replicas are selected by :meth:`.selectReplicas`.
 
         If :attr:`aggregate` attribute is ``True``, this method
         obtains URLs of aggregated dataset, else URLs of all of files
@@ -230,6 +765,9 @@ class ESGFSearch():
         Args:
             params (dict): keyword parameters and facet parameters.
             base_url : base URL of the ESGF search service.
+            stages (tuple(str)): stages to be done after the search,
+                                 overrides :attr:`stages`.
+                                 See :meth:`.resolve`.
 
         Raises:
             NotFoundError: raised if no catalog found.
@@ -242,59 +780,1121 @@ class ESGFSearch():
 
         `params` is to *update* (use `update()` method of python dict)
         to :attr:`params` attribute.
+
+        Example:
+
+            Get only URLs of datasets, not DDS nor local files::
+
+                >>> es.doSearch(params, stages=('search', 'catalog'))
+        """
+        self.datainfo = self.splitSearch(params, base_url)
+
+        if (self.numFound == 0):
+            raise NotFoundError('No catalog found.')
+
+        if self.select_replica:
+            self.selectReplicas()
+
+        if self._debug:
+            for dinfo in self.datainfo:
+                print(dinfo.get('cat_url'))
+
+        self.resolve(stages)
+
+    def resolve(self, stages=None):
+        """
+        Do stages after the search for each of :attr:`.datainfo`,
+        concurrently.
+
+        Stages are below, done in this order:
+
+        - ``files``: :meth:`.searchFiles`, for all of :attr:`.datainfo`
+          at once
+        - ``catalog``: :meth:`~esgfdatainfo.ESGFDataInfo.getDataURL`
+        - ``dds``: :meth:`~esgfdatainfo.ESGFDataInfo.getDDS`
+        - ``local``: :meth:`.findLocalFiles`, for all of :attr:`.datainfo`
+          at once, after the others
+
+        ``search`` is also allowed in `stages` and just ignored.
+        Stages not done here are done on first access to the
+        corresponding attribute of :class:`esgfdatainfo.ESGFDataInfo`.
+        If ``files`` is done and :attr:`.aggregate` is ``False``,
+        ``catalog`` is skipped since URLs are already obtained.
+
+        Each element of :attr:`.datainfo` is processed in a worker
+        thread.  Number of workers are limited by
+        :attr:`.max_workers` in total and by
+        :attr:`.max_workers_per_node` for each ``data_node``.
+
+        DDS memorized in :attr:`.dds_memo` by the last call are
+        forgotten.
+
+        This is called by :meth:`.doSearch` and :meth:`.doSync`.
+
+        Args:
+            stages (tuple(str)): stages to be done, overrides
+                                 :attr:`stages`.
+
+        Raises:
+            ValueError: invalid stage is given.
+            Exception: the first exception raised in workers, after all
+                       running workers finish.
+        """
+        stages = self._checkStages(stages)
+        self.dds_memo.clear()
+        if 'files' in stages:
+            self.searchFiles()
+            if not self.aggregate:
+                stages = [st for st in stages if st != 'catalog']
+        methods = [_stage_methods[st] for st in stages_all
+                   if st in stages and st in _stage_methods]
+
+        def _resolve(dinfo):
+            for method in methods:
+                getattr(dinfo, method)()
+
+        if methods:
+            tasks = [(getattr(dinfo, 'data_node', None), _resolve, dinfo)
+                     for dinfo in self.datainfo]
+            _runPerNode(tasks, self.max_workers, self.max_workers_per_node)
+        if 'local' in stages:
+            self.findLocalFiles()
+
+    def findLocalFiles(self, datainfo=None, base_dir=None):
+        """
+        Find local (pre-downloaded) files of search results at once.
+
+        Search results are grouped by their DRS directory, and
+        directories on the way to them are listed top-down from
+        `base_dir`, each once, concurrently by :attr:`.max_workers`
+        threads.  Subtrees that do not exist are not visited.  Then
+        filenames of each result are matched against the listing of
+        its directory.  Results are set as ``local_files`` of each
+        :class:`esgfdatainfo.ESGFDataInfo`, sorted by name.
+
+        Unlike :meth:`~esgfdatainfo.ESGFDataInfo.findLocalFile`,
+        attributes are not validated by :class:`drs.DRS`.  Results
+        lacking attributes necessary for the DRS directory fall back
+        to :meth:`~esgfdatainfo.ESGFDataInfo.findLocalFile`.
+
+        Each listing is recorded to :attr:`.metrics` as a request of
+        stage ``local``.
+
+        Args:
+            datainfo (list(esgfdatainfo.ESGFDataInfo)): search results,
+                ``None`` means :attr:`.datainfo`.
+            base_dir (path-like): root of the local data store, ``None``
+                means :attr:`.base_dir`.
+        """
+        if datainfo is None:
+            datainfo = self.datainfo
+        if base_dir is None:
+            base_dir = self.base_dir
+        base_dir = Path(base_dir or '').expanduser()
+
+        wanted = {}  # DRS directory -> [(dinfo, filename pattern)]
+        for dinfo in datainfo:
+            loc = dinfo.drsLocation()
+            if loc is None:
+                dinfo.findLocalFile(base_dir)
+            else:
+                wanted.setdefault(loc[0], []).append((dinfo, loc[1]))
+
+        listings = _listTree(base_dir, wanted, self.max_workers,
+                             self.metrics)
+        for dname, items in wanted.items():
+            names = sorted(listings.get(dname, ()))
+            for dinfo, pattern in items:
+                dinfo.local_files = [base_dir.joinpath(*dname, n)
+                                     for n in names
+                                     if fnmatchcase(n, pattern)]
+
+    def download(self, datainfo=None, base_dir=None):
+        """
+        Download files of search results into the local data store, by
+        :class:`download.Downloader` configured by ``[Download]``
+        section of config file.
+
+        File-level search (:meth:`.searchFiles`) is done first for
+        results whose ``files`` are not set yet.  After downloading,
+        ``local_files`` are found again by :meth:`.findLocalFiles`.
+
+        Args:
+            datainfo (list(esgfdatainfo.ESGFDataInfo)): search results,
+                ``None`` means :attr:`.datainfo`.
+            base_dir (path-like): root of the local data store, ``None``
+                means :attr:`.base_dir`.
+
+        Returns:
+            dict: report of :meth:`download.Downloader.download`
+        """
+        if datainfo is None:
+            datainfo = self.datainfo
+        if base_dir is None:
+            base_dir = self.base_dir
+        todo = [dinfo for dinfo in datainfo if not dinfo.isSet('files')]
+        if todo:
+            self.searchFiles(todo)
+        downloader = download.Downloader(conf=self.conf, session=self.session)
+        res = downloader.download(datainfo, base_dir)
+        self.findLocalFiles(datainfo, base_dir)
+        return res
+
+    def selectReplicas(self, datainfo=None):
+        """
+        Keep only the fastest live copy of each dataset, and set the
+        others as its replicas.
+
+        Search results are grouped by ``instance_id``.  Data nodes of
+        datasets with two or more copies are probed by ``HEAD``
+        requests to their OPeNDAP catalog, concurrently as
+        :meth:`.resolve`, unless probed within ``probe_ttl`` seconds.
+        Then copies are ranked by
+        :meth:`replica.NodeMonitor.rank`, and the first one is kept,
+        with the others set by
+        :meth:`~esgfdatainfo.ESGFDataInfo.setReplicas`.
+
+        Args:
+            datainfo (list(esgfdatainfo.ESGFDataInfo)): datasets,
+                ``None`` means :attr:`.datainfo`.
+
+        Returns:
+            list(esgfdatainfo.ESGFDataInfo): selected datasets, also set
+            as :attr:`.datainfo`.
+        """
+        if datainfo is None:
+            datainfo = self.datainfo
+        monitor = self.monitor
+
+        probes = {}
+        for copies in replica.groupReplicas(datainfo).values():
+            if len(copies) < 2:
+                continue
+            for dinfo in copies:
+                node = dinfo.get('data_node')
+                if (node not in probes and 'cat_url' in dinfo
+                        and monitor.state(node) is None):
+                    probes[node] = dinfo.cat_url
+
+        def _probe(args):
+            return monitor.probe(*args)
+
+        tasks = [(node, _probe, (node, url)) for node, url in probes.items()]
+        _runPerNode(tasks, self.max_workers, self.max_workers_per_node)
+
+        if self._debug:
+            print(f'dbg:ESGFSearch.selectReplicas():probed {len(tasks)} '
+                  'nodes:', monitor.rank(probes))
+
+        self.datainfo = replica.selectReplicas(datainfo, monitor)
+        return self.datainfo
+
+    def _checkStages(self, stages):
+        if stages is None:
+            stages = self.stages
+        invalid = set(stages) - set(stages_all)
+        if invalid:
+            raise ValueError(f'invalid stages: {invalid}')
+        return stages
+
+    def searchFiles(self, datainfo=None, base_url=None, batch_size=None):
+        """
+        Do file-level search for datasets, without accessing OPeNDAP
+        catalogs.
+
+        Files of `batch_size` datasets are requested at once, by
+        ``type=File`` and comma-separated ``dataset_id``.  Requests are
+        issued concurrently, at most :attr:`.max_workers` at once.
+        Results are set by
+        :meth:`~esgfdatainfo.ESGFDataInfo.setFiles` of each dataset.
+
+        Args:
+            datainfo (list(esgfdatainfo.ESGFDataInfo)): datasets,
+                ``None`` means :attr:`.datainfo`.
+            base_url : base URL of the ESGF search service.
+            batch_size (int): number of datasets per request, overrides
+                              :attr:`.files_batch`.
+
+        Raises:
+            Exception: the first exception raised in requests.
         """
-        if params:
-            self.params.update(params)
         if not base_url:
             base_url = self.search_service + self.service_type
+        datasets, batches = self._fileBatches(datainfo, batch_size)
+
+        def _search(fields):
+            return [doc for page in self._iterPages(base_url, fields)
+                    for doc in page]
+
+        tasks = [(None, _search, fields) for fields in batches]
+        results = _runPerNode(tasks, self.max_workers, self.max_workers)
+        self._setFiles(datasets, results)
+
+    def _fileBatches(self, datainfo, batch_size):
+        # Group `datainfo` by dataset id, returns them and query
+        # parameters for each batch.
+        if datainfo is None:
+            datainfo = self.datainfo
+        if not batch_size:
+            batch_size = self.files_batch
+
+        datasets = {}
+        for dinfo in datainfo:
+            datasets.setdefault(dinfo.id, []).append(dinfo)
+        ids = list(datasets)
+
+        batches = []
+        for i in range(0, len(ids), batch_size):
+            fields = {k: v for k, v in self.params.items()
+                      if k in _files_keywords}
+            fields.update({'type': 'File',
+                           'dataset_id': ','.join(ids[i:i+batch_size]),
+                           'limit': self.page_size,
+                           'fields': ','.join(file_fields)})
+            batches.append(fields)
+        return datasets, batches
+
+    def _setFiles(self, datasets, results):
+        # Set file records in `results` (list of docs for each batch)
+        # to `datasets` grouped by _fileBatches().
+        files = {}
+        for docs in results:
+            for doc in docs:
+                dataset_id = doc.get('dataset_id')
+                if type(dataset_id) is list:
+                    dataset_id = dataset_id[0]
+                files.setdefault(dataset_id, []).append(doc)
+
+        if self._debug:
+            print(f'dbg:ESGFSearch.searchFiles():{len(datasets)} datasets, '
+                  f'{len(results)} requests, '
+                  f'{sum(len(f) for f in files.values())} files')
+
+        for dataset_id, dinfos in datasets.items():
+            for dinfo in dinfos:
+                dinfo.setFiles(files.get(dataset_id, []))
+
+    def doSync(self, params=None, base_url=None, sync_file=None):
+        """
+        Do search incrementally, based on the result of the last
+        search with the same parameters.
+
+        Datasets found and their ``_timestamp`` and ``version`` are
+        stored in `sync_file`, see :mod:`syncstate`.  Next time, only
+        datasets published, retracted or superseded after the last
+        search are requested to the search service, via ``from``
+        keyword.  The first time, this is the same as :meth:`.doSearch`.
+
+        New or updated datasets are set as :attr:`.datainfo`, and
+        processed by :meth:`.resolve`.
+
+        Args:
+            params (dict): keyword parameters and facet parameters.
+            base_url : base URL of the ESGF search service.
+            sync_file (path-like): state file, overrides :attr:`sync_file`
+
+        Returns:
+            syncstate.SyncResult: sets of ``instance_id``, ``added``,
+            ``updated`` (re-published), ``retracted`` and ``superseded``
+            (by a newer version) since the last search.
+
+        `params` and `base_url` are treated as the same as
+        :meth:`.doSearch`.  States are kept separately for different
+        `params` and `base_url`.
+        """
+        if params:
+            self.params.update(params)
+        if not sync_file:
+            sync_file = self.sync_file
+
+        state = syncstate.SyncState(sync_file)
+        try:
+            query = cache.makeKey(
+                base_url or self.search_service + self.service_type,
+                {k: v for k, v in self.params.items()
+                 if k not in _sync_ignored_keywords})
+            known = state.get(query)
+            last_sync = state.lastSync(query)
+
+            fields = dict(self.params)
+            if last_sync is not None:
+                # request also old versions and retracted ones, to know
+                # what is superseded or retracted.
+                fields['from'] = last_sync
+                fields.pop('latest', None)
+                fields.pop('retracted', None)
+
+            if self._debug:
+                print(f'dbg:ESGFSearch.doSync():last_sync:{last_sync}, '
+                      f'known:{len(known)}')
+
+            added, updated, retracted, superseded = set(), set(), set(), set()
+            found = {}
+            newest = last_sync
+            for copies in self._iterDocs(fields, base_url):
+                dinfo = self._copiesDataInfo(copies)
+                iid = dinfo.instance_id
+                timestamp = dinfo.get('_timestamp')
+                if timestamp and (newest is None or timestamp > newest):
+                    newest = timestamp
+                if _isTrue(dinfo.get('retracted', False)):
+                    if iid in known:
+                        retracted.add(iid)
+                elif not _isTrue(dinfo.get('latest', True)):
+                    if iid in known:
+                        superseded.add(iid)
+                elif iid not in known:
+                    added.add(iid)
+                    found[iid] = dinfo
+                elif known[iid]['_timestamp'] != timestamp:
+                    updated.add(iid)
+                    found[iid] = dinfo
+
+            # older versions of newly added datasets are superseded.
+            masters = {found[iid].get('master_id') for iid in added}
+            for iid, row in known.items():
+                if (row['master_id'] in masters and iid not in found
+                        and iid not in retracted):
+                    superseded.add(iid)
+
+            self.datainfo = list(found.values())
+            self.resolve()
+
+            state.update(
+                query,
+                stored=[{c: d.get(c) for c in syncstate.SyncState.columns}
+                        for d in self.datainfo],
+                removed=retracted | superseded,
+                last_sync=newest)
+        finally:
+            state.close()
+
+        return syncstate.SyncResult(added, updated, retracted, superseded)
+
+    def iterSearch(self, params=None, base_url=None, page_size=None):
+        """
+        Do search via ESGF RESTful API, page by page.
+
+        This is a generator, that requests search results page by
+        page, via ``offset`` and ``limit`` keywords, and yields
+        :class:`esgfdatainfo.ESGFDataInfo` instances as each page
+        arrives.  After the first page is received, :attr:`.numFound`
+        is set as the total number of search results.
+
+        Unlike :meth:`.doSearch`, results are not stored in
+        :attr:`.datainfo`, and OPeNDAP catalogs, DDS and local files
+        are not accessed.
+
+        Args:
+            params (dict): keyword parameters and facet parameters.
+            base_url : base URL of the ESGF search service.
+            page_size (int): number of results per page, overrides
+                             :attr:`page_size`.
+
+        Yields:
+            esgfdatainfo.ESGFDataInfo: one search result
+
+        `params` and `base_url` are treated as the same as
+        :meth:`.doSearch`.
+
+        If ``offset`` is set in :attr:`params`, results are from there.
+        """
+        if params:
+            self.params.update(params)
 
         if (self._debug):
-            print(f'dbg:ESGFSearch.doSearch():base_url:{base_url}')
-            print('dbg:ESGFSeaerch.doSearch():params:')
+            print(f'dbg:ESGFSearch.iterSearch():base_url:{base_url}')
+            print('dbg:ESGFSeaerch.iterSearch():params:')
             pprint(self.params)
 
-        http = urllib3.PoolManager()
+        for copies in self._iterDocs(dict(self.params), base_url, page_size):
+            yield self._copiesDataInfo(copies)
+
+    def splitSearch(self, params=None, base_url=None, limit=None):
+        """
+        Do search via ESGF RESTful API, by sub-queries planned by
+        :meth:`.planQueries`, concurrently.
+
+        Sub-queries are requested at most :attr:`.max_workers` at
+        once, and results are merged in order of sub-queries and
+        deduplicated by ``instance_id``, preferring the original (not
+        replica) copy, with copies on other data nodes set as its
+        replicas.  :attr:`.numFound` is set as the number of
+        merged results.  If not split, results of the one query are
+        deduplicated in the same way, so that results do not depend
+        on whether the query is split or not.
+
+        Args:
+            params (dict): keyword parameters and facet parameters.
+            base_url : base URL of the ESGF search service.
+            limit (int): maximum number of search results of one
+                         sub-query, overrides :attr:`.split_limit`.
+
+        Returns:
+            list(esgfdatainfo.ESGFDataInfo): search results
+
+        Raises:
+            Exception: the first exception raised in sub-queries.
+
+        `params` and `base_url` are treated as the same as
+        :meth:`.doSearch`.
+        """
+        if params:
+            self.params.update(params)
+        plan = self.planQueries(base_url=base_url, limit=limit)
+        if len(plan) == 1:
+            results = [list(self._iterDocs(dict(self.params), base_url))]
+        else:
+            results = self._runQueries(plan, base_url)
+        groups = _dedupDocs(doc for res in results
+                            for copies in res for doc in copies)
+
+        if self._debug:
+            print(f'dbg:ESGFSearch.splitSearch():{len(plan)} sub-queries, '
+                  f'{sum(len(r) for r in results)} docs, '
+                  f'{len(groups)} deduplicated')
+
+        self.numFound = len(groups)
+        return [self._copiesDataInfo(copies) for copies in groups]
+
+    def _runQueries(self, plan, base_url=None):
+        # Request sub-queries `plan` concurrently, returns lists of
+        # copies of each dataset for each sub-query.
+        federated = (not base_url and len(self.index_nodes) > 1)
+        if not base_url:
+            base_url = self.search_service + self.service_type
+
+        def _collect(fields):
+            self._searchFields(fields)
+            if federated:
+                return self._federatedSearch(fields)
+            return [[doc] for page in self._iterPages(base_url, fields)
+                    for doc in page]
+
+        tasks = [(None, _collect, fields) for fields in plan]
+        return _runPerNode(tasks, self.max_workers, self.max_workers)
+
+    def planQueries(self, params=None, base_url=None, limit=None):
+        """
+        Split a query with multi-valued facets into sub-queries, each
+        of which finds at most `limit` search results.
+
+        Search results are counted for each value of multi-valued
+        facets by :meth:`.countFacets`.  If more than `limit` are
+        found, the facet with the most values is split into groups of
+        values, packed in order up to `limit` results.  Groups still
+        finding more than `limit` (that is, one value of the facet)
+        are split by the next facet, and so on.  A query that can not
+        be split any more is left as is, to be paged.
+
+        Args:
+            params (dict): keyword parameters and facet parameters,
+                           in addition to :attr:`.params`.
+            base_url : base URL of the ESGF search service.
+            limit (int): maximum number of search results of one
+                         sub-query, overrides :attr:`.split_limit`.
+                         ``0`` means no splitting.
+
+        Returns:
+            list(dict): query parameters of each sub-query.
+
+        Unlike :meth:`.doSearch`, `params` do not update
+        :attr:`params` attribute.  No request is sent if there is no
+        multi-valued facet.
+        """
+        if limit is None:
+            limit = self.split_limit
+        fields = dict(self.params)
+        if params:
+            fields.update(params)
+
+        multi = {}
+        for name, value in fields.items():
+            values = _facetValues(value)
+            if name not in _split_ignored_keywords and len(values) > 1:
+                multi[name] = values
+        if not limit or not multi:
+            return [fields]
+        return self._splitFields(fields, multi, base_url, limit)
+
+    def _splitFields(self, fields, multi, base_url, limit):
+        # Split query parameters `fields` by facets in `multi`,
+        # {name: [value, ...]}, see planQueries().
+        counts = self.countFacets(fields, facets=list(multi),
+                                  base_url=base_url)
+        if counts is None or counts['numFound'] <= limit:
+            return [fields]
+
+        name = max(multi, key=lambda n: len(multi[n]))
+        rest = {n: v for n, v in multi.items() if n != name}
+        per_value = counts['facets'].get(name, {})
+
+        if self._debug:
+            print(f'dbg:ESGFSearch.planQueries():{counts["numFound"]} '
+                  f'found, split by {name}:{per_value}')
+
+        res = []
+        for group, found in _packValues(multi[name], per_value, limit):
+            sub = dict(fields)
+            sub[name] = ','.join(group)
+            if found > limit and rest:
+                res += self._splitFields(sub, rest, base_url, limit)
+            else:
+                res.append(sub)
+        return res
+
+    def _newDataInfo(self, doc):
+        return esgfdatainfo.ESGFDataInfo(attribs=doc,
+                                         **self._dataInfoArgs())
+
+    def _dataInfoArgs(self):
+        # Arguments of ESGFDataInfo for search results of this instance.
+        return {'aggregate': self.aggregate,
+                'base_dir': self.base_dir,
+                'keep_raw': self.keep_raw,
+                'dds_policy': self.dds_policy,
+                'session': self.session,
+                'monitor': self.monitor,
+                'catalog_cache': (False if self.catalog_cache is None
+                                  else self.catalog_cache),
+                'dds_memo': self.dds_memo}
+
+    def _copiesDataInfo(self, copies):
+        # ESGFDataInfo of the first of `copies` of one dataset, with
+        # the others set as its replicas, see _dedupDocs().
+        dinfo = self._newDataInfo(copies[0])
+        if len(copies) > 1:
+            dinfo.setReplicas([self._newDataInfo(doc) for doc in copies[1:]])
+        return dinfo
+
+    def _iterDocs(self, fields, base_url=None, page_size=None):
+        # Search with query parameters `fields`, yields lists of copies
+        # of each dataset, see _dedupDocs().  Copies are deduplicated
+        # only for federated search.
+        federated = (not base_url and len(self.index_nodes) > 1)
+        if not base_url:
+            base_url = self.search_service + self.service_type
+        self._searchFields(fields, page_size)
+
+        self.numFound = None
+        if federated:
+            groups = self._federatedSearch(fields)
+            self.numFound = len(groups)
+            yield from groups
+            return
+
+        for page in self._iterPages(base_url, fields):
+            for doc in page:
+                self.numFound = page.numFound
+                yield [doc]
+            self.numFound = page.numFound
+
+    def _searchFields(self, fields, page_size=None):
+        # Set `limit` and `fields` of query parameters `fields`.
+        if not page_size:
+            page_size = self.page_size
+        fields['limit'] = page_size
+        if self.projection and 'fields' not in fields:
+            fields['fields'] = ','.join(self.projectedFields())
+
+    def projectedFields(self):
+        """
+        Fields requested to the search service if :attr:`projection`
+        is ``True``.
+
+        Returns:
+            list(str): :attr:`esgfdatainfo.ESGFDataInfo.managedAttribNames`,
+            :data:`fields_required` and :attr:`extra_fields`, without
+            duplication.
+        """
+        res = list(esgfdatainfo.ESGFDataInfo.managedAttribNames)
+        res += list(fields_required) + list(self.extra_fields)
+        return list(dict.fromkeys(res))
+
+    def countFacets(self, params=None, facets=None, base_url=None):
+        """
+        Count search results and values of facets, without retrieving
+        search results themselves.
+
+        This sends a query with ``limit=0`` and ``facets=``, so that
+        only the number of search results and counts for each value of
+        `facets` are returned.  Useful to estimate the size of the
+        search before :meth:`.doSearch`.
+
+        Args:
+            params (dict): keyword parameters and facet parameters.
+            facets (list(str)): facet names to be counted.
+            base_url : base URL of the ESGF search service.
+
+        Returns:
+            dict: ``{'numFound': int, 'facets': {facet: {value: count}}}``,
+            or ``None`` if the request failed.
+
+        Unlike :meth:`.doSearch`, `params` do not update
+        :attr:`params` attribute.
+
+        Example:
+
+            >>> es = esgfsearch.ESGFSearch()
+            >>> es.countFacets({'source_id': 'MIROC6'},
+            ...                facets=['experiment_id'])  # doctest: +SKIP
+            {'numFound': 1234, 'facets': {'experiment_id': {'historical': 100, ...}}}
+        """
+        if not base_url:
+            base_url = self.search_service + self.service_type
+        fields = dict(self.params)
+        if params:
+            fields.update(params)
+        fields['limit'] = 0
+        fields.pop('offset', None)
+        if facets:
+            fields['facets'] = ','.join(facets)
+
+        result = self._query(base_url, fields)
+        if result is None:
+            return None
+
+        counts = {}
+        facet_fields = result.get('facet_counts', {}).get('facet_fields', {})
+        for facet in (facets or []):
+            # Solr returns [value1, count1, value2, count2, ...]
+            flat = facet_fields.get(facet, [])
+            counts[facet] = dict(zip(flat[0::2], flat[1::2]))
+        return {'numFound': result['response']['numFound'],
+                'facets': counts}
+
+    def _iterPages(self, base_url, fields, stop=None):
+        # Request pages in turn, yields _Page for each page.
+        # Each page must be consumed before requesting the next.  If
+        # threading.Event `stop` is set, no more page is requested.
+        fields = dict(fields)
+        offset = int(fields.get('offset', 0))
+        while True:
+            if stop is not None and stop.is_set():
+                return
+            fields['offset'] = offset
+            chunks = self._fetch(base_url, fields)
+            if chunks is None:
+                return
+
+            page = _Page(chunks)
+            yield page
+            numFound = page.numFound
+            if self._debug:
+                print(f'dbg:_iterPages:{base_url}:numFound:{numFound}, '
+                      f'offset:{offset}, docs:{page.count}')
+
+            offset += page.count
+            if (page.count == 0 or offset >= numFound):
+                return
+
+    def _federatedSearch(self, fields):
+        # Query all of index nodes in parallel, returns a list of
+        # copies of each dataset, see _dedupDocs().
+
+        stop = threading.Event()
+
+        def _collect(url):
+            t0 = time.time()
+            docs = [doc for page in self._iterPages(url, fields, stop)
+                    for doc in page]
+            return docs, time.time() - t0
+
+        urls = [node + self.service_type for node in self.index_nodes]
+        executor = ThreadPoolExecutor(max_workers=len(urls))
+        futures = {executor.submit(_collect, url): url for url in urls}
+        results = []   # in order of completion
+        errors = []
+        try:
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for f in done:
+                    url = futures[f]
+                    try:
+                        docs, elapsed = f.result()
+                    except Exception as e:
+                        print(f'Error in searching {url}:', e.args)
+                        errors.append(e)
+                        continue
+                    if self._debug:
+                        print(f'dbg:_federatedSearch:{url}:'
+                              f'{len(docs)} docs in {elapsed:.3f} s')
+                    results.append(docs)
+                if results and self.federation == 'first':
+                    break
+        finally:
+            # do not wait for slow nodes in 'first' mode, and stop
+            # them requesting further pages.
+            stop.set()
+            for f in futures:
+                f.cancel()
+            executor.shutdown(wait=False)
+
+        if not results:
+            if errors:
+                raise errors[0]
+            return []
+        return _dedupDocs(doc for docs in results for doc in docs)
+
+    def setCache(self, offline=None):
+        """
+        Set up :attr:`cache` from ``[ESGFSearch.cache]`` section of
+        config file.
+
+        Called by the constructor, no need to call explicitly unless
+        you modify :attr:`conf`.
+
+        Args:
+            offline (bool): serve only from cache, overrides config
+                            file if not ``None``.
+        """
+        sect = 'ESGFSearch.cache'
+        enable = self.conf.getboolean(sect, 'enable',
+                                      fallback=cache_default['enable'])
+        if offline is None:
+            offline = self.conf.getboolean(sect, 'offline',
+                                           fallback=cache_default['offline'])
+        file = self.conf.get(sect, 'file', fallback=cache_default['file'])
+        ttl = self.conf.getfloat(sect, 'ttl', fallback=cache_default['ttl'])
+        max_size = self.conf.getint(sect, 'max_size',
+                                    fallback=cache_default['max_size'])
+
+        self.offline = offline
+        if enable or offline:
+            self.cache = cache.DiskCache(file, ttl=ttl,
+                                         max_size=max_size * 1024 * 1024)
+        else:
+            self.cache = None
+
+    def setCatalogCache(self):
+        """
+        Set up :attr:`catalog_cache` from ``[ESGFSearch.catalog_cache]``
+        section of config file, used by search results of this
+        instance.
+
+        Called by the constructor, no need to call explicitly unless
+        you modify :attr:`conf`.
+        """
+        sect = 'ESGFSearch.catalog_cache'
+        d = catalog_cache_default
+        enable = self.conf.getboolean(sect, 'enable', fallback=d['enable'])
+        file = self.conf.get(sect, 'file', fallback=d['file'])
+        max_size = self.conf.getint(sect, 'max_size',
+                                    fallback=d['max_size'])
+
+        if enable:
+            self.catalog_cache = cache.DiskCache(
+                file, ttl=None, max_size=max_size * 1024 * 1024)
+        else:
+            self.catalog_cache = None
+
+    def _query(self, base_url, fields):
+        # Issue one request to the search service, returns decoded
+        # JSON as a dict, or None if failed.
+        chunks = self._fetch(base_url, fields)
+        if chunks is None:
+            return None
+        # don't know why but returned are bytes, not str.
+        return json.loads(b''.join(chunks).decode())
+
+    def _fetch(self, base_url, fields):
+        # Issue one request to the search service, returns an iterator
+        # of chunks of the response body, or None if failed.
+        # Responses are stored in/served from the cache, if enabled.
+        if self.cache is None:
+            return self._request(base_url, fields)
+
+        key, data = self._cacheLookup(base_url, fields)
+        if data is not None:
+            return [data]
+
+        chunks = self._request(base_url, fields)
+        if chunks is None:
+            return None
+        return self._storeChunks(key, chunks)
+
+    def _cacheLookup(self, base_url, fields):
+        # Returns cache key and cached response or None.
+        key = cache.makeKey(base_url, fields)
+        data = self.cache.get(key, stale=self.offline)
+        if data is not None:
+            if self._debug:
+                print(f'dbg:ESGFSearch:cache hit:{key}')
+            self.metrics.record(_searchStage(fields),
+                                urlparse(base_url).netloc,
+                                nbytes=len(data), cache_hit=True)
+        elif self.offline:
+            raise cache.CacheMissError(
+                f'not found in cache (offline mode): {base_url}')
+        return key, data
+
+    def _storeChunks(self, key, chunks):
+        # Pass through `chunks`, and store them to the cache when all
+        # of them are consumed.
+        data = []
+        for chunk in chunks:
+            data.append(chunk)
+            yield chunk
+        self.cache.put(key, b''.join(data))
+
+    def _request(self, base_url, fields):
+        # Issue one request to the search service, returns an iterator
+        # of chunks of the response body, or None if failed.
         try:
-            r = http.request('GET', base_url, fields=self.params)
+            with metrics.stage(_searchStage(fields)):
+                r = self.session.request('GET', base_url, fields=fields,
+                                         preload_content=False)
         except Exception as e:
             print('Error in http.request():')
             print(e.args)
             raise
-            return []
         if (r.status != 200):
             print('Bad Status:', r.status)
             print(r.data.decode())
-            return []
-        # don't know why but returned are bytes, not str.
-        result = json.loads(r.data.decode())
+            r.release_conn()
+            return None
+        return _streamBody(r)
 
-        if self._debug:
-            print('dbg:doSearch:numFound:', result['response']['numFound'])
+    def saveResults(self, file, append=False):
+        """
+        Save :attr:`.datainfo` to `file`.
+
+        Args:
+            file (path-like): result file, see :mod:`resultstore`.
+            append (bool): keep results already saved in `file`, or not.
+        """
+        store = resultstore.ResultStore(file)
+        try:
+            store.save(self.datainfo, append=append)
+        finally:
+            store.close()
+
+    def loadResults(self, file, facets=None):
+        """
+        Load search results saved by :meth:`.saveResults` from `file`
+        as :attr:`.datainfo`.
+
+        Args:
+            file (path-like): result file, see :mod:`resultstore`.
+            facets (dict): load only datasets matching all of them,
+                           such as ``{'source_id': 'MIROC6,MRI-ESM2-0'}``.
+
+        Returns:
+            list(esgfdatainfo.ESGFDataInfo): loaded results, also set
+            as :attr:`.datainfo`.
+
+        :attr:`.numFound` is set as the number of loaded results.
+        """
+        store = resultstore.ResultStore(file)
+        try:
+            self.datainfo = store.load(facets, **self._dataInfoArgs())
+        finally:
+            store.close()
+        self.numFound = len(self.datainfo)
+        return self.datainfo
+
+    async def asearch(self, params=None, base_url=None, stages=None,
+                      timeout=None):
+        """
+        Do search via ESGF RESTful API, asynchronously.
 
-        if (result['response']['numFound'] == 0):
+        This is a coroutine, counterpart of :meth:`.doSearch`.  Search
+        results are set as :attr:`.datainfo` and also returned.
+
+        Args:
+            params (dict): keyword parameters and facet parameters.
+            base_url : base URL of the ESGF search service.
+            stages (tuple(str)): stages to be done after the search,
+                                 see :meth:`.aresolve`.
+            timeout (float): timeout in seconds of each request.
+
+        Returns:
+            list(esgfdatainfo.ESGFDataInfo): search results
+
+        Raises:
+            NotFoundError: raised if no catalog found.
+
+        Other arguments are treated as the same as :meth:`.doSearch`.
+        """
+        if params:
+            self.params.update(params)
+
+        groups = await self._adocs(dict(self.params), base_url,
+                                   timeout=timeout)
+        self.datainfo = [self._copiesDataInfo(copies) for copies in groups]
+
+        if (self.numFound == 0):
             raise NotFoundError('No catalog found.')
 
-        self.datainfo = [
-            esgfdatainfo.ESGFDataInfo(attribs=doc)
-            for doc in result['response']['docs']
-        ]
-        if self._debug:
-            for dinfo in self.datainfo:
-                print(dinfo.cat_url)
+        await self.aresolve(stages, timeout=timeout)
+        return self.datainfo
 
-        for dinfo in self.datainfo:
-            dinfo.getDataURL(self.aggregate)
+    async def aresolve(self, stages=None, timeout=None):
+        """
+        Do stages after the search for each of :attr:`.datainfo`,
+        asynchronously.
 
-        if self._debug:
-            print('dbg:ESGFSearch.getDataURLs:')
-            for dinfo in self.datainfo:
-                print(f"- master id:{dinfo.master_id},\n data_url:")
-                pprint(dinfo.data_url)
+        This is a coroutine, counterpart of :meth:`.resolve`, with
+        the same limits of concurrency.  ``catalog`` and ``dds`` are
+        done by :meth:`~esgfdatainfo.ESGFDataInfo.aresolve` and
+        :meth:`~esgfdatainfo.ESGFDataInfo.aget_dds`, and ``local`` is
+        done by :meth:`.findLocalFiles` in the default executor of the
+        event loop, after the others.
+
+        If one of datasets fails, or this is cancelled, the others are
+        cancelled.
+
+        Args:
+            stages (tuple(str)): stages to be done, overrides
+                                 :attr:`stages`.
+            timeout (float): timeout in seconds of each request.
+        """
+        stages = self._checkStages(stages)
+        self.dds_memo.clear()
+        if 'files' in stages:
+            await self.asearchFiles(timeout=timeout)
+            if not self.aggregate:
+                stages = [st for st in stages if st != 'catalog']
+
+        loop = asyncio.get_running_loop()
+        limit = asyncio.Semaphore(self.max_workers)
+        node_limits = {}
+
+        async def _resolve(dinfo):
+            node = getattr(dinfo, 'data_node', None)
+            if node not in node_limits:
+                node_limits[node] = asyncio.Semaphore(
+                    self.max_workers_per_node)
+            async with node_limits[node], limit:
+                if 'catalog' in stages:
+                    await dinfo.aresolve(timeout=timeout)
+                if 'dds' in stages:
+                    await dinfo.aget_dds(timeout=timeout)
+
+        await _arunAll(_resolve(dinfo) for dinfo in self.datainfo)
+        if 'local' in stages:
+            await loop.run_in_executor(None, self.findLocalFiles)
+
+    async def asearchFiles(self, datainfo=None, base_url=None,
+                           batch_size=None, timeout=None):
+        """
+        Do file-level search for datasets, asynchronously.
 
-        for dinfo in self.datainfo:
-            dinfo.getDDS() 
-            dinfo.findLocalFile(self.base_dir)
+        This is a coroutine, counterpart of :meth:`.searchFiles`.
 
+        Args:
+            timeout (float): timeout in seconds of each request.
+
+        Other arguments are the same as :meth:`.searchFiles`.
+        """
+        if not base_url:
+            base_url = self.search_service + self.service_type
+        datasets, batches = self._fileBatches(datainfo, batch_size)
+        limit = asyncio.Semaphore(self.max_workers)
+
+        async def _search(fields):
+            async with limit:
+                docs, _ = await self._aallPages(base_url, fields, timeout)
+            return docs
+
+        results = await _arunAll(_search(fields) for fields in batches)
+        self._setFiles(datasets, results)
+
+    async def _adocs(self, fields, base_url=None, page_size=None,
+                     timeout=None):
+        # Search with query parameters `fields`, returns a list of
+        # copies of each dataset, as _iterDocs().
+        federated = (not base_url and len(self.index_nodes) > 1)
+        if not base_url:
+            base_url = self.search_service + self.service_type
+        self._searchFields(fields, page_size)
+
+        self.numFound = None
+        if federated:
+            groups = await self._afederatedSearch(fields, timeout)
+            self.numFound = len(groups)
+        else:
+            docs, self.numFound = await self._aallPages(base_url, fields,
+                                                        timeout)
+            groups = [[doc] for doc in docs]
+        return groups
+
+    async def _aallPages(self, base_url, fields, timeout=None):
+        # Request the first page, and then the rest concurrently.
+        # Returns a list of docs and numFound.
+        fields = dict(fields)
+        offset = int(fields.get('offset', 0))
+        limit = int(fields['limit'])
+        first = await self._aquery(base_url, fields, timeout)
+        if first is None:
+            return [], None
+        numFound = first['response']['numFound']
+        docs = first['response']['docs']
+        if not docs:
+            return docs, numFound
+
+        async def _page(offset):
+            res = await self._aquery(base_url, dict(fields, offset=offset),
+                                     timeout)
+            return [] if res is None else res['response']['docs']
+
+        offsets = range(offset + len(docs), numFound, limit)
+        for page in await _arunAll(_page(o) for o in offsets):
+            docs += page
+        return docs, numFound
+
+    async def _afederatedSearch(self, fields, timeout=None):
+        # Asynchronous counterpart of _federatedSearch().
+        urls = [node + self.service_type for node in self.index_nodes]
+        tasks = {asyncio.ensure_future(self._aallPages(url, fields, timeout)):
+                 url for url in urls}
+        results = []   # in order of completion
+        errors = []
+        try:
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED)
+                for t in done:
+                    try:
+                        docs, _ = t.result()
+                    except Exception as e:
+                        print(f'Error in searching {tasks[t]}:', e.args)
+                        errors.append(e)
+                        continue
+                    results.append(docs)
+                if results and self.federation == 'first':
+                    break
+        finally:
+            # do not wait for slow nodes in 'first' mode.
+            for t in tasks:
+                t.cancel()
+
+        if not results:
+            if errors:
+                raise errors[0]
+            return []
+        return _dedupDocs(doc for docs in results for doc in docs)
+
+    async def _aquery(self, base_url, fields, timeout=None):
+        # Asynchronous counterpart of _query().
+        key = None
+        if self.cache is not None:
+            key, data = self._cacheLookup(base_url, fields)
+            if data is not None:
+                return json.loads(data.decode())
+
+        with metrics.stage(_searchStage(fields)):
+            r = await self.session.arequest('GET', base_url, fields=fields,
+                                            timeout=timeout)
+        if (r.status != 200):
+            print('Bad Status:', r.status)
+            print(r.data.decode())
+            return None
+        if key is not None:
+            self.cache.put(key, r.data)
+        return json.loads(r.data.decode())
 
     @property
     def cat_urls(self):
@@ -326,11 +1926,234 @@ class ESGFSearch():
         """
         return [dinfo.local_files for dinfo in self.datainfo]
 
+    @property
+    def estimated_bytes(self):
+        """
+        Estimated bytes of data of each dataset, from DDS, see
+        :meth:`esgfdatainfo.ESGFDataInfo.estimateBytes`.
+
+        :type: list(int)
+        """
+        return [dinfo.estimated_bytes for dinfo in self.datainfo]
+
+
+
+class _Page():
+    # One page of search results, docs are decoded as iterated.
+
+    def __init__(self, chunks):
+        self._stream = jsonstream.ItemStream(chunks, path=('response', 'docs'))
+        self.count = 0
+
+    @property
+    def numFound(self):
+        # available after the first doc, or after iterated.
+        return self._stream.meta['response']['numFound']
+
+    def __iter__(self):
+        for doc in self._stream:
+            self.count += 1
+            yield doc
+
+
+def _streamBody(r):
+    # Iterate the body of response `r` by chunks.
+    try:
+        yield from r.stream(_chunk_size)
+    finally:
+        r.release_conn()
+
+
+async def _arunAll(coros):
+    # Run `coros` concurrently, returns a list of results in order.
+    #
+    # If one of them fails, or this is cancelled, the others are
+    # cancelled, and the first exception (in order of `coros`) is
+    # raised.
+    tasks = [asyncio.ensure_future(c) for c in coros]
+    if not tasks:
+        return []
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+    finally:
+        pending = [t for t in tasks if not t.done()]
+        for t in pending:
+            t.cancel()
+        if pending:
+            await asyncio.wait(pending)
+    # retrieve all of exceptions, not to be warned.
+    errors = [t.exception() for t in tasks if not t.cancelled()]
+    for e in errors:
+        if e is not None:
+            raise e
+    return [t.result() for t in tasks]
+
+
+def _dedupDocs(docs):
+    # Deduplicate `docs` by `instance_id`, returns a list of copies of
+    # each dataset, the preferred one first.
+    #
+    # `docs` should be ordered by preference, for example, results from
+    # the fastest index node first.  The original (not replica) copy
+    # is preferred over the order, also for the same `id`.  Copies
+    # with other `id`, that is, on other data nodes, follow it to be set
+    # as replicas.  The order of the first appearance of each
+    # `instance_id` is kept.
+    res = {}
+    for doc in docs:
+        key = doc.get('instance_id', doc.get('id'))
+        copies = res.setdefault(key, {})
+        cid = doc.get('id')
+        if (cid not in copies or
+                (_isReplica(copies[cid]) and not _isReplica(doc))):
+            copies[cid] = doc
+    return [sorted(copies.values(), key=_isReplica)
+            for copies in res.values()]
+
+
+def _searchStage(fields):
+    # Stage of metrics of the request to the search service.
+    return 'files' if fields.get('type') == 'File' else 'search'
+
+
+def _facetValues(value):
+    # Values of a facet parameter, comma-separated str or list.
+    if type(value) is str:
+        return [v.strip() for v in value.split(',') if v.strip()]
+    if type(value) in (list, tuple):
+        return [str(v).strip() for v in value]
+    return [value]
+
+
+def _packValues(values, counts, limit):
+    # Pack `values` in order into groups of at most `limit` results by
+    # `counts`, {value: count}.  A value over `limit` is a group by
+    # itself.  Returns a list of (group, count).
+    res = []
+    group, found = [], 0
+    for v in values:
+        n = counts.get(v, 0)
+        if group and found + n > limit:
+            res.append((group, found))
+            group, found = [], 0
+        group.append(v)
+        found += n
+    if group:
+        res.append((group, found))
+    return res
+
+
+def _isReplica(doc):
+    return _isTrue(doc.get('replica', False))
+
+
+def _isTrue(value):
+    # boolean field of a doc may be a bool, str, or list of them.
+    if type(value) is list:
+        value = value[0]
+    return value in (True, 'true', 'True')
+
+
+def _listTree(base_dir, dirs, max_workers, recorder):
+    # List directories `dirs` (tuples of components under `base_dir`)
+    # and their ancestors, each once, level by level, recorded to
+    # Metrics `recorder`.  Subtrees not existing are skipped.  Returns
+    # {dir: set of names} of `dirs` existing.
+    children = {}
+    for d in dirs:
+        for i in range(len(d)):
+            children.setdefault(d[:i], set()).add(d[i])
+
+    res = {}
+    level = [()]
+    with ThreadPoolExecutor(max_workers) as ex:
+        while level:
+            listings = ex.map(
+                lambda d: _listDir(base_dir.joinpath(*d), recorder), level)
+            next_level = []
+            for d, names in zip(level, listings):
+                if d in dirs:
+                    res[d] = names
+                next_level += [d + (n,) for n in children.get(d, ())
+                               if n in names]
+            level = next_level
+    return res
+
+
+def _listDir(path, recorder):
+    # Names in directory `path`, empty if not exists.  Recorded to
+    # Metrics `recorder`.
+    t0 = time.monotonic()
+    error = False
+    try:
+        names = set(os.listdir(path))
+    except (FileNotFoundError, NotADirectoryError):
+        names = set()
+    except OSError as e:
+        print('Error in listing local directory:', e.args)
+        names = set()
+        error = True
+    recorder.record('local', 'local', time.monotonic() - t0, error=error)
+    return names
+
+
+def _runPerNode(tasks, max_workers, max_per_node):
+    # Run `tasks`, a list of (node, func, arg), in a thread pool.
+    #
+    # At most `max_workers` tasks are running at once, and at most
+    # `max_per_node` tasks for the same node.  Tasks are submitted
+    # round-robin over nodes, so that no node waits for the others.
+    # Returns a list of results in the same order as `tasks`.
+
+    queues = {}
+    for i, (node, func, arg) in enumerate(tasks):
+        queues.setdefault(node, deque()).append(i)
+    nodes = deque(queues)
+    active = dict.fromkeys(queues, 0)
+    results = [None] * len(tasks)
+    running = {}
+    error = None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while running or (nodes and error is None):
+            # fill up workers, round-robin over nodes.
+            stalled = 0
+            while (error is None and nodes and len(running) < max_workers
+                   and stalled < len(nodes)):
+                node = nodes[0]
+                nodes.rotate(-1)
+                if active[node] >= max_per_node:
+                    stalled += 1
+                    continue
+                stalled = 0
+                i = queues[node].popleft()
+                if not queues[node]:
+                    nodes.remove(node)
+                func, arg = tasks[i][1:]
+                running[executor.submit(func, arg)] = (i, node)
+                active[node] += 1
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for f in done:
+                i, node = running.pop(f)
+                active[node] -= 1
+                try:
+                    results[i] = f.result()
+                except Exception as e:
+                    if error is None:
+                        error = e
+
+    if error is not None:
+        raise error
+    return results
 
 
 ########################################################################
 # defaults
 
+#: Size of chunks to read responses from the search service.
+_chunk_size = 65536
+
 #: Default search service URL
 search_service_default = 'http://esgf-node.llnl.gov/esg-search/'
 # search_service_default = 'http://esgf-data.dkrz.de/esg-search/'
@@ -338,8 +2161,89 @@ search_service_default = 'http://esgf-node.llnl.gov/esg-search/'
 #: Default service type: Not configurable
 service_type_default = 'search'
 
+#: Default for requesting only necessary fields or not.
+projection_default = True
+
+#: Fields necessary in this module, in addition to
+#: :attr:`esgfdatainfo.ESGFDataInfo.managedAttribNames`.
+fields_required = (
+    'replica',
+    'latest',
+    'retracted',
+    'size',
+    'index_node',
+    '_timestamp',
+)
+
+#: Default state file for :meth:`ESGFSearch.doSync`.
+sync_file_default = '~/.cache/cmiputil/sync.sqlite'
+
+#: Keywords not affecting the query key of :meth:`ESGFSearch.doSync`.
+_sync_ignored_keywords = ('offset', 'limit', 'fields', 'from', 'to')
+
+#: Default way to treat results from multiple index nodes.
+federation_default = 'merge'
+
 aggregate_default = True
 
+#: All stages of :meth:`ESGFSearch.doSearch`, in order.
+stages_all = ('search', 'files', 'catalog', 'dds', 'local')
+
+#: Default stages of :meth:`ESGFSearch.doSearch`.
+stages_default = ('search', 'catalog', 'dds', 'local')
+
+#: Method of :class:`esgfdatainfo.ESGFDataInfo` for each stage, done
+#: for each dataset by :meth:`ESGFSearch.resolve`.
+_stage_methods = {
+    'catalog': 'getDataURL',
+    'dds': 'getDDS',
+}
+
+#: Default number of search results requested at once.
+page_size_default = 1000
+
+#: Default maximum number of concurrent accesses to data nodes.
+max_workers_default = 8
+
+#: Default maximum number of concurrent accesses to one data node.
+max_workers_per_node_default = 2
+
+#: Default number of datasets per one request of file-level search.
+files_batch_default = 20
+
+#: Default maximum number of search results of one sub-query.
+split_limit_default = 10000
+
+#: Default for selecting replicas or not.
+select_replica_default = False
+
+#: Default for keeping fields of search results not in slots of
+#: :class:`esgfdatainfo.ESGFDataInfo`.
+keep_raw_default = True
+
+#: Default policy of requesting DDS, see :mod:`esgfdatainfo`.
+dds_policy_default = 'all'
+
+#: Keywords never split by :meth:`ESGFSearch.planQueries`.
+_split_ignored_keywords = ('format', 'limit', 'offset', 'type', 'fields',
+                           'facets', 'from', 'to', 'query', 'shards',
+                           'distrib')
+
+#: Fields requested by file-level search.
+file_fields = (
+    'id',
+    'dataset_id',
+    'title',
+    'url',
+    'size',
+    'checksum',
+    'checksum_type',
+    'data_node',
+)
+
+#: Keywords passed to file-level search from :attr:`ESGFSearch.params`.
+_files_keywords = ('format', 'distrib')
+
 #: Default keywords for RESTful API.
 keywords_default = {
     'replica': 'false',
@@ -349,10 +2253,25 @@ keywords_default = {
 #: Keywords not configurable for RESTful API.
 keywords_non_configurable = {
     'format': r'application/solr+json',
-    'limit': 10000,
     'type': 'Dataset',  # must be to get catalog
 }
 
+#: Default configuration of the response cache.
+cache_default = {
+    'enable': False,
+    'file': '~/.cache/cmiputil/esgfsearch.sqlite',
+    'ttl': 86400,
+    'max_size': 256,
+    'offline': False,
+}
+
+#: Default configuration of the catalog cache.
+catalog_cache_default = {
+    'enable': False,
+    'file': '~/.cache/cmiputil/catalog.sqlite',
+    'max_size': 64,
+}
+
 #: Default fasets for RESTful API.
 facets_default = {
     'table_id': 'Amon',
@@ -381,8 +2300,25 @@ def getDefaultConf():
     res = {}
     res['ESGFSearch'] = {
         'search_service': search_service_default,
-        'aggregate': aggregate_default
+        'projection': projection_default,
+        'extra_fields': '',
+        'sync_file': sync_file_default,
+        'index_nodes': '',
+        'federation': federation_default,
+        'aggregate': aggregate_default,
+        'stages': ', '.join(stages_default),
+        'page_size': page_size_default,
+        'max_workers': max_workers_default,
+        'max_workers_per_node': max_workers_per_node_default,
+        'files_batch': files_batch_default,
+        'split_limit': split_limit_default,
+        'select_replica': select_replica_default,
+        'probe_ttl': replica.probe_ttl_default,
+        'keep_raw': keep_raw_default,
+        'dds_policy': dds_policy_default,
     }
+    res['ESGFSearch.cache'] = cache_default
+    res['ESGFSearch.catalog_cache'] = catalog_cache_default
     res['ESGFSearch.keywords'] = keywords_default
     res['ESGFSearch.facets'] = facets_default
     return res
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Incremental JSON decoder for large search responses.
+
+Responses from the ESGF search service (in Solr JSON format) are like
+below, where ``docs`` may contain thousands of search results::
+
+    {"responseHeader": {...},
+     "response": {"numFound": 1234, "start": 0, "docs": [{...}, {...}, ...]},
+     "facet_counts": {...}}
+
+:class:`ItemStream` decodes such JSON text incrementally, from an
+iterable of bytes chunks such as `urllib3.HTTPResponse.stream()`_, and
+yields each element of the array specified by `path` (``docs`` above)
+as soon as it is decoded.  Other values along the `path` are stored in
+:attr:`ItemStream.meta`.  So the peak memory usage is about one element
+plus one chunk, rather than the whole response.
+
+Example:
+
+    >>> from cmiputil import jsonstream
+    >>> chunks = [b'{"response": {"numFound": 2, "do',
+    ...           b'cs": [{"id": "a"}, {"id"', b': "b"}]}, "x": 1}']
+    >>> stream = jsonstream.ItemStream(chunks, path=('response', 'docs'))
+    >>> for doc in stream:
+    ...     print(stream.meta['response']['numFound'], doc)
+    2 {'id': 'a'}
+    2 {'id': 'b'}
+    >>> stream.meta
+    {'response': {'numFound': 2}, 'x': 1}
+
+.. _urllib3.HTTPResponse.stream():
+   https://urllib3.readthedocs.io/en/latest/reference/urllib3.response.html
+
+"""
+__author__ = 'T.Inoue'
+__credits__ = 'Copyright (c) 2019 RIST'
+__version__ = 'v20190714'
+__date__ = '2019/07/14'
+
+import codecs
+import json
+
+_ws = ' \t\n\r'
+
+
+class ItemStream():
+    """
+    Iterator over elements of an array in a JSON text, decoded
+    incrementally.
+
+    Args:
+        chunks (iterable(bytes)): JSON text in UTF-8, split arbitrarily.
+        path (tuple(str)): keys of nested objects to the array.
+
+    Attributes:
+        meta (dict): values along `path` other than the array, set as
+                     they are decoded.
+
+    Raises:
+        ValueError: JSON text is invalid or truncated.
+
+    If the array at `path` does not exist, nothing is yielded.
+    """
+
+    def __init__(self, chunks, path=('response', 'docs')):
+        self.path = tuple(path)
+        self.meta = {}
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json = json.JSONDecoder()
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+
+    def __iter__(self):
+        if self._peek() != '':
+            yield from self._object(self.path, self.meta)
+        if self._peek() != '':
+            self._error('extra data')
+
+    def _fill(self):
+        # Read next chunk, returns False at EOF.
+        if self._eof:
+            return False
+        try:
+            chunk = next(self._chunks)
+        except StopIteration:
+            self._buf = self._buf[self._pos:] + self._decoder.decode(
+                b'', final=True)
+            self._pos = 0
+            self._eof = True
+            return False
+        self._buf = self._buf[self._pos:] + self._decoder.decode(chunk)
+        self._pos = 0
+        return True
+
+    def _peek(self):
+        # Skip whitespaces and return the next char, '' at EOF.
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in _ws:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ''
+
+    def _expect(self, chars):
+        c = self._peek()
+        if c == '' or c not in chars:
+            self._error(f'expected {chars!r}, got {c!r}')
+        self._pos += 1
+        return c
+
+    def _value(self):
+        # Decode one whole value.
+        self._peek()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                self._error('invalid or truncated value')
+            # a number may continue in the next chunk.
+            if end == len(self._buf) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def _object(self, path, meta):
+        self._expect('{')
+        if self._peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            key = self._value()
+            self._expect(':')
+            if key == path[0] and len(path) == 1 and self._peek() == '[':
+                yield from self._array()
+            elif key == path[0] and len(path) > 1 and self._peek() == '{':
+                meta[key] = {}
+                yield from self._object(path[1:], meta[key])
+            else:
+                meta[key] = self._value()
+            if self._expect(',}') == '}':
+                return
+
+    def _array(self):
+        self._expect('[')
+        if self._peek() == ']':
+            self._pos += 1
+            return
+        while True:
+            yield self._value()
+            if self._expect(',]') == ']':
+                return
+
+    def _error(self, msg):
+        raise ValueError(f'jsonstream: {msg} at {self._buf[self._pos:][:40]!r}')
+
+
+if (__name__ == '__main__'):
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Metrics of network accesses and stages of :mod:`esgfsearch`.
+
+Every request via :class:`session.Session` is recorded to its
+:class:`Metrics` instance (the shared one by default), with the *stage* it is issued for and the
+host it is sent to.  Stages are below:
+
+- ``search``: requests to the search service,
+- ``files``: file-level search, see :meth:`esgfsearch.ESGFSearch.searchFiles`,
+- ``catalog``: OPeNDAP catalogs,
+- ``dds``: DDS of datasets and files,
+- ``local``: finding local files, recorded with host ``local``,
+- ``probe``: probing data nodes, see :mod:`replica`,
+- ``download``: downloading files, see :mod:`download`,
+- ``other``: requests not in any stage.
+
+The stage is set by :func:`stage` for requests issued in it, in the
+same thread or asyncio task.  For each stage and host, below are
+counted:
+
+- ``requests``: number of requests, not including cache hits,
+- ``bytes``: bytes of response bodies (``Content-Length`` if the body
+  is streamed),
+- ``retries``: number of retries,
+- ``errors``: failed requests, raised or with status >= 400,
+- ``cache_hits``: responses served from the cache,
+- ``p50``, ``p95``: percentiles of latency in seconds, of the last
+  `max_samples` requests.
+
+:meth:`Metrics.asDict` (or :meth:`Metrics.toJSON`) exports them
+summarized per stage, per host, and per stage and host, so that you
+can find which data node is slow.  Functions added by
+:meth:`Metrics.addHook` are called with each record, for tracing.
+
+Each :class:`esgfsearch.ESGFSearch` instance creates a new
+:class:`Metrics` instance as its ``metrics`` attribute, and gives it
+to its own :class:`session.Session`, so that it records only requests
+of that instance.  The shared instance, obtained by :func:`getMetrics`
+and replaced by :func:`setMetrics`, records requests of the other
+sessions.
+
+Example:
+
+    >>> from cmiputil import metrics
+    >>> m = metrics.Metrics()
+    >>> with metrics.stage('dds'):
+    ...     m.record(metrics.currentStage(), 'node.a', latency=0.2, nbytes=100)
+    >>> m.record('dds', 'node.a', latency=0.4, nbytes=100, retries=1)
+    >>> m.asDict()['hosts']['node.a']
+    {'requests': 2, 'bytes': 200, 'retries': 1, 'errors': 0, 'cache_hits': 0, 'p50': 0.2, 'p95': 0.4}
+
+"""
+__author__ = 'T.Inoue'
+__credits__ = 'Copyright (c) 2019 RIST'
+__version__ = 'v20190714'
+__date__ = '2019/07/14'
+
+import contextvars
+import json
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+#: Default number of latency samples kept for each stage and host.
+max_samples_default = 10000
+
+#: Counters of each stage and host.
+counters = ('requests', 'bytes', 'retries', 'errors', 'cache_hits')
+
+_stage = contextvars.ContextVar('cmiputil_metrics_stage', default='other')
+
+_metrics = None
+_lock = threading.Lock()
+
+
+class Metrics():
+    """
+    Registry of counters and latencies, per stage and host.
+
+    Args:
+        max_samples (int): number of latency samples kept for each
+                           stage and host.
+
+    Instances are thread-safe.
+    """
+
+    def __init__(self, max_samples=max_samples_default):
+        self.max_samples = max_samples
+        self._counts = {}     # (stage, host) -> {counter: int}
+        self._latencies = {}  # (stage, host) -> deque of seconds
+        self._hooks = []
+        self._lock = threading.Lock()
+
+    def record(self, stage, host, latency=None, nbytes=0, retries=0,
+               error=False, cache_hit=False, **extra):
+        """
+        Record one request, or one cache hit.
+
+        Args:
+            stage (str): stage the request is issued for
+            host (str): host the request is sent to
+            latency (float): latency in seconds, ``None`` if unknown.
+            nbytes (int): bytes of the response body
+            retries (int): number of retries
+            error (bool): the request failed or not
+            cache_hit (bool): served from the cache, not requested.
+            extra: other items passed to hooks, such as ``url`` and
+                   ``status``.
+
+        Hooks are called with a dict of all of arguments, with key
+        ``bytes`` for `nbytes`.  Exceptions in hooks are printed, not
+        raised.
+        """
+        key = (stage, host)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = dict.fromkeys(counters, 0)
+                self._latencies[key] = deque(maxlen=self.max_samples)
+            if cache_hit:
+                counts['cache_hits'] += 1
+            else:
+                counts['requests'] += 1
+                if latency is not None:
+                    self._latencies[key].append(latency)
+            counts['bytes'] += nbytes or 0
+            counts['retries'] += retries or 0
+            counts['errors'] += bool(error)
+            hooks = list(self._hooks)
+
+        if hooks:
+            event = {'stage': stage, 'host': host, 'latency': latency,
+                     'bytes': nbytes, 'retries': retries, 'error': error,
+                     'cache_hit': cache_hit}
+            event.update(extra)
+            for hook in hooks:
+                try:
+                    hook(event)
+                except Exception as e:
+                    print('Error in metrics hook:', e.args)
+
+    def addHook(self, func):
+        """
+        Add `func`, called with each record as a dict, see :meth:`record`.
+        """
+        with self._lock:
+            self._hooks.append(func)
+
+    def removeHook(self, func):
+        """
+        Remove `func` added by :meth:`addHook`.
+        """
+        with self._lock:
+            self._hooks.remove(func)
+
+    def asDict(self):
+        """
+        Export counters and percentiles of latency.
+
+        Returns:
+            dict: ``{'stages': {stage: summary}, 'hosts': {host: summary},
+            'detail': {stage: {host: summary}}}``, where ``summary`` is
+            a dict of :data:`counters`, ``p50`` and ``p95``.
+        """
+        with self._lock:
+            items = [(key, dict(self._counts[key]), list(self._latencies[key]))
+                     for key in self._counts]
+
+        res = {'stages': {}, 'hosts': {}, 'detail': {}}
+        merged = {'stages': {}, 'hosts': {}}
+        for (stage, host), counts, lats in items:
+            res['detail'].setdefault(stage, {})[host] = _summary(counts, lats)
+            for kind, name in (('stages', stage), ('hosts', host)):
+                c, l = merged[kind].setdefault(
+                    name, (dict.fromkeys(counters, 0), []))
+                for k in counters:
+                    c[k] += counts[k]
+                l += lats
+        for kind in merged:
+            for name, (c, l) in merged[kind].items():
+                res[kind][name] = _summary(c, l)
+        return res
+
+    def toJSON(self, **kw):
+        """
+        Export :meth:`asDict` as JSON text.
+
+        Args:
+            kw: passed to :func:`json.dumps`, such as ``indent``.
+        """
+        return json.dumps(self.asDict(), **kw)
+
+    def clear(self):
+        """
+        Remove all records.  Hooks are kept.
+        """
+        with self._lock:
+            self._counts.clear()
+            self._latencies.clear()
+
+
+@contextmanager
+def stage(name):
+    """
+    Context manager to record requests in it as of stage `name`.
+    """
+    token = _stage.set(name)
+    try:
+        yield
+    finally:
+        _stage.reset(token)
+
+
+def currentStage():
+    """
+    Return the stage set by :func:`stage`, ``'other'`` if not set.
+    """
+    return _stage.get()
+
+
+def getMetrics():
+    """
+    Return the shared :class:`Metrics` instance.
+    """
+    global _metrics
+    with _lock:
+        if _metrics is None:
+            _metrics = Metrics()
+        return _metrics
+
+
+def setMetrics(metrics):
+    """
+    Set `metrics` as the shared :class:`Metrics` instance.
+    """
+    global _metrics
+    with _lock:
+        _metrics = metrics
+
+
+def percentile(values, p):
+    """
+    Percentile of `values` by the nearest-rank method, ``None`` if
+    empty.
+
+    Examples:
+        >>> percentile([1, 2, 3, 4], 50)
+        2
+        >>> percentile([1, 2, 3, 4], 95)
+        4
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(1, -(-len(values) * p // 100))
+    return values[int(rank) - 1]
+
+
+def _summary(counts, latencies):
+    res = dict(counts)
+    res['p50'] = percentile(latencies, 50)
+    res['p95'] = percentile(latencies, 95)
+    return res
+
+
+if (__name__ == '__main__'):
+    import doctest
+    doctest.testmod()
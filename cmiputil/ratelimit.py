@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Per-host rate limiting and fair scheduling of HTTP requests, used by
+:class:`session.Session`.
+
+Since all network accesses in :mod:`esgfsearch` and
+:mod:`esgfdatainfo` go through the shared :class:`session.Session`,
+its :class:`RateLimiter` limits all of them, as below:
+
+- Requests to each host are limited by a :class:`TokenBucket`, at most
+  ``rate`` requests per second on average.  The bucket holds up to
+  ``burst`` tokens, so that after an idle period up to ``burst``
+  requests go without waiting.  The rate of specific hosts can be set
+  by ``host_rates``.
+- At most ``max_requests`` requests are issued at once in total, by
+  :class:`FairScheduler`.  When it is full, free slots are granted to
+  waiting requests round-robin over hosts, so that requests to a busy
+  host do not delay requests to the others.
+
+Waiting for a token of one host does not hold a slot, so the other
+hosts go as fast as they can.  Asynchronous requests by
+:meth:`session.Session.arequest` wait for tokens and slots in the
+event loop by :meth:`RateLimiter.alimit`, sharing the limits with
+requests from threads.
+
+Example:
+
+    >>> from cmiputil import ratelimit
+    >>> limiter = ratelimit.RateLimiter(
+    ...     rate=10, host_rates=ratelimit.parseHostRates('slow.node: 2'))
+    >>> limiter.bucket('http://slow.node/thredds/catalog.xml').rate
+    2.0
+    >>> with limiter.limit('http://fast.node/thredds/catalog.xml'):
+    ...     pass     # request here
+
+Config File
+===========
+
+This module reads in config file, section below;
+
+- [Session]
+
+    ``rate`` (float):
+         maximum requests per second to one host, ``0`` means no limit
+
+    ``burst`` (int):
+         capacity of the token bucket of one host, that is, the number
+         of requests allowed without waiting after an idle period,
+         ``0`` means the same as ``rate``
+
+    ``host_rates`` (str):
+         comma-separated ``host: rate`` overriding ``rate``, such as
+         ``esgf-data.dkrz.de: 5, esgf-data2.diasjp.net: 2``
+
+    ``max_requests`` (int):
+         maximum requests at once in total, ``0`` means no limit
+
+"""
+__author__ = 'T.Inoue'
+__credits__ = 'Copyright (c) 2019 RIST'
+__version__ = 'v20190714'
+__date__ = '2019/07/14'
+
+import asyncio
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from urllib.parse import urlparse
+
+#: Default configuration, in [Session] section.
+ratelimit_default = {
+    'rate': 0,
+    'burst': 0,
+    'host_rates': '',
+    'max_requests': 32,
+}
+
+
+class TokenBucket():
+    """
+    Token bucket, that allows `rate` requests per second on average
+    and `burst` requests at once.
+
+    Args:
+        rate (float): tokens added per second, ``0`` means no limit.
+        burst (int): capacity of the bucket, ``0`` or ``None`` means
+                     ``max(1, rate)``.
+
+    Tokens are reserved in order of requests, and may be borrowed, so
+    that waiting requests are served in turn.
+
+    Example:
+
+        >>> b = TokenBucket(rate=10, burst=2)
+        >>> [round(b.reserve(), 1) for i in range(4)]
+        [0.0, 0.0, 0.1, 0.2]
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = burst or max(1, self.rate)
+        self._tokens = self.burst
+        self._time = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Take one token.
+
+        Returns:
+            float: seconds to wait before using the token.
+        """
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst,
+                               self._tokens + (now - self._time) * self.rate)
+            self._time = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self):
+        """
+        Take one token, waiting until available.
+        """
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def aacquire(self):
+        """
+        Take one token, waiting until available, asynchronously.
+        """
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class FairScheduler():
+    """
+    Limit the number of requests at once in total, granting free slots
+    round-robin over hosts.
+
+    Args:
+        max_active (int): maximum number of requests at once, ``0``
+                          means no limit.
+
+    Instances are thread-safe, and slots can be waited for from
+    threads by :meth:`acquire` and from event loops by
+    :meth:`aacquire` together.
+    """
+
+    def __init__(self, max_active):
+        self.max_active = max_active
+        self.active = 0
+        self._queues = {}      # host -> deque of waiting tickets
+        self._hosts = deque()  # hosts with waiting tickets, in turn
+        self._granted = set()
+        self._cond = threading.Condition()
+
+    def acquire(self, host):
+        """
+        Wait for a free slot for a request to `host`.
+        """
+        if not self.max_active:
+            return
+        with self._cond:
+            if self.active < self.max_active and not self._hosts:
+                self.active += 1
+                return
+            ticket = object()
+            self._enqueue(host, ticket)
+            while ticket not in self._granted:
+                self._cond.wait()
+            self._granted.remove(ticket)
+
+    async def aacquire(self, host):
+        """
+        Wait for a free slot for a request to `host`, asynchronously.
+
+        This is a coroutine, counterpart of :meth:`acquire`.  If
+        cancelled while waiting, the slot is not taken.
+        """
+        if not self.max_active:
+            return
+        with self._cond:
+            if self.active < self.max_active and not self._hosts:
+                self.active += 1
+                return
+            # the future is set by release(), from any thread.
+            ticket = asyncio.get_running_loop().create_future()
+            self._enqueue(host, ticket)
+        try:
+            await ticket
+        except asyncio.CancelledError:
+            with self._cond:
+                granted = ticket in self._granted
+                if not granted:
+                    self._dequeue(host, ticket)
+            if granted:
+                self.release()
+            raise
+        finally:
+            with self._cond:
+                self._granted.discard(ticket)
+
+    def release(self):
+        """
+        Release a slot, and grant it to the next host waiting.
+        """
+        if not self.max_active:
+            return
+        with self._cond:
+            self.active -= 1
+            while self.active < self.max_active and self._hosts:
+                host = self._hosts.popleft()
+                queue = self._queues[host]
+                ticket = queue.popleft()
+                if queue:
+                    self._hosts.append(host)
+                else:
+                    del self._queues[host]
+                if isinstance(ticket, asyncio.Future):
+                    try:
+                        ticket.get_loop().call_soon_threadsafe(_wake, ticket)
+                    except RuntimeError:
+                        continue  # the event loop is closed.
+                self._granted.add(ticket)
+                self.active += 1
+            self._cond.notify_all()
+
+    def _enqueue(self, host, ticket):
+        # must be called with the lock held.
+        if host not in self._queues:
+            self._queues[host] = deque()
+            self._hosts.append(host)
+        self._queues[host].append(ticket)
+
+    def _dequeue(self, host, ticket):
+        # Remove `ticket` not granted yet, must be called with the
+        # lock held.
+        queue = self._queues[host]
+        queue.remove(ticket)
+        if not queue:
+            del self._queues[host]
+            self._hosts.remove(host)
+
+    @contextmanager
+    def slot(self, host):
+        """
+        Context manager holding a slot for a request to `host`.
+        """
+        self.acquire(host)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class RateLimiter():
+    """
+    Per-host token buckets and a fair scheduler over hosts.
+
+    Args:
+        rate (float): maximum requests per second to one host,
+                      ``0`` means no limit.
+        burst (int): capacity of the token bucket of each host, see
+                     :class:`TokenBucket`.
+        host_rates (dict): ``{host: rate}`` overriding `rate`.
+        max_requests (int): maximum requests at once in total,
+                            ``0`` means no limit.
+
+    Attributes:
+        scheduler (FairScheduler): scheduler of all requests
+    """
+
+    def __init__(self, rate=0, burst=None, host_rates=None, max_requests=0):
+        self.rate = rate
+        self.burst = burst
+        self.host_rates = dict(host_rates or {})
+        self.scheduler = FairScheduler(max_requests)
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, url):
+        """
+        Return :class:`TokenBucket` for the host of `url`.
+        """
+        host = _host(url)
+        with self._lock:
+            b = self._buckets.get(host)
+            if b is None:
+                b = TokenBucket(self.host_rates.get(host, self.rate),
+                                self.burst)
+                self._buckets[host] = b
+            return b
+
+    def acquire(self, url):
+        """
+        Wait for a token of the host of `url` and then for a slot of
+        :attr:`scheduler`.  The slot must be released by
+        :meth:`release`.
+        """
+        self.bucket(url).acquire()
+        self.scheduler.acquire(_host(url))
+
+    def release(self):
+        """
+        Release a slot of :attr:`scheduler` held by :meth:`acquire`.
+        """
+        self.scheduler.release()
+
+    @contextmanager
+    def limit(self, url):
+        """
+        Context manager to issue a request to `url`, waiting for a
+        token of the host and then for a slot of :attr:`scheduler`.
+        """
+        self.acquire(url)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def aacquire(self, url):
+        """
+        Wait for a token of the host of `url` and then for a slot of
+        :attr:`scheduler`, asynchronously.  The slot must be released
+        by :meth:`release`.
+        """
+        await self.bucket(url).aacquire()
+        await self.scheduler.aacquire(_host(url))
+
+    @asynccontextmanager
+    async def alimit(self, url):
+        """
+        Asynchronous context manager to issue a request to `url`,
+        counterpart of :meth:`limit`.
+        """
+        await self.aacquire(url)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+def parseHostRates(text):
+    """
+    Parse ``host_rates`` in config file.
+
+    Example:
+
+        >>> parseHostRates('a.node: 5, b.node:0.5')
+        {'a.node': 5.0, 'b.node': 0.5}
+    """
+    res = {}
+    for item in (text or '').split(','):
+        if not item.strip():
+            continue
+        host, rate = item.rsplit(':', 1)
+        res[host.strip()] = float(rate)
+    return res
+
+
+def _wake(future):
+    # Wake the coroutine waiting for `future` in FairScheduler.aacquire().
+    if not future.done():
+        future.set_result(None)
+
+
+def _host(url):
+    # host (and port) of `url`, key of limits.
+    return urlparse(url).netloc
+
+
+if (__name__ == '__main__'):
+    import doctest
+    doctest.testmod()
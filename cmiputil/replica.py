@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Latency-aware selection of replicas, used by
+:meth:`esgfsearch.ESGFSearch.selectReplicas`.
+
+If replicas are allowed in search (``replica`` keyword is not
+``false``), the same dataset (the same ``instance_id``) may be found
+on several data nodes, whose throughput differs much.  This module
+groups such search results by :func:`groupReplicas`, and ranks data
+nodes by :class:`NodeMonitor`, that probes each data node by a cheap
+``HEAD`` request and caches its latency and health for ``ttl``
+seconds.
+
+The fastest live copy of each dataset is used, and the others are set
+as its replicas (see :meth:`esgfdatainfo.ESGFDataInfo.setReplicas`),
+tried in turn if accessing the OPeNDAP catalog fails.  Failures are
+also recorded to :class:`NodeMonitor`, so that the failed node is
+ranked last until the record expires.
+
+The shared :class:`NodeMonitor` instance is obtained by
+:func:`getMonitor`, and replaced by :func:`setMonitor`.
+:class:`esgfsearch.ESGFSearch` uses one of its own instead.
+
+Example:
+
+    >>> from cmiputil import replica
+    >>> mon = replica.NodeMonitor(ttl=600)
+    >>> mon.record('fast.node', 0.05)
+    >>> mon.record('slow.node', 0.8)
+    >>> mon.fail('dead.node')
+    >>> mon.rank(['dead.node', 'new.node', 'slow.node', 'fast.node'])
+    ['fast.node', 'slow.node', 'new.node', 'dead.node']
+
+Config File
+===========
+
+This module reads in config file, section below;
+
+- [ESGFSearch]
+
+    ``probe_ttl`` (float):
+         probed latency and health of a data node expire after this
+         seconds
+
+"""
+__author__ = 'T.Inoue'
+__credits__ = 'Copyright (c) 2019 RIST'
+__version__ = 'v20190714'
+__date__ = '2019/07/14'
+
+import threading
+import time
+from collections import namedtuple
+
+from cmiputil import metrics, session
+
+#: Default expiry of probed latency and health in seconds.
+probe_ttl_default = 600
+
+#: Probed state of a data node.
+#:
+#: - ``latency`` (float): latency in seconds, ``None`` if failed.
+#: - ``time`` (float): when probed or recorded, by :func:`time.monotonic`.
+NodeState = namedtuple('NodeState', ('latency', 'time'))
+
+_monitor = None
+_lock = threading.Lock()
+
+
+class NodeMonitor():
+    """
+    Cache of latency and health of data nodes, with expiry.
+
+    Args:
+        ttl (float): records expire after this seconds.
+        session (session.Session): session of probes, ``None`` means
+                                   the shared one.
+
+    Attributes:
+        ttl (float): records expire after this seconds.
+        session (session.Session): session of probes, or ``None``
+
+    Instances are thread-safe.
+    """
+    _debug = False
+
+    @classmethod
+    def _enable_debug(cls):
+        cls._debug = True
+
+    @classmethod
+    def _disable_debug(cls):
+        cls._debug = True
+
+    def __init__(self, ttl=probe_ttl_default, session=None):
+        self.ttl = ttl
+        self.session = session
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def probe(self, node, url):
+        """
+        Probe `node` by a ``HEAD`` request to `url` of that node, and
+        record the latency, or the failure.
+
+        Args:
+            node (str): data node
+            url (str): URL on `node`, such as an OPeNDAP catalog.
+
+        Returns:
+            float: latency in seconds, ``None`` if failed.
+
+        Failed requests are not retried.
+        """
+        sess = self.session
+        if sess is None:
+            sess = session.getSession()
+        t0 = time.monotonic()
+        try:
+            with metrics.stage('probe'):
+                r = sess.request('HEAD', url, retries=False)
+            ok = (r.status < 400)
+        except Exception as e:
+            if self._debug:
+                print(f'dbg:NodeMonitor.probe():{node}:', e)
+            ok = False
+        latency = (time.monotonic() - t0) if ok else None
+        if latency is None:
+            self.fail(node)
+        else:
+            self.record(node, latency)
+        return latency
+
+    def record(self, node, latency):
+        """
+        Record the `latency` of `node` in seconds.
+        """
+        with self._lock:
+            self._states[node] = NodeState(latency, time.monotonic())
+
+    def fail(self, node):
+        """
+        Record `node` as failed.
+        """
+        self.record(node, None)
+
+    def state(self, node):
+        """
+        Return :data:`NodeState` of `node`, ``None`` if not recorded
+        or expired.
+        """
+        with self._lock:
+            st = self._states.get(node)
+            if st is None:
+                return None
+            if time.monotonic() - st.time > self.ttl:
+                del self._states[node]
+                return None
+            return st
+
+    def rank(self, nodes):
+        """
+        Sort `nodes` by preference.
+
+        Live nodes come first in order of latency, then nodes not
+        probed yet (or expired), then failed nodes.  The order among
+        the same rank is kept.
+
+        Returns:
+            list(str): sorted nodes
+        """
+        def _key(node):
+            st = self.state(node)
+            if st is None:
+                return (1, 0)
+            if st.latency is None:
+                return (2, 0)
+            return (0, st.latency)
+        return sorted(nodes, key=_key)
+
+    def clear(self):
+        """
+        Remove all records.
+        """
+        with self._lock:
+            self._states.clear()
+
+
+def getMonitor():
+    """
+    Return the shared :class:`NodeMonitor` instance.
+    """
+    global _monitor
+    with _lock:
+        if _monitor is None:
+            _monitor = NodeMonitor()
+        return _monitor
+
+
+def setMonitor(monitor):
+    """
+    Set `monitor` as the shared :class:`NodeMonitor` instance.
+    """
+    global _monitor
+    with _lock:
+        _monitor = monitor
+
+
+def groupReplicas(datainfo):
+    """
+    Group search results by ``instance_id``.
+
+    Replicas already set to a search result, for example by
+    deduplication of :meth:`esgfsearch.ESGFSearch.splitSearch`, follow
+    it in its group.
+
+    Args:
+        datainfo (list(esgfdatainfo.ESGFDataInfo)): search results
+
+    Returns:
+        dict: ``{instance_id: [datainfo, ...]}``, in order of the first
+        appearance.
+    """
+    res = {}
+    for dinfo in datainfo:
+        key = dinfo.get('instance_id', dinfo.get('id'))
+        res.setdefault(key, []).extend([dinfo] + dinfo.replicas)
+    return res
+
+
+def selectReplicas(datainfo, monitor=None):
+    """
+    Select the fastest live copy of each dataset in `datainfo`,
+    ranked by `monitor`, and set the others as its replicas.
+
+    Nodes should be probed beforehand, see
+    :meth:`esgfsearch.ESGFSearch.selectReplicas`.
+
+    Args:
+        datainfo (list(esgfdatainfo.ESGFDataInfo)): search results
+        monitor (NodeMonitor): ``None`` means :func:`getMonitor`.
+
+    Returns:
+        list(esgfdatainfo.ESGFDataInfo): one for each ``instance_id``,
+        in order of the first appearance.
+    """
+    if monitor is None:
+        monitor = getMonitor()
+    res = []
+    for copies in groupReplicas(datainfo).values():
+        nodes = monitor.rank(list(dict.fromkeys(
+            d.get('data_node') for d in copies)))
+        copies = sorted(copies, key=lambda d: nodes.index(d.get('data_node')))
+        for dinfo in copies[1:]:
+            dinfo.setReplicas(())
+        copies[0].setReplicas(copies[1:])
+        res.append(copies[0])
+    return res
+
+
+if (__name__ == '__main__'):
+    import doctest
+    doctest.testmod()
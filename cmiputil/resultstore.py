@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compact persistent store of search results, used by
+:meth:`esgfsearch.ESGFSearch.saveResults` and
+:meth:`esgfsearch.ESGFSearch.loadResults`.
+
+:class:`ResultStore` keeps search results
+(:class:`esgfdatainfo.ESGFDataInfo` instances) in one `SQLite`_ file,
+one row per dataset.  Each attribute in :attr:`ResultStore.columns`,
+that is, managed attributes (see
+:attr:`esgfdatainfo.ESGFDataInfo.managedAttribNames`), URLs, file
+records, size, DDS and local files, is stored in its own column as
+JSON text.  Attributes not resolved yet are not stored, and not
+resolved by saving.  DDS is stored as its text.
+
+Values of facets are also indexed, so that datasets can be filtered
+by facets on loading, without loading the others.  The file is
+accessed via memory-mapping, so loading a part of a large inventory is
+fast.
+
+Example:
+
+    >>> from cmiputil import resultstore, esgfdatainfo
+    >>> st = resultstore.ResultStore('/tmp/cmiputil-results.sqlite')
+    >>> st.save([esgfdatainfo.ESGFDataInfo(
+    ...     {'id': 'a|node', 'source_id': 'MIROC6',
+    ...      'experiment_id': 'historical'})])
+    >>> st.count({'source_id': 'MIROC6'})
+    1
+    >>> [d.id for d in st.load({'experiment_id': 'historical, amip'})]
+    ['a|node']
+
+.. _SQLite: https://docs.python.org/3/library/sqlite3.html
+
+"""
+__author__ = 'T.Inoue'
+__credits__ = 'Copyright (c) 2019 RIST'
+__version__ = 'v20190714'
+__date__ = '2019/07/14'
+
+import json
+import sqlite3
+import threading
+from pathlib import Path
+
+from cmiputil import dds, esgfdatainfo
+
+#: Attributes obtained after the search, stored if resolved.
+resolved_attribs = ('data_url', 'agg_data_url', 'mf_data_url', 'files',
+                    'agg_dds', 'mf_dds', 'local_files')
+
+#: Managed attributes not indexed as facets.
+_not_facets = ('id', 'url', 'title', 'number_of_files',
+               'number_of_aggregations')
+
+#: Size of memory-mapping in bytes.
+mmap_size = 256 * 1024 * 1024
+
+#: Number of rows fetched at once by :meth:`ResultStore.iterLoad`.
+fetch_size = 1000
+
+
+class ResultStore():
+    """
+    Persistent store of search results.
+
+    Args:
+        file (path-like): SQLite database file, created if not exists.
+
+    Attributes:
+        file (Path): SQLite database file
+
+    Instances are thread-safe.
+    """
+
+    #: Stored attributes, in order of columns.
+    columns = tuple(dict.fromkeys(
+        esgfdatainfo.ESGFDataInfo.managedAttribNames +
+        ('size', 'cat_url') + resolved_attribs))
+
+    #: Attributes indexed as facets.
+    facets = tuple(a for a in esgfdatainfo.ESGFDataInfo.managedAttribNames
+                   if a not in _not_facets)
+
+    def __init__(self, file):
+        self.file = Path(file).expanduser()
+        self.file.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.file), timeout=30,
+                                   check_same_thread=False)
+        cols = ''.join(f', "{c}" TEXT' for c in self.columns)
+        with self._lock, self._db:
+            self._db.execute(f'PRAGMA mmap_size = {mmap_size}')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS datasets ('
+                ' rowid INTEGER PRIMARY KEY,'
+                ' key TEXT UNIQUE' + cols + ')')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS facets ('
+                ' dataset INTEGER,'
+                ' name TEXT,'
+                ' value TEXT)')
+            self._db.execute(
+                'CREATE INDEX IF NOT EXISTS facets_index'
+                ' ON facets (name, value, dataset)')
+
+    def save(self, datainfo, append=False):
+        """
+        Store search results.
+
+        Args:
+            datainfo (list(esgfdatainfo.ESGFDataInfo)): search results
+            append (bool): keep already stored results, or not.  Results
+                           with the same ``id`` are replaced.
+        """
+        rows = []
+        for dinfo in datainfo:
+            values = {a: _encode(a, getattr(dinfo, a)) for a in self.columns
+                      if dinfo.isSet(a)}
+            key = getattr(dinfo, 'id', None) or getattr(dinfo, 'instance_id')
+            facets = []
+            for f in self.facets:
+                v = getattr(dinfo, f) if dinfo.isSet(f) else None
+                for x in (v if type(v) is list else [v]):
+                    if x is not None:
+                        facets.append((f, str(x)))
+            rows.append((key, values, facets))
+
+        cols = ', '.join(f'"{c}"' for c in self.columns)
+        marks = ', '.join('?' for c in self.columns)
+        with self._lock, self._db:
+            if not append:
+                self._db.execute('DELETE FROM datasets')
+                self._db.execute('DELETE FROM facets')
+            for key, values, facets in rows:
+                old = self._db.execute(
+                    'SELECT rowid FROM datasets WHERE key = ?',
+                    (key,)).fetchone()
+                if old:
+                    self._db.execute('DELETE FROM facets WHERE dataset = ?',
+                                     old)
+                    self._db.execute('DELETE FROM datasets WHERE rowid = ?',
+                                     old)
+                cur = self._db.execute(
+                    f'INSERT INTO datasets (key, {cols}) VALUES (?, {marks})',
+                    (key,) + tuple(values.get(c) for c in self.columns))
+                self._db.executemany(
+                    'INSERT INTO facets VALUES (?, ?, ?)',
+                    [(cur.lastrowid, f, v) for f, v in facets])
+
+    def iterLoad(self, facets=None, aggregate=None, base_dir=None, **kw):
+        """
+        Load stored search results one by one.
+
+        Args:
+            facets (dict): load only datasets matching all of them,
+                           see :meth:`.count`.
+            aggregate (bool): given to :class:`esgfdatainfo.ESGFDataInfo`
+            base_dir (path-like): given to
+                                  :class:`esgfdatainfo.ESGFDataInfo`
+            kw: other keyword arguments given to
+                :class:`esgfdatainfo.ESGFDataInfo`
+
+        Yields:
+            esgfdatainfo.ESGFDataInfo: one search result, in order of
+            saving.
+        """
+        where, args = _where(facets)
+        cols = ', '.join(f'"{c}"' for c in self.columns)
+        # Rows are read in batches by a connection of its own, not to
+        # hold all of them in memory, nor the lock while yielding.
+        db = sqlite3.connect(str(self.file), timeout=30)
+        try:
+            db.execute(f'PRAGMA mmap_size = {mmap_size}')
+            cur = db.execute(
+                f'SELECT {cols} FROM datasets{where} ORDER BY rowid', args)
+            while True:
+                rows = cur.fetchmany(fetch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield self._dataInfo(row, aggregate=aggregate,
+                                         base_dir=base_dir, **kw)
+        finally:
+            db.close()
+
+    def _dataInfo(self, row, **kw):
+        # Make ESGFDataInfo from a row of columns, `kw` are given to it.
+        attribs = {c: _decode(c, v)
+                   for c, v in zip(self.columns, row) if v is not None}
+        # resolved attributes are set as is, not to be flattened.
+        resolved = {a: attribs.pop(a) for a in resolved_attribs
+                    if a in attribs}
+        dinfo = esgfdatainfo.ESGFDataInfo(attribs, **kw)
+        for a, v in resolved.items():
+            setattr(dinfo, a, v)
+        return dinfo
+
+    def load(self, facets=None, aggregate=None, base_dir=None, **kw):
+        """
+        Load stored search results.
+
+        Returns:
+            list(esgfdatainfo.ESGFDataInfo): search results
+
+        Arguments are the same as :meth:`.iterLoad`.
+        """
+        return list(self.iterLoad(facets, aggregate, base_dir, **kw))
+
+    def count(self, facets=None):
+        """
+        Count stored search results.
+
+        Args:
+            facets (dict): count only datasets matching all of them.
+                           Each value is a str, comma-separated str or
+                           a list of str, matching any of them.
+
+        Returns:
+            int: number of datasets
+        """
+        where, args = _where(facets)
+        with self._lock:
+            return self._db.execute(
+                f'SELECT COUNT(*) FROM datasets{where}', args).fetchone()[0]
+
+    def clear(self):
+        """
+        Remove all stored results.
+        """
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM datasets')
+            self._db.execute('DELETE FROM facets')
+
+    def close(self):
+        """
+        Close the database.
+        """
+        with self._lock:
+            self._db.close()
+
+
+def _where(facets):
+    # WHERE clause and its arguments to select datasets by `facets`.
+    conds = []
+    args = []
+    for name, values in (facets or {}).items():
+        if type(values) is str:
+            values = values.split(',')
+        values = [str(v).strip() for v in values]
+        marks = ', '.join('?' for v in values)
+        conds.append('rowid IN (SELECT dataset FROM facets'
+                     f' WHERE name = ? AND value IN ({marks}))')
+        args += [name] + values
+    if not conds:
+        return '', args
+    return ' WHERE ' + ' AND '.join(conds), args
+
+
+def _encode(attr, value):
+    # Encode a value of attribute as JSON text.
+    if attr == 'agg_dds':
+        value = None if value is None else value.text
+    elif attr == 'mf_dds':
+        value = [None if d is None else d.text for d in value]
+    elif attr == 'local_files':
+        value = [str(p) for p in value]
+    return json.dumps(value)
+
+
+def _decode(attr, text):
+    # Decode JSON text made by _encode().
+    value = json.loads(text)
+    if attr == 'agg_dds':
+        value = None if value is None else dds.parse_dataset(value)
+    elif attr == 'mf_dds':
+        value = [None if d is None else dds.parse_dataset(d) for d in value]
+    elif attr == 'local_files':
+        value = [Path(p) for p in value]
+    return value
+
+
+if (__name__ == '__main__'):
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,529 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Shared HTTP session for accessing ESGF services.
+
+All network accesses in :mod:`esgfsearch` and :mod:`esgfdatainfo`,
+that is, requests to the search service, OPeNDAP catalogs (also via
+`siphon`_, if used) and DDS, go through one :class:`Session` instance, which
+holds a pool of keep-alive connections per host, and applies
+timeouts and retries with exponential backoff.
+
+Each :class:`esgfsearch.ESGFSearch` instance creates its own
+:class:`Session` from its config file, and gives it to its search
+results and downloads.  Otherwise the shared instance, obtained by
+:func:`getSession` and replaced by :func:`setSession`, is used.
+
+Metrics
+=======
+
+Each request is recorded to :attr:`Session.metrics`, a
+:class:`metrics.Metrics` instance given to the constructor (the shared
+one by default), with its latency, bytes of the response body, number
+of retries and the stage set by :func:`metrics.stage`.  See
+:mod:`metrics`.
+
+Rate limiting
+=============
+
+Requests are limited per host, and scheduled fairly over hosts, by
+:attr:`Session.limiter`, a :class:`ratelimit.RateLimiter` instance, so
+that concurrent accesses do not flood one data node.  This applies to
+all requests via this session, including those by `siphon`_.  A
+request with ``preload_content=False`` holds its slot of the scheduler
+until the body is drained or the connection is released by
+``release_conn()``, so that streamed bodies are limited as well.  See
+:mod:`ratelimit` for the details and options in ``[Session]`` section
+of config file.
+
+Asynchronous API
+================
+
+:meth:`Session.arequest` is the asynchronous counterpart of
+:meth:`Session.request`, for `asyncio`_, on top of `aiohttp`_ (needed
+only if you use it).  Requests from the same event loop share one
+pool of connections, with the same limits, timeouts and retries as
+:meth:`Session.request`.  Call :meth:`Session.aclose` before the event
+loop is closed.
+
+Config File
+===========
+
+This module reads in config file, section below;
+
+- [Session]
+
+    ``connect_timeout`` (float):
+         timeout in seconds for connecting to a host
+
+    ``read_timeout`` (float):
+         timeout in seconds for reading a response
+
+    ``retries`` (int):
+         number of retries on connection errors and 5xx status
+
+    ``backoff_factor`` (float):
+         retries are delayed by ``backoff_factor * 2**(n-1)`` seconds
+
+    ``maxsize`` (int):
+         number of keep-alive connections per host
+
+    ``num_pools`` (int):
+         number of hosts whose connections are kept
+
+    ``rate``, ``burst``, ``host_rates``, ``max_requests``:
+         rate limiting, see :mod:`ratelimit`
+
+Example:
+
+    >>> from cmiputil import session
+    >>> s = session.Session(None)
+    >>> r = s.request('GET', 'http://esgf-node.llnl.gov/esg-search/search',
+    ...               fields={'limit': 0, 'format': 'application/solr+json'})
+    >>> r.status
+    200
+
+.. _siphon: https://www.unidata.ucar.edu/software/siphon/
+.. _asyncio: https://docs.python.org/3/library/asyncio.html
+.. _aiohttp: https://docs.aiohttp.org/
+
+"""
+__author__ = 'T.Inoue'
+__credits__ = 'Copyright (c) 2019 RIST'
+__version__ = 'v20190714'
+__date__ = '2019/07/14'
+
+import asyncio
+import threading
+import time
+import weakref
+from collections import namedtuple
+from pprint import pprint
+from urllib.parse import urlparse
+
+import urllib3
+
+from cmiputil import config, metrics, ratelimit
+
+#: Default configuration of [Session] section.
+session_default = {
+    'connect_timeout': 10.0,
+    'read_timeout': 60.0,
+    'retries': 3,
+    'backoff_factor': 0.5,
+    'maxsize': 10,
+    'num_pools': 50,
+}
+
+#: HTTP status to be retried.
+status_forcelist = (500, 502, 503, 504)
+
+#: Response of :meth:`Session.arequest`, whose body ``data`` is
+#: already read.
+AsyncResponse = namedtuple('AsyncResponse', ['status', 'data', 'headers'])
+
+_session = None
+_lock = threading.Lock()
+
+
+class Session():
+    """
+    HTTP connection pool with timeouts and retries.
+
+    If `conf` is given, it must be a :class:`config.Conf` instance and
+    `conffile` is ignored.  Otherwise `conffile` is read, treated as
+    the same as :class:`config.Conf`.
+
+    Args:
+        conffile (path-like): config file
+        conf (config.Conf): config already read
+        metrics (metrics.Metrics): requests are recorded to, ``None``
+                                   means the shared one.
+
+    Attributes:
+        connect_timeout (float): timeout for connecting in seconds
+        read_timeout (float): timeout for reading in seconds
+        retries (int): number of retries
+        backoff_factor (float): factor of exponential backoff
+        maxsize (int): number of keep-alive connections per host
+        num_pools (int): number of hosts whose connections are kept
+        pool: :class:`urllib3.PoolManager` instance
+        limiter: :class:`ratelimit.RateLimiter` instance
+        metrics: :class:`metrics.Metrics` instance, or ``None``
+    """
+    _debug = False
+
+    @classmethod
+    def _enable_debug(cls):
+        cls._debug = True
+
+    @classmethod
+    def _disable_debug(cls):
+        cls._debug = True
+
+    def __init__(self, conffile="", conf=None, metrics=None):
+        if conf is None:
+            conf = config.Conf(conffile)
+        self.metrics = metrics
+
+        sect = 'Session'
+        d = session_default
+        self.connect_timeout = conf.getfloat(
+            sect, 'connect_timeout', fallback=d['connect_timeout'])
+        self.read_timeout = conf.getfloat(
+            sect, 'read_timeout', fallback=d['read_timeout'])
+        self.retries = conf.getint(sect, 'retries', fallback=d['retries'])
+        self.backoff_factor = conf.getfloat(
+            sect, 'backoff_factor', fallback=d['backoff_factor'])
+        self.maxsize = conf.getint(sect, 'maxsize', fallback=d['maxsize'])
+        self.num_pools = conf.getint(
+            sect, 'num_pools', fallback=d['num_pools'])
+        d = ratelimit.ratelimit_default
+        self.limiter = ratelimit.RateLimiter(
+            rate=conf.getfloat(sect, 'rate', fallback=d['rate']),
+            burst=conf.getint(sect, 'burst', fallback=d['burst']),
+            host_rates=ratelimit.parseHostRates(
+                conf.get(sect, 'host_rates', fallback=d['host_rates'])),
+            max_requests=conf.getint(
+                sect, 'max_requests', fallback=d['max_requests']))
+
+        self.pool = urllib3.PoolManager(
+            num_pools=self.num_pools,
+            maxsize=self.maxsize,
+            block=False,
+            retries=self.retry,
+            timeout=self.timeout)
+        self._adapter = None
+        self._aclients = weakref.WeakKeyDictionary()
+        self._alock = threading.Lock()
+
+        if self._debug:
+            print('dbg:Session():')
+            pprint({k: v for k, v in vars(self).items()
+                    if not k.startswith('_')})
+
+    @property
+    def retry(self):
+        """
+        Retry policy.
+
+        :type: urllib3.util.Retry
+        """
+        return urllib3.util.Retry(
+            total=self.retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=status_forcelist,
+            raise_on_status=False)
+
+    @property
+    def timeout(self):
+        """
+        Timeouts for connecting and reading.
+
+        :type: urllib3.util.Timeout
+        """
+        return urllib3.util.Timeout(connect=self.connect_timeout,
+                                    read=self.read_timeout)
+
+    def request(self, method, url, fields=None, headers=None, **kw):
+        """
+        Issue a HTTP request.
+
+        Arguments are passed to :meth:`urllib3.PoolManager.request`.
+
+        Returns:
+            urllib3.HTTPResponse: response
+
+        Raises:
+            urllib3.exceptions.HTTPError: failed after retries.
+
+        If the status is still 5xx after retries, the last response is
+        returned, not raised.  The request is limited by
+        :attr:`limiter`, and recorded to :meth:`getMetrics`.
+        With ``preload_content=False``, the slot of the scheduler is
+        held until the body is drained, or ``release_conn()`` or
+        ``close()`` of the response is called.
+        """
+        if self._debug:
+            print(f'dbg:Session.request():{method} {url}')
+        self.limiter.acquire(url)
+        try:
+            t0 = time.monotonic()
+            try:
+                r = self.pool.request(method, url, fields=fields,
+                                      headers=headers, **kw)
+            except Exception:
+                self._record(method, url, t0, error=True)
+                raise
+        except BaseException:
+            self.limiter.release()
+            raise
+        if kw.get('preload_content', True):
+            self.limiter.release()
+            nbytes = len(r.data)
+        else:
+            _holdSlot(r, self.limiter.release)
+            nbytes = int(r.headers.get('Content-Length') or 0)
+        self._record(method, url, t0, r.status, nbytes, _retries(r))
+        return r
+
+    async def arequest(self, method, url, fields=None, headers=None,
+                       timeout=None):
+        """
+        Issue a HTTP request asynchronously.
+
+        This is a coroutine, counterpart of :meth:`request`.  Failed
+        requests are retried as :meth:`request`.
+
+        Args:
+            method (str): HTTP method
+            url (str): URL
+            fields (dict): query parameters
+            headers (dict): request headers
+            timeout (float): timeout in seconds of one attempt in total,
+                             overrides :attr:`connect_timeout` and
+                             :attr:`read_timeout`.
+
+        Returns:
+            AsyncResponse: response
+
+        Raises:
+            aiohttp.ClientError: failed after retries.
+            asyncio.TimeoutError: timed out after retries.
+
+        If the status is still 5xx after retries, the last response is
+        returned, not raised.  Each attempt waits for a token and a
+        slot of :attr:`limiter`, as :meth:`request`.  The request is recorded to
+        :meth:`getMetrics`, with latency from the first attempt.
+        """
+        aiohttp = _importAiohttp()
+        client = self._aclient()
+        if timeout is None:
+            timeout = aiohttp.ClientTimeout(sock_connect=self.connect_timeout,
+                                            sock_read=self.read_timeout)
+        else:
+            timeout = aiohttp.ClientTimeout(total=timeout)
+        # aiohttp accepts only str and numbers.
+        params = {k: str(v) for k, v in (fields or {}).items()}
+
+        t0 = None
+        for n in range(self.retries + 1):
+            if n > 0:
+                await asyncio.sleep(self.backoff_factor * 2 ** (n - 1))
+            async with self.limiter.alimit(url):
+                if t0 is None:
+                    t0 = time.monotonic()
+                if self._debug:
+                    print(f'dbg:Session.arequest():{method} {url}')
+                try:
+                    async with client.request(method, url, params=params,
+                                              headers=headers,
+                                              timeout=timeout) as r:
+                        res = AsyncResponse(r.status, await r.read(),
+                                            dict(r.headers))
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    if n == self.retries:
+                        self._record(method, url, t0, retries=n,
+                                     error=True)
+                        raise
+                    continue
+                except asyncio.CancelledError:
+                    self._record(method, url, t0, retries=n, error=True)
+                    raise
+            if res.status not in status_forcelist:
+                break
+        self._record(method, url, t0, res.status, len(res.data), n)
+        return res
+
+    async def aclose(self):
+        """
+        Close the pool of connections used by :meth:`arequest` in the
+        running event loop.
+        """
+        with self._alock:
+            client = self._aclients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.close()
+
+    def _aclient(self):
+        # aiohttp.ClientSession for the running event loop.
+        aiohttp = _importAiohttp()
+        loop = asyncio.get_running_loop()
+        with self._alock:
+            client = self._aclients.get(loop)
+            if client is None or client.closed:
+                connector = aiohttp.TCPConnector(
+                    limit=self.maxsize * self.num_pools,
+                    limit_per_host=self.maxsize)
+                client = aiohttp.ClientSession(connector=connector)
+                self._aclients[loop] = client
+        return client
+
+    def requestsAdapter(self):
+        """
+        Transport adapter for `requests`_, used by `siphon`_, that
+        shares the same timeouts, retries and pool size with this
+        session.
+
+        Returns:
+            requests.adapters.HTTPAdapter: adapter
+
+        .. _requests: https://requests.readthedocs.io/
+        """
+        if self._adapter is None:
+            self._adapter = _makeAdapter(self)
+        return self._adapter
+
+    def clear(self):
+        """
+        Close all pooled connections.
+        """
+        self.pool.clear()
+
+    def getMetrics(self):
+        """
+        Return :attr:`metrics`, or the shared :class:`metrics.Metrics`
+        instance if it is ``None``.
+        """
+        if self.metrics is None:
+            return metrics.getMetrics()
+        return self.metrics
+
+    def _record(self, method, url, t0, status=None, nbytes=0, retries=0,
+                error=False):
+        # Record a request started at `t0` to getMetrics().
+        self.getMetrics().record(
+            metrics.currentStage(), urlparse(url).netloc,
+            latency=time.monotonic() - t0, nbytes=nbytes, retries=retries,
+            error=error or (status is not None and status >= 400),
+            method=method, url=url, status=status)
+
+
+def getSession():
+    """
+    Return the shared :class:`Session` instance.
+
+    If not set yet, created from the default config file.
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            _session = Session()
+        return _session
+
+
+def setSession(session):
+    """
+    Set `session` as the shared :class:`Session` instance.
+    """
+    global _session
+    with _lock:
+        _session = session
+
+
+def _makeAdapter(session):
+    # `requests` is imported here since it is needed only for siphon.
+    from requests.adapters import HTTPAdapter
+
+    class _SharedAdapter(HTTPAdapter):
+        # Apply default timeout and rate limiting, and keep
+        # connections alive even if the session using this is closed,
+        # since this is shared.
+        def send(self, request, timeout=None, **kw):
+            if timeout is None:
+                timeout = (session.connect_timeout, session.read_timeout)
+            with session.limiter.limit(request.url):
+                t0 = time.monotonic()
+                try:
+                    r = super().send(request, timeout=timeout, **kw)
+                    if not kw.get('stream'):
+                        # read the body holding the slot.
+                        r.content
+                except Exception:
+                    session._record(request.method, request.url, t0,
+                                    error=True)
+                    raise
+            session._record(request.method, request.url, t0, r.status_code,
+                            int(r.headers.get('Content-Length') or 0),
+                            _retries(r.raw))
+            return r
+
+        def close(self):
+            pass
+
+    return _SharedAdapter(pool_connections=session.num_pools,
+                          pool_maxsize=session.maxsize,
+                          max_retries=session.retry)
+
+
+def _holdSlot(r, release):
+    # Call `release` once, when the connection of urllib3.HTTPResponse
+    # `r` is released (also by urllib3 when the body is drained) or
+    # closed, or `r` is garbage-collected.
+    done = weakref.finalize(r, release)
+    ref = weakref.ref(r)
+    for name in ('release_conn', 'close'):
+        setattr(r, name, _thenCall(getattr(type(r), name), ref, done))
+
+
+def _thenCall(method, ref, done):
+    # Call `method` of the object of weakref `ref`, and then `done`.
+    def call():
+        try:
+            method(ref())
+        finally:
+            done()
+    return call
+
+
+def _retries(r):
+    # Number of retries of urllib3.HTTPResponse `r`.
+    retries = getattr(r, 'retries', None)
+    return len(retries.history) if retries is not None else 0
+
+
+def _importAiohttp():
+    # `aiohttp` is imported here since it is needed only for the
+    # asynchronous API.
+    try:
+        import aiohttp
+    except ImportError:
+        raise ImportError('aiohttp is required for the asynchronous API')
+    return aiohttp
+
+
+def getDefaultConf():
+    """
+    Return default values for config file.
+
+    Intended to be called before :meth:`config.writeConf`
+
+    Example:
+        >>> from cmiputil import session, config
+        >>> conf = config.Conf(None)   #  to create brank config
+        >>> d = session.getDefaultConf()
+        >>> conf.read_dict(d)
+        >>> print(conf)
+        [Session]
+        connect_timeout = 10.0
+        read_timeout = 60.0
+        retries = 3
+        backoff_factor = 0.5
+        maxsize = 10
+        num_pools = 50
+        rate = 0
+        burst = 0
+        host_rates = 
+        max_requests = 32
+        <BLANKLINE>
+        <BLANKLINE>
+    """
+    res = {}
+    res['Session'] = dict(session_default)
+    res['Session'].update(ratelimit.ratelimit_default)
+    return res
+
+
+if (__name__ == '__main__'):
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Keep the state of incremental search, used by
+:meth:`esgfsearch.ESGFSearch.doSync`.
+
+:class:`SyncState` stores, in one `SQLite`_ file, datasets found by
+the last search for each query, with their ``_timestamp`` and
+``version``, and the time of the last search.  One file can hold
+states for several queries, distinguished by a query key (see
+:func:`cache.makeKey`).
+
+Example:
+
+    >>> from cmiputil import syncstate
+    >>> st = syncstate.SyncState('/tmp/cmiputil-sync.sqlite')
+    >>> st.update('query1', [{'instance_id': 'a.v20190101',
+    ...                       'master_id': 'a', 'version': '20190101',
+    ...                       '_timestamp': '2019-01-01T00:00:00Z'}],
+    ...           last_sync='2019-01-01T00:00:00Z')
+    >>> st.lastSync('query1')
+    '2019-01-01T00:00:00Z'
+    >>> st.get('query1')['a.v20190101']['master_id']
+    'a'
+
+.. _SQLite: https://docs.python.org/3/library/sqlite3.html
+
+"""
+__author__ = 'T.Inoue'
+__credits__ = 'Copyright (c) 2019 RIST'
+__version__ = 'v20190714'
+__date__ = '2019/07/14'
+
+import sqlite3
+import threading
+from collections import namedtuple
+from pathlib import Path
+
+#: Result of :meth:`esgfsearch.ESGFSearch.doSync`, each is a set of
+#: ``instance_id``.
+SyncResult = namedtuple('SyncResult',
+                        ['added', 'updated', 'retracted', 'superseded'])
+
+
+class SyncState():
+    """
+    State of incremental search.
+
+    Args:
+        file (path-like): SQLite database file, created if not exists.
+
+    Attributes:
+        file (Path): SQLite database file
+    """
+
+    #: Columns stored for each dataset.
+    columns = ('instance_id', 'master_id', 'version', '_timestamp')
+
+    def __init__(self, file):
+        self.file = Path(file).expanduser()
+        self.file.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.file), timeout=30,
+                                   check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS syncs ('
+                ' query TEXT PRIMARY KEY,'
+                ' last_sync TEXT)')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS datasets ('
+                ' query TEXT,'
+                ' instance_id TEXT,'
+                ' master_id TEXT,'
+                ' version TEXT,'
+                ' _timestamp TEXT,'
+                ' PRIMARY KEY (query, instance_id))')
+
+    def lastSync(self, query):
+        """
+        Return the time of the last search for `query`, as the
+        ``_timestamp`` of the newest dataset found, or ``None`` if
+        never searched.
+        """
+        with self._lock:
+            row = self._db.execute(
+                'SELECT last_sync FROM syncs WHERE query = ?',
+                (query,)).fetchone()
+        return row[0] if row else None
+
+    def get(self, query):
+        """
+        Return datasets stored for `query`.
+
+        Returns:
+            dict: ``{instance_id: {column: value}}``, see :attr:`columns`.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT ' + ', '.join(self.columns) +
+                ' FROM datasets WHERE query = ?', (query,)).fetchall()
+        return {r[0]: dict(zip(self.columns, r)) for r in rows}
+
+    def update(self, query, stored=(), removed=(), last_sync=None):
+        """
+        Store and remove datasets for `query`, and set the time of
+        the last search, in one transaction.
+
+        Args:
+            query (str): query key
+            stored (list(dict)): datasets to be stored, each must have
+                                 keys in :attr:`columns`.
+            removed (list(str)): ``instance_id`` to be removed
+            last_sync (str): time of the last search, not changed if
+                             ``None``.
+        """
+        with self._lock, self._db:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO datasets VALUES (?, ?, ?, ?, ?)',
+                [(query,) + tuple(d.get(c) for c in self.columns)
+                 for d in stored])
+            self._db.executemany(
+                'DELETE FROM datasets WHERE query = ? AND instance_id = ?',
+                [(query, i) for i in removed])
+            if last_sync is not None:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO syncs VALUES (?, ?)',
+                    (query, last_sync))
+
+    def clear(self, query=None):
+        """
+        Remove the state for `query`, or all states if `query` is
+        ``None``.
+        """
+        with self._lock, self._db:
+            if query is None:
+                self._db.execute('DELETE FROM datasets')
+                self._db.execute('DELETE FROM syncs')
+            else:
+                self._db.execute('DELETE FROM datasets WHERE query = ?',
+                                 (query,))
+                self._db.execute('DELETE FROM syncs WHERE query = ?',
+                                 (query,))
+
+    def close(self):
+        """
+        Close the database.
+        """
+        with self._lock:
+            self._db.close()
+
+
+if (__name__ == '__main__'):
+    import doctest
+    doctest.testmod()
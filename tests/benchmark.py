@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+End-to-end benchmark of :class:`esgfsearch.ESGFSearch` on the local
+stand-in server (see :mod:`standin`), without network access.
+
+For each number of datasets, stages below are done in turn, and the
+throughput (datasets per second) and percentiles of latency are
+reported.  Latency is of each request for ``search``, of all
+datasets for ``local``, and of each dataset for the others.
+
+- ``search``: :meth:`esgfsearch.ESGFSearch.iterSearch`
+- ``catalog``: :meth:`esgfdatainfo.ESGFDataInfo.getDataURL`
+- ``dds``: :meth:`esgfdatainfo.ESGFDataInfo.getDDS`
+- ``local``: :meth:`esgfsearch.ESGFSearch.findLocalFiles`, with local
+  files of every other dataset.
+
+Stages but ``search`` are done by :meth:`esgfsearch.ESGFSearch.resolve`,
+that is, concurrently as configured.  Errors in each dataset are
+counted, not raised.
+
+Usage::
+
+    $ python tests/benchmark.py --sizes 10 100 1000 10000 --latency 0.02
+
+Run with ``--help`` for other options.
+"""
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from standin import StandinServer
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from cmiputil import esgfdatainfo, esgfsearch  # noqa: E402
+from cmiputil.metrics import percentile  # noqa: E402
+
+#: Default numbers of datasets.
+sizes_default = (10, 100, 1000, 10000)
+
+#: Stages measured, in order.
+stages = ('search', 'catalog', 'dds', 'local')
+
+_timings = {}
+_errors = {}
+
+
+class _TimedDataInfo(esgfdatainfo.ESGFDataInfo):
+    # Record latency and errors of each stage.
+
+    def getDataURL(self, aggregate=None):
+        _timed('catalog', super().getDataURL, aggregate)
+
+    def getDDS(self, *args, **kwargs):
+        _timed('dds', super().getDDS, *args, **kwargs)
+
+
+class _TimedSearch(esgfsearch.ESGFSearch):
+    # Record latency of each request to the search service.
+
+    def _fetch(self, base_url, fields):
+        t0 = time.perf_counter()
+        chunks = super()._fetch(base_url, fields)
+        if chunks is None:
+            _errors['search'] += 1
+            return None
+        return self._timedChunks(t0, chunks)
+
+    def _timedChunks(self, t0, chunks):
+        yield from chunks
+        _timings['search'].append(time.perf_counter() - t0)
+
+    def findLocalFiles(self, datainfo=None, base_dir=None):
+        _timed('local', super().findLocalFiles, datainfo, base_dir)
+
+    def _newDataInfo(self, doc):
+        return _TimedDataInfo(attribs=doc, **self._dataInfoArgs())
+
+
+def _timed(stage, func, *args, **kwargs):
+    t0 = time.perf_counter()
+    try:
+        func(*args, **kwargs)
+    except Exception:
+        _errors[stage] += 1
+    _timings[stage].append(time.perf_counter() - t0)
+
+
+def run(size, latency=0.0, failure_rate=0.0, seed=0, conf=None):
+    """
+    Run the benchmark for `size` datasets.
+
+    Args:
+        size (int): number of datasets
+        latency (float or dict): see :class:`standin.StandinServer`
+        failure_rate (float or dict): see :class:`standin.StandinServer`
+        seed (int): seed of random failures
+        conf (dict): config, ``{section: {option: value}}``, in
+                     addition to ``search_service``.
+
+    Returns:
+        list(dict): result of each stage
+    """
+    for st in stages:
+        _timings[st] = []
+        _errors[st] = 0
+
+    res = []
+    with StandinServer(size, latency=latency, failure_rate=failure_rate,
+                       seed=seed) as server, \
+            tempfile.TemporaryDirectory() as tmp:
+        server.makeLocalFiles(tmp, step=2)
+
+        conffile = Path(tmp) / 'benchmark.conf'
+        sections = {'cmiputil': {'cmip6_data_dir': tmp},
+                    'ESGFSearch': {}}
+        for sect, opts in (conf or {}).items():
+            sections.setdefault(sect, {}).update(opts)
+        sections['ESGFSearch']['search_service'] = server.search_service
+        conffile.write_text('\n'.join(
+            f'[{sect}]\n' + ''.join(f'{k} = {v}\n' for k, v in opts.items())
+            for sect, opts in sections.items()))
+
+        es = _TimedSearch(conffile)
+        for st in stages:
+            t0 = time.perf_counter()
+            if st == 'search':
+                es.datainfo = list(es.iterSearch())
+            else:
+                es.resolve(stages=(st,))
+            elapsed = time.perf_counter() - t0
+            count = len(es.datainfo)
+            res.append({
+                'datasets': size,
+                'stage': st,
+                'count': count,
+                'requests': len(_timings[st]),
+                'errors': _errors[st],
+                'elapsed': elapsed,
+                'throughput': count / elapsed if elapsed > 0 else None,
+                'p50': percentile(_timings[st], 50),
+                'p95': percentile(_timings[st], 95),
+            })
+    return res
+
+
+def report(results, file=sys.stdout):
+    """
+    Print `results` of :func:`run` as a table.
+    """
+    print(f'{"datasets":>8} {"stage":<8} {"errors":>6} {"elapsed[s]":>10} '
+          f'{"datasets/s":>10} {"p50[ms]":>8} {"p95[ms]":>8}', file=file)
+    for r in results:
+        def _ms(v):
+            return f'{v * 1000:8.1f}' if v is not None else f'{"-":>8}'
+        tp = (f'{r["throughput"]:10.1f}' if r['throughput'] is not None
+              else f'{"-":>10}')
+        print(f'{r["datasets"]:8d} {r["stage"]:<8} {r["errors"]:6d} '
+              f'{r["elapsed"]:10.3f} {tp} {_ms(r["p50"])} {_ms(r["p95"])}',
+              file=file)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='End-to-end benchmark on the local stand-in server')
+    parser.add_argument('-s', '--sizes', type=int, nargs='+',
+                        default=sizes_default,
+                        help='numbers of datasets')
+    parser.add_argument('-l', '--latency', type=float, default=0.0,
+                        help='latency of each response in seconds')
+    parser.add_argument('-f', '--failure_rate', type=float, default=0.0,
+                        help='rate of responses failing with 503')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of random failures')
+    parser.add_argument('-o', '--option', action='append', default=[],
+                        metavar='SECTION.OPTION=VALUE',
+                        help='config option, such as '
+                        'ESGFSearch.max_workers=16, may be repeated')
+    parser.add_argument('-j', '--json', metavar='FILE',
+                        help='write results as JSON to FILE')
+    a = parser.parse_args()
+
+    conf = {}
+    for opt in a.option:
+        key, value = opt.split('=', 1)
+        sect, name = key.rsplit('.', 1)
+        conf.setdefault(sect, {})[name] = value
+
+    results = []
+    for size in a.sizes:
+        res = run(size, latency=a.latency, failure_rate=a.failure_rate,
+                  seed=a.seed, conf=conf)
+        report(res)
+        results += res
+
+    if a.json:
+        Path(a.json).write_text(json.dumps(results, indent=2))
+
+
+if (__name__ == '__main__'):
+    main()
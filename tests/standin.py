@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Local stand-in server of an ESGF index node and a THREDDS data node,
+for end-to-end tests and benchmarks without network access.
+
+Responses recorded from real services are kept in
+``fixtures/standin/``, as below, and replayed for any number of
+datasets, made by replacing the ``variant_label`` (``r1i1p1f1``) of
+the recorded dataset with ``r<k>i1p1f1`` (``k = 1 .. datasets``), and
+the recorded data node with this server.
+
+- ``search_dataset.json``: search result of ``type=Dataset``
+- ``search_file.json``: search result of ``type=File``
+- ``catalog.xml``: THREDDS catalog of the dataset
+- ``aggregation.dds``, ``file_<time_range>.dds``: DDS of the
+  aggregation and of each file
+
+Files are served by ``HTTPServer`` URLs in ``search_file.json``, with
+``Range`` requests supported unless `ranges` is ``False``.  Their
+contents are made up from the URL, `file_size` bytes each, and their
+``size`` and ``checksum`` in search results match them.
+
+Search requests support ``offset``, ``limit``, ``fields``, ``facets``,
+``type`` and ``dataset_id``.  Other constraints are ignored, that is,
+all of datasets are always found.
+
+Each kind of requests, ``search``, ``catalog``, ``dds`` and ``file``, can be
+delayed by `latency` seconds, and fails with status 503 at the rate of
+`failure_rate`.  Both may be a float for all kinds, or a dict per kind.
+
+Example:
+
+    >>> from standin import StandinServer
+    >>> from cmiputil import esgfsearch
+    >>> with StandinServer(datasets=100, latency=0.01) as server:
+    ...     es = esgfsearch.ESGFSearch(None)
+    ...     es.search_service = server.search_service
+    ...     es.doSearch(stages=('search', 'catalog'))
+    ...     len(es.data_urls), server.counts['catalog']
+    (100, 100)
+
+"""
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+#: Directory of recorded responses.
+fixtures_dir = Path(__file__).parent / 'fixtures' / 'standin'
+
+#: Data node in recorded responses, replaced by this server.
+recorded_node = 'esgf-data2.diasjp.net'
+
+#: Variant label in recorded responses, replaced for each dataset.
+recorded_variant = 'r1i1p1f1'
+
+#: Kinds of requests.
+kinds = ('search', 'catalog', 'dds', 'file')
+
+_variant_pat = re.compile(r'[./]r(\d+)i1p1f1[./]')
+_time_range_pat = re.compile(r'_(\d+-\d+)\.nc\.dds$')
+_range_pat = re.compile(r'bytes=(\d+)-(\d*)$')
+
+
+class StandinServer():
+    """
+    Stand-in server, run in a background thread.
+
+    Args:
+        datasets (int): number of datasets found by search.
+        latency (float or dict): delay of each response in seconds.
+        failure_rate (float or dict): rate of responses failing with
+                                      status 503.
+        seed (int): seed of random failures.
+        fixtures (path-like): directory of recorded responses.
+        file_size (int): size of each file in bytes.
+        ranges (bool): support ``Range`` requests of files, or not.
+
+    Attributes:
+        url (str): base URL of this server, set by :meth:`start`.
+        counts (dict): number of requests per kind, including failed
+                       ones.
+        failures (dict): number of failed requests per kind.
+    """
+
+    def __init__(self, datasets=10, latency=0.0, failure_rate=0.0, seed=None,
+                 fixtures=fixtures_dir, file_size=100000, ranges=True):
+        self.datasets = datasets
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.file_size = file_size
+        self.ranges = ranges
+        self.url = None
+        self.counts = dict.fromkeys(kinds, 0)
+        self.failures = dict.fromkeys(kinds, 0)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+
+        fixtures = Path(fixtures)
+        self._search = {
+            t: json.loads((fixtures / f'search_{t.lower()}.json').read_text())
+            for t in ('Dataset', 'File')}
+        self._catalog = (fixtures / 'catalog.xml').read_text()
+        self._dds = {p.stem: p.read_text() for p in fixtures.glob('*.dds')}
+
+    @property
+    def search_service(self):
+        """URL of the search service, for :class:`esgfsearch.ESGFSearch`."""
+        return self.url + '/esg-search/'
+
+    def start(self):
+        """Start serving in a background thread."""
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.standin = self
+        self.url = f'http://127.0.0.1:{self._server.server_port}'
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def makeLocalFiles(self, base_dir, step=1):
+        """
+        Create empty local files of every `step` datasets under
+        `base_dir`, in the DRS directory structure.
+
+        Returns:
+            list(Path): files created
+        """
+        res = []
+        docs = self._search['File']['response']['docs']
+        for k in range(1, self.datasets + 1, step):
+            for doc in docs:
+                for url in doc['url']:
+                    url, mime, service = url.split('|')
+                    if service != 'HTTPServer':
+                        continue
+                    path = url.split('/esg_dataroot/')[1]
+                    path = Path(base_dir) / self._render(path, k)
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    path.touch()
+                    res.append(path)
+        return res
+
+    def fileContent(self, path):
+        """
+        Contents of the file served at `path` of URL.
+        """
+        block = hashlib.sha256(path.encode()).digest()
+        return (block * (self.file_size // len(block) + 1))[:self.file_size]
+
+    def _fileDoc(self, doc):
+        # Set size and checksum of the file of search result `doc`.
+        for url in doc.get('url', []):
+            url, mime, service = url.split('|')
+            if service == 'HTTPServer':
+                data = self.fileContent(urlparse(url).path)
+                doc['size'] = len(data)
+                doc['checksum'] = [hashlib.sha256(data).hexdigest()]
+                doc['checksum_type'] = ['SHA256']
+        return doc
+
+    def _render(self, text, k):
+        # Make text for the k-th dataset from recorded one.
+        if self.url:
+            text = text.replace(recorded_node, self.url[len('http://'):])
+        return text.replace(recorded_variant, f'r{k}i1p1f1')
+
+    def _index(self, text):
+        # Index of the dataset `text` refers to, or None.
+        m = _variant_pat.search(text)
+        if m and 1 <= int(m.group(1)) <= self.datasets:
+            return int(m.group(1))
+        return None
+
+    def _param(self, value, kind):
+        if type(value) is dict:
+            return value.get(kind, 0.0)
+        return value
+
+    def _fails(self, kind):
+        # Count a request, and decide it fails or not.
+        rate = self._param(self.failure_rate, kind)
+        with self._lock:
+            self.counts[kind] += 1
+            failed = (rate > 0 and self._random.random() < rate)
+            if failed:
+                self.failures[kind] += 1
+        return failed
+
+    def respond(self, path, query):
+        """
+        Make a response for the request.
+
+        Args:
+            path (str): path of the request URL
+            query (dict): query parameters, as :func:`urllib.parse.parse_qs`
+
+        Returns:
+            tuple: ``(kind, status, content_type, body)``
+        """
+        if path.startswith('/esg-search/search'):
+            return ('search', 200, 'application/json',
+                    json.dumps(self.search(query)).encode())
+        if path.startswith('/thredds/catalog/'):
+            k = self._index(path)
+            if k is None:
+                return ('catalog', 404, 'text/plain', b'not found')
+            return ('catalog', 200, 'application/xml',
+                    self._render(self._catalog, k).encode())
+        if path.startswith('/thredds/dodsC/') and path.endswith('.dds'):
+            k = self._index(path)
+            m = _time_range_pat.search(path)
+            if 'aggregation' in path:
+                name = 'aggregation'
+            elif m:
+                name = f'file_{m.group(1)}'
+            else:
+                name = None
+            if k is None or name not in self._dds:
+                return ('dds', 404, 'text/plain', b'not found')
+            return ('dds', 200, 'text/plain',
+                    self._render(self._dds[name], k).encode())
+        if path.startswith('/thredds/fileServer/'):
+            if self._index(path) is None:
+                return ('file', 404, 'text/plain', b'not found')
+            return ('file', 200, 'application/netcdf',
+                    self.fileContent(path))
+        return (None, 404, 'text/plain', b'not found')
+
+    def search(self, query):
+        """
+        Make a search result for `query`, as a dict.
+        """
+        def _get(key, default=None):
+            values = query.get(key)
+            return values[-1] if values else default
+
+        kind = _get('type', 'Dataset')
+        recorded = self._search.get(kind, self._search['Dataset'])
+        templates = [json.dumps(d) for d in recorded['response']['docs']]
+        if kind == 'File':
+            indices = []
+            for value in query.get('dataset_id', []):
+                indices += [self._index(i + '.') for i in value.split(',')]
+            indices = [k for k in indices if k is not None]
+        else:
+            indices = range(1, self.datasets + 1)
+        numFound = len(indices) * len(templates)
+
+        offset = int(_get('offset', 0))
+        limit = int(_get('limit', 10))
+        facets = [f for f in _get('facets', '').split(',') if f]
+
+        def _docs(start, stop):
+            for n in range(start, min(stop, numFound)):
+                k = indices[n // len(templates)]
+                doc = json.loads(self._render(templates[n % len(templates)],
+                                              k))
+                yield self._fileDoc(doc) if kind == 'File' else doc
+
+        docs = list(_docs(offset, offset + limit))
+        fields = [f for f in _get('fields', '*').split(',') if f]
+        if '*' not in fields:
+            docs = [{f: d[f] for f in fields if f in d} for d in docs]
+
+        counts = {f: {} for f in facets}
+        if facets:
+            for d in _docs(0, numFound):
+                for f in facets:
+                    values = d.get(f, [])
+                    if type(values) is not list:
+                        values = [values]
+                    for v in values:
+                        counts[f][v] = counts[f].get(v, 0) + 1
+
+        res = dict(recorded)
+        res['response'] = dict(recorded['response'], numFound=numFound,
+                               start=offset, docs=docs)
+        res['facet_counts'] = {
+            'facet_fields': {
+                f: [x for kv in sorted(c.items()) for x in kv]
+                for f, c in counts.items()}}
+        return res
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self._respond(body=True)
+
+    def do_HEAD(self):
+        self._respond(body=False)
+
+    def _respond(self, body):
+        standin = self.server.standin
+        url = urlparse(self.path)
+        kind, status, ctype, data = standin.respond(url.path,
+                                                    parse_qs(url.query))
+        headers = {}
+        if kind is not None:
+            time.sleep(standin._param(standin.latency, kind))
+            if standin._fails(kind):
+                status, ctype, data = 503, 'text/plain', b'unavailable'
+        m = _range_pat.match(self.headers.get('Range', ''))
+        if kind == 'file' and status == 200 and standin.ranges and m:
+            start = int(m.group(1))
+            end = min(int(m.group(2) or len(data) - 1), len(data) - 1)
+            if start < len(data):
+                status = 206
+                headers['Content-Range'] = f'bytes {start}-{end}/{len(data)}'
+                data = data[start:end + 1]
+            else:
+                status = 416
+                headers['Content-Range'] = f'bytes */{len(data)}'
+                data = b''
+        self.send_response(status)
+        self.send_header('Content-Type', ctype)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if body:
+            self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+if (__name__ == '__main__'):
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from cmiputil import cache
+import unittest
+import time
+from pathlib import Path
+
+
+class test_DiskCache(unittest.TestCase):
+    def setUp(self):
+        self.file = Path('/tmp/test_cache.sqlite')
+        if self.file.exists():
+            self.file.unlink()
+
+    def tearDown(self):
+        pass
+
+    def test_put_get(self):
+        """Store and retrieve a value."""
+        c = cache.DiskCache(self.file)
+        c.put('a', b'value')
+        self.assertEqual(c.get('a'), b'value')
+        self.assertIsNone(c.get('b'))
+        self.assertTrue('a' in c)
+        self.assertEqual(len(c), 1)
+
+    def test_persistent(self):
+        """Entries survive re-opening."""
+        c = cache.DiskCache(self.file)
+        c.put('a', b'value')
+        c.close()
+        c = cache.DiskCache(self.file)
+        self.assertEqual(c.get('a'), b'value')
+
+    def test_ttl(self):
+        """Expired entries are not returned unless `stale=True`."""
+        c = cache.DiskCache(self.file, ttl=0.05)
+        c.put('a', b'value')
+        time.sleep(0.1)
+        self.assertIsNone(c.get('a'))
+        self.assertEqual(c.get('a', stale=True), b'value')
+        c.expire()
+        self.assertEqual(len(c), 0)
+
+    def test_lru(self):
+        """Least recently used entries are evicted."""
+        c = cache.DiskCache(self.file, max_size=30)
+        c.put('a', b'0' * 10)
+        c.put('b', b'1' * 10)
+        c.put('c', b'2' * 10)
+        c.get('a')
+        c.put('d', b'3' * 10)
+        self.assertIsNone(c.get('b'))
+        for k in ('a', 'c', 'd'):
+            self.assertIsNotNone(c.get(k))
+        self.assertEqual(c.size, 30)
+
+    def test_lru01(self):
+        """Eviction over more entries than one batch."""
+        c = cache.DiskCache(self.file, max_size=1000)
+        for i in range(250):
+            c.put(f'k{i:03d}', b'0' * 4)
+        self.assertEqual(len(c), 250)
+        c.put('big', b'1' * 800)
+        self.assertEqual(c.size, 1000)
+        self.assertEqual(len(c), 51)
+        self.assertIsNone(c.get('k199'))
+        self.assertIsNotNone(c.get('k200'))
+        self.assertIsNotNone(c.get('big'))
+
+    def test_invalidate(self):
+        """Remove one or all entries."""
+        c = cache.DiskCache(self.file)
+        c.put('a', b'0')
+        c.put('b', b'1')
+        c.invalidate('a')
+        self.assertIsNone(c.get('a'))
+        self.assertEqual(len(c), 1)
+        c.invalidate()
+        self.assertEqual(len(c), 0)
+
+    def test_makeKey(self):
+        """Keys are canonicalized."""
+        a = cache.makeKey('http://a/search', {'x': 'p, q', 'limit': 10})
+        b = cache.makeKey('http://a/search', {'limit': '10', 'x': 'p,q'})
+        c = cache.makeKey('http://b/search', {'limit': '10', 'x': 'p,q'})
+        self.assertEqual(a, b)
+        self.assertNotEqual(a, c)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == "__main__":
+    main()
@@ -509,6 +509,33 @@ class test_DDS(unittest.TestCase):
         res = g.text
         self.assertEqual(ref, res)
 
+    def test_nbytes(self):
+        v = dds.Var(text='Float64 time_bnds[time = 8412][bnds = 2];')
+        self.assertEqual(v.shape, (8412, 2))
+        self.assertEqual(v.nbytes, 8412 * 2 * 8)
+        self.assertEqual(v.hyperslabShape({'time': (0, 12), 'bnds': -1}),
+                         (12, 1))
+        self.assertEqual(dds.Var(text='Int16 height;').nbytes, 2)
+        self.assertIsNone(dds.Var(text='String name[name = 4];').nbytes)
+
+        g = sample1_struct.tas
+        self.assertEqual(g.shape, (8412, 160, 320))
+        maps = (8412 + 160 + 320) * 8
+        self.assertEqual(g.nbytes, 8412 * 160 * 320 * 4 + maps)
+        sel = {'time': range(8400, 8424), 'lat': slice(None, None, 2)}
+        self.assertEqual(g.hyperslabShape(sel), (12, 80, 320))
+        self.assertEqual(g.hyperslabBytes(sel),
+                         12 * 80 * 320 * 4 + (12 + 80 + 320) * 8)
+
+        ds = sample1_struct
+        self.assertEqual(ds.nbytes,
+                         sum(d.nbytes for d in ds.decl.values()))
+        # Sequence and String are not counted.
+        self.assertEqual(sample2_struct.nbytes, 4)
+
+        with self.assertRaises(TypeError):
+            v.hyperslabShape({'time': 'all'})
+
     def test_check_braces_matching(self):
         dds.check_braces_matching(sample1_text)
         dds.check_braces_matching(sample2_text)
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from cmiputil import download
+import unittest
+import threading
+import time
+
+
+class test_runPerHost(unittest.TestCase):
+    def test_limit00(self):
+        """At most max_per_host at once for one host."""
+        tasks = [download.DownloadTask(f'http://{h}/{i}.nc', None, None,
+                                       None, None)
+                 for i in range(6) for h in ('a', 'b')]
+        lock = threading.Lock()
+        active = {'a': 0, 'b': 0}
+        peak = {'a': 0, 'b': 0}
+
+        def _func(task):
+            host = download._host(task.url)
+            with lock:
+                active[host] += 1
+                peak[host] = max(peak[host], active[host])
+            time.sleep(0.02)
+            with lock:
+                active[host] -= 1
+            return task.url
+
+        res = download._runPerHost(tasks, _func, 8, 2)
+        self.assertEqual(res, [t.url for t in tasks])
+        self.assertEqual(peak, {'a': 2, 'b': 2})
+
+
+class test_report(unittest.TestCase):
+    def test_report00(self):
+        """Counts and throughput per host."""
+        R = download.FileResult
+        res = [R('http://a/1.nc', None, 'downloaded', 300, 0.0, 2.0, None),
+               R('http://a/2.nc', None, 'failed', 100, 1.0, 3.0, 'error'),
+               R('http://b/3.nc', None, 'skipped', 0, 0.0, 0.0, None)]
+        r = download.report(res, 4.0)
+        self.assertEqual((r['downloaded'], r['skipped'], r['failed']),
+                         (1, 1, 1))
+        self.assertEqual(r['throughput'], 100.0)
+        self.assertEqual(r['hosts'], {'a': {'files': 2, 'bytes': 400,
+                                            'seconds': 3.0,
+                                            'throughput': 400 / 3.0}})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,13 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from cmiputil import esgfdatainfo
+from cmiputil import esgfdatainfo, dds
 import unittest
 import copy
+from pathlib import Path
+
+_dds_file = (Path(__file__).parent / 'fixtures' / 'standin' /
+             'aggregation.dds')
 
 sample_attrs = {
             '_timestamp': '2018-12-12T10:01:59.852Z',
@@ -216,6 +220,160 @@ class test_ESGFDataInfo(unittest.TestCase):
         self.assertFalse(('id' in dinfo))
 
 
+    def test_lazy00(self):
+        """Lazy attributes are resolved on first access."""
+        class _DataInfo(esgfdatainfo.ESGFDataInfo):
+            def getDataURL(self, aggregate=None):
+                if aggregate is None:
+                    aggregate = self._aggregate
+                self.count = self.get('count', 0) + 1
+                self.agg_data_url = 'agg'
+                self.mf_data_url = ['mf']
+                self.data_url = 'agg' if aggregate else ['mf']
+
+        dinfo = _DataInfo(self.elements, aggregate=False)
+        self.assertFalse(dinfo.isSet('data_url'))
+        self.assertEqual(dinfo.data_url, ['mf'])
+        self.assertEqual(dinfo.agg_data_url, 'agg')
+        self.assertEqual(dinfo.count, 1)
+        with self.assertRaises(AttributeError):
+            dinfo.no_such_attribute
+
+    def test_lazy01(self):
+        """Membership test and get() do not resolve lazy attributes."""
+        class _DataInfo(esgfdatainfo.ESGFDataInfo):
+            def getDataURL(self, aggregate=None):
+                raise RuntimeError('network access')
+
+        dinfo = _DataInfo(self.elements)
+        self.assertFalse('data_url' in dinfo)
+        self.assertIsNone(dinfo.get('data_url'))
+        self.assertEqual(dinfo.get('agg_dds', 'none'), 'none')
+        with self.assertRaises(RuntimeError):
+            dinfo['data_url']
+        dinfo.data_url = 'url'
+        self.assertTrue('data_url' in dinfo)
+        self.assertEqual(dinfo.get('data_url'), 'url')
+
+    def test_private00(self):
+        """Private attributes are not visible as mapping."""
+        dinfo = esgfdatainfo.ESGFDataInfo(self.elements, aggregate=False,
+                                          base_dir='/data')
+        self.assertEqual(len(self.elements), len(dinfo))
+        self.assertEqual(str(self.elements), str(dinfo))
+        self.assertFalse('_aggregate' in dinfo)
+
+    def test_raw00(self):
+        """Fields not in slots are kept as JSON text until accessed."""
+        dinfo = esgfdatainfo.ESGFDataInfo(self.sample_attrs)
+        self.assertFalse(hasattr(dinfo, '__dict__'))
+        self.assertIsInstance(dinfo._raw, bytes)
+        self.assertIsNone(dinfo._extra)
+        self.assertTrue(dinfo.isSet('source_id'))
+        self.assertIsNone(dinfo._extra)
+        self.assertEqual(copy.deepcopy(dinfo)._raw, dinfo._raw)
+
+        self.assertEqual(dinfo.score, 1.0)
+        self.assertEqual(dinfo['realm'], 'atmos')
+        self.assertEqual(dinfo.geo, self.sample_attrs['geo'])
+        self.assertIsNone(dinfo._raw)
+        self.assertEqual(len(dinfo), len(self.sample_attrs) + 1)  # cat_url
+        self.assertEqual(set(dinfo),
+                         set(self.sample_attrs) | {'cat_url'})
+
+        dinfo.score = 0.5
+        del dinfo['realm']
+        self.assertEqual(dinfo['score'], 0.5)
+        self.assertNotIn('realm', dinfo)
+
+    def test_raw02(self):
+        """Fields named as methods or properties are kept as fields."""
+        attrs = dict(self.elements, keys='k', get='g', replicas=['r'])
+        dinfo = esgfdatainfo.ESGFDataInfo(attrs)
+        self.assertEqual(dinfo['keys'], 'k')
+        self.assertEqual(dinfo['get'], 'g')
+        self.assertEqual(dinfo['replicas'], 'r')
+        self.assertEqual(dinfo.replicas, [])
+        self.assertEqual(sorted(dinfo.keys()), sorted(attrs))
+
+    def test_splitTime00(self):
+        """Time steps of each file from <time_range>."""
+        split = esgfdatainfo._splitTime
+        self.assertEqual(split(1980, [('185001', '194912'),
+                                      ('195001', '201412')]), [1200, 780])
+        self.assertEqual(split(12, [('200001010000', '200001011800'),
+                                    ('200001020000', '200001021800'),
+                                    ('200001030000', '200001031800')]),
+                         [4, 4, 4])
+        # noleap calendar, scaled to the total.
+        self.assertEqual(sum(split(730, [('20000101', '20001231'),
+                                         ('20010101', '20011231')])), 730)
+        self.assertIsNone(split(10, [('1850', '1859'), None]))
+        self.assertIsNone(split(10, [('1850', '1859'), ('186001', '186912')]))
+
+    def test_inferDDS00(self):
+        """Only DDS of files not requested are inferred."""
+        agg = dds.parse_dataset(_dds_file.read_text())
+        urls = [f'http://node/dodsC/tas_Amon_{r}.nc'
+                for r in ('185001-194912', '195001-201412')]
+        res = esgfdatainfo._inferDDS(agg, urls, {})
+        self.assertEqual([esgfdatainfo._timeLength(d) for d in res],
+                         [1200, 780])
+        res = esgfdatainfo._inferDDS(agg, urls, {urls[0]: None})
+        self.assertIsNone(res[0])
+        self.assertEqual(esgfdatainfo._timeLength(res[1]), 780)
+        res = esgfdatainfo._inferDDS(agg, urls,
+                                     {urls[0]: None, urls[1]: None})
+        self.assertEqual(res, [None, None])
+
+    def test_catalogReader00(self):
+        """Catalog is read by chunks, resolving services of datasets."""
+        text = b'''<?xml version="1.0" encoding="UTF-8"?>
+<catalog xmlns="http://www.unidata.ucar.edu/namespaces/thredds/InvCatalog/v1.0">
+  <service name="all" serviceType="Compound" base="">
+    <service name="http" serviceType="HTTPServer" base="/thredds/fileServer/" />
+    <service name="odap" serviceType="OpenDAP" base="/thredds/dodsC/" />
+  </service>
+  <service name="fileonly" serviceType="HTTPServer" base="/thredds/fileServer/" />
+  <dataset name="ds" ID="ds">
+    <metadata inherited="true"><serviceName>all</serviceName></metadata>
+    <dataset name="a.nc" urlPath="data/a.nc" />
+    <dataset name="b.nc" urlPath="data/b.nc" serviceName="fileonly" />
+    <dataset name="c.nc" urlPath="data/c.nc" />
+    <dataset name="agg" urlPath="agg">
+      <access urlPath="agg" serviceName="odap" />
+    </dataset>
+  </dataset>
+</catalog>'''
+        url = 'http://node/thredds/catalog/x.xml'
+        reader = esgfdatainfo._CatalogReader(url)
+        for i in range(0, len(text), 17):
+            reader.feed(text[i:i+17])
+        res = reader.close()
+        self.assertEqual(res, (
+            'http://node/thredds/dodsC/agg',
+            ['http://node/thredds/dodsC/data/a.nc',
+             'http://node/thredds/dodsC/data/c.nc'],
+            'http://node/thredds/dodsC/'))
+        self.assertEqual(esgfdatainfo._parseCatalog(text, url), res)
+
+        with self.assertRaises(esgfdatainfo.CatalogError):
+            esgfdatainfo._parseCatalog(text[:200], url)
+        with self.assertRaises(esgfdatainfo.CatalogError):
+            esgfdatainfo._parseCatalog(b'<catalog></catalog>', url)
+
+    def test_raw01(self):
+        """Fields not in slots are dropped by keep_raw=False."""
+        dinfo = esgfdatainfo.ESGFDataInfo(self.sample_attrs, keep_raw=False)
+        self.assertEqual(dinfo.managedAttribs, self.managed_attribs)
+        self.assertIsNone(dinfo._raw)
+        self.assertNotIn('score', dinfo)
+        self.assertTrue(dinfo.isSet('size'))
+        self.assertFalse(dinfo.isSet('data_url'))
+
+        dinfo['score'] = 1.0
+        self.assertEqual(dinfo.score, 1.0)
+
 
 def main():
     unittest.main()
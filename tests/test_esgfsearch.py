@@ -0,0 +1,577 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from cmiputil import esgfsearch
+import unittest
+import json
+import threading
+import time
+from pathlib import Path
+
+
+def _sample_docs(n):
+    return [{'id': f'CMIP6.dummy.{i:05d}|dummy.node',
+             'instance_id': f'CMIP6.dummy.{i:05d}',
+             'version': '20190101'}
+            for i in range(n)]
+
+
+def _chunked(data, size=37):
+    # split response body as if it arrives in chunks.
+    return [data[i:i+size] for i in range(0, len(data), size)]
+
+
+class _FakeSearch(esgfsearch.ESGFSearch):
+    """ESGFSearch that returns canned docs instead of HTTP requests."""
+    def __init__(self, docs, conffile=None, offline=None):
+        super().__init__(conffile, offline=offline)
+        self.docs = docs
+        self.requested = []
+
+    def _request(self, base_url, fields):
+        self.requested.append(dict(fields))
+        return self._respond(self.docs, fields)
+
+    def _respond(self, docs, fields):
+        offset = fields.get('offset', 0)
+        limit = fields['limit']
+        result = {'response': {'numFound': len(docs),
+                               'docs': docs[offset:offset+limit]}}
+        if 'facets' in fields:
+            result['facet_counts'] = {'facet_fields': {}}
+            for facet in fields['facets'].split(','):
+                counts = {}
+                for doc in docs:
+                    counts[doc[facet]] = counts.get(doc[facet], 0) + 1
+                flat = [x for kv in counts.items() for x in kv]
+                result['facet_counts']['facet_fields'][facet] = flat
+        return _chunked(json.dumps(result).encode())
+
+
+class _FakeFederatedSearch(esgfsearch.ESGFSearch):
+    """ESGFSearch that returns canned docs for each index node."""
+    def __init__(self, nodes, federation='merge'):
+        conffile = Path('/tmp/test_esgfsearch_federated.conf')
+        conffile.write_text('\n'.join((
+            '[ESGFSearch]',
+            'index_nodes = ' + ', '.join(nodes),
+            f'federation = {federation}')))
+        super().__init__(conffile)
+        self.nodes = nodes
+        self.requested = []
+
+    def _request(self, base_url, fields):
+        node = base_url[:-len(self.service_type)]
+        self.requested.append(node)
+        delay, docs = self.nodes[node]
+        time.sleep(delay)
+        if docs is None:
+            raise ConnectionError(node)
+        offset = fields['offset']
+        limit = fields['limit']
+        result = {'response': {'numFound': len(docs),
+                               'docs': docs[offset:offset+limit]}}
+        return _chunked(json.dumps(result).encode())
+
+
+class _FakeSyncSearch(_FakeSearch):
+    """_FakeSearch that handles `from` and `latest`, without resolving."""
+    def _request(self, base_url, fields):
+        docs = self.docs
+        if 'from' in fields:
+            docs = [d for d in docs if d['_timestamp'] >= fields['from']]
+        if 'latest' in fields:
+            docs = [d for d in docs if d['latest']]
+        self.requested.append(dict(fields))
+        result = {'response': {'numFound': len(docs), 'docs': docs}}
+        return _chunked(json.dumps(result).encode())
+
+    def resolve(self, stages=None):
+        self.resolved = [d.instance_id for d in self.datainfo]
+
+
+class _FakeFileSearch(_FakeSearch):
+    """_FakeSearch that returns file records for type=File."""
+    def _request(self, base_url, fields):
+        if fields.get('type') != 'File':
+            return super()._request(base_url, fields)
+        self.requested.append(dict(fields))
+        ids = fields['dataset_id'].split(',')
+        docs = []
+        for i in ids:
+            name = i.split('|')[0]
+            for n in (1, 0):
+                url = f'http://dummy.node/thredds/{name}.{n}.nc'
+                docs.append({
+                    'dataset_id': i,
+                    'title': f'{name}.{n}.nc',
+                    'size': 100 + n,
+                    'checksum': [f'sum{n}'],
+                    'checksum_type': ['SHA256'],
+                    'url': [url.replace('thredds', 'dodsC') + '.html'
+                            + '|application/opendap-html|OPENDAP',
+                            url + '|application/netcdf|HTTPServer']})
+        result = {'response': {'numFound': len(docs), 'docs': docs}}
+        return _chunked(json.dumps(result).encode())
+
+
+class _FakeSplitSearch(_FakeSearch):
+    """_FakeSearch that filters docs by comma-separated facets."""
+    facet_names = ('experiment_id', 'variable_id')
+
+    def _request(self, base_url, fields):
+        docs = self.docs
+        for name in self.facet_names:
+            if name in fields:
+                values = fields[name].replace(' ', '').split(',')
+                docs = [d for d in docs if d[name] in values]
+        self.requested.append(dict(fields))
+        return self._respond(docs, fields)
+
+
+def _sync_doc(master, version, timestamp, latest=True, retracted=False):
+    return {'instance_id': f'{master}.v{version}', 'master_id': master,
+            'version': version, '_timestamp': timestamp,
+            'latest': latest, 'retracted': retracted}
+
+
+class _StageDataInfo(esgfsearch.esgfdatainfo.ESGFDataInfo):
+    """ESGFDataInfo that records called stages."""
+    def getDataURL(self, aggregate=None):
+        self.called = self.get('called', []) + ['getDataURL']
+
+    def getDDS(self):
+        self.called = self.get('called', []) + ['getDDS']
+
+    def findLocalFile(self, base_dir=None):
+        self.called = self.get('called', []) + ['findLocalFile']
+
+
+class test_ESGFSearch(unittest.TestCase):
+    def setUp(self):
+        self.docs = _sample_docs(25)
+
+    def tearDown(self):
+        pass
+
+    def test_init00(self):
+        """Create a blank instance."""
+        es = esgfsearch.ESGFSearch(None)
+        self.assertIsInstance(es, esgfsearch.ESGFSearch)
+        self.assertEqual(es.page_size, esgfsearch.page_size_default)
+        self.assertIsNone(es.numFound)
+
+    def test_iterSearch00(self):
+        """All pages are requested and yielded in order."""
+        es = _FakeSearch(self.docs)
+        ref = [d['instance_id'] for d in self.docs]
+        res = [d.instance_id for d in es.iterSearch(page_size=10)]
+        self.assertEqual(ref, res)
+        self.assertEqual([f['offset'] for f in es.requested], [0, 10, 20])
+        self.assertEqual(es.numFound, len(self.docs))
+
+    def test_iterSearch01(self):
+        """numFound is set after the first page."""
+        es = _FakeSearch(self.docs)
+        it = es.iterSearch(page_size=10)
+        next(it)
+        self.assertEqual(es.numFound, len(self.docs))
+        self.assertEqual(len(es.requested), 1)
+
+    def test_iterSearch02(self):
+        """No results."""
+        es = _FakeSearch([])
+        res = list(es.iterSearch(page_size=10))
+        self.assertEqual(res, [])
+        self.assertEqual(es.numFound, 0)
+
+    def test_cache00(self):
+        """Second search is served from the cache, also in offline mode."""
+        cachefile = Path('/tmp/test_esgfsearch_cache.sqlite')
+        conffile = Path('/tmp/test_esgfsearch_cache.conf')
+        conffile.write_text('\n'.join((
+            '[ESGFSearch.cache]',
+            'enable = True',
+            f'file = {cachefile}')))
+        es = _FakeSearch(self.docs, conffile)
+        es.cache.invalidate()
+        ref = [d.instance_id for d in es.iterSearch(page_size=10)]
+        self.assertEqual(len(es.requested), 3)
+
+        es = _FakeSearch(self.docs, conffile, offline=True)
+        res = [d.instance_id for d in es.iterSearch(page_size=10)]
+        self.assertEqual(ref, res)
+        self.assertEqual(len(es.requested), 0)
+
+        with self.assertRaises(esgfsearch.cache.CacheMissError):
+            list(es.iterSearch(page_size=20))
+
+    def test_projection00(self):
+        """Only necessary fields are requested by default."""
+        es = _FakeSearch(self.docs)
+        list(es.iterSearch(page_size=10))
+        res = es.requested[0]['fields'].split(',')
+        for f in ('instance_id', 'url', 'version', 'replica'):
+            self.assertIn(f, res)
+        self.assertNotIn('geo', res)
+
+    def test_projection01(self):
+        """Extra fields, and opt-out."""
+        es = _FakeSearch(self.docs)
+        es.extra_fields = ['geo']
+        list(es.iterSearch(page_size=10))
+        self.assertIn('geo', es.requested[0]['fields'].split(','))
+
+        es = _FakeSearch(self.docs)
+        es.projection = False
+        list(es.iterSearch(page_size=10))
+        self.assertNotIn('fields', es.requested[0])
+
+        es = _FakeSearch(self.docs)
+        list(es.iterSearch({'fields': '*'}, page_size=10))
+        self.assertEqual(es.requested[0]['fields'], '*')
+
+    def test_resolve00(self):
+        """Only selected stages are done."""
+        es = esgfsearch.ESGFSearch(None)
+        es.datainfo = [_StageDataInfo(d) for d in self.docs[:3]]
+        es.resolve(stages=('search', 'local', 'catalog'))
+        for d in es.datainfo:
+            self.assertEqual(d.called, ['getDataURL', 'findLocalFile'])
+
+        es.datainfo = [_StageDataInfo(d) for d in self.docs[:3]]
+        es.resolve()
+        for d in es.datainfo:
+            self.assertEqual(d.called,
+                             ['getDataURL', 'getDDS', 'findLocalFile'])
+
+        with self.assertRaises(ValueError):
+            es.resolve(stages=('search', 'invalid'))
+
+    def test_searchFiles00(self):
+        """File records are set from file-level search, in batches."""
+        es = _FakeFileSearch(self.docs)
+        es.aggregate = False
+        es.datainfo = list(es.iterSearch(page_size=100))
+        es.requested = []
+        es.resolve(stages=('search', 'files'))
+        self.assertEqual(len(es.requested), 2)  # 25 datasets / 20
+        for req in es.requested:
+            self.assertEqual(req['type'], 'File')
+        for d in es.datainfo:
+            name = d.instance_id
+            self.assertEqual([f['filename'] for f in d.files],
+                             [f'{name}.0.nc', f'{name}.1.nc'])
+            f = d.files[1]
+            self.assertEqual(f['size'], 101)
+            self.assertEqual(f['checksum'], 'sum1')
+            self.assertEqual(f['checksum_type'], 'SHA256')
+            self.assertEqual(f['http_url'],
+                             f'http://dummy.node/thredds/{name}.1.nc')
+            self.assertEqual(f['opendap_url'],
+                             f'http://dummy.node/dodsC/{name}.1.nc')
+            # set without accessing the catalog.
+            self.assertTrue(d.isSet('data_url'))
+            self.assertEqual(d.data_url, d.mf_data_url)
+
+    def test_countFacets00(self):
+        """Count results and facet values without retrieving docs."""
+        for i, doc in enumerate(self.docs):
+            doc['experiment_id'] = ['piControl', 'historical'][i % 2]
+        es = _FakeSearch(self.docs)
+        res = es.countFacets({'source_id': 'dummy'},
+                             facets=['experiment_id'])
+        ref = {'numFound': 25,
+               'facets': {'experiment_id': {'piControl': 13,
+                                            'historical': 12}}}
+        self.assertEqual(ref, res)
+        self.assertEqual(es.requested[0]['limit'], 0)
+        self.assertNotIn('source_id', es.params)
+
+    def test_planQueries00(self):
+        """Split only as far as needed."""
+        docs = _sample_docs(60)
+        for i, d in enumerate(docs):
+            d['experiment_id'] = ('piControl' if i < 40 else
+                                  'historical' if i < 55 else 'amip')
+            d['variable_id'] = ['tas', 'pr'][i % 2]
+        es = _FakeSplitSearch(docs)
+        params = {'experiment_id': 'piControl, historical, amip',
+                  'variable_id': 'tas, pr'}
+
+        # not split if not needed, no request if not multi-valued.
+        self.assertEqual(len(es.planQueries(params, limit=60)), 1)
+        self.assertEqual(len(es.requested), 1)
+        self.assertEqual(len(es.planQueries({'variable_id': 'tas'},
+                                            limit=1)), 1)
+        self.assertEqual(len(es.requested), 1)
+
+        # piControl (40) is split by variable_id, others are packed.
+        plan = es.planQueries(params, limit=25)
+        self.assertEqual(
+            [(p['experiment_id'], p['variable_id']) for p in plan],
+            [('piControl', 'tas'), ('piControl', 'pr'),
+             ('historical,amip', 'tas, pr')])
+        self.assertNotIn('experiment_id', es.params)
+
+    def test_splitSearch00(self):
+        """Same results as one query, deduplicated."""
+        docs = _sample_docs(30)
+        for i, d in enumerate(docs):
+            d['experiment_id'] = ['piControl', 'historical', 'amip'][i % 3]
+            d['variable_id'] = 'tas'
+        es = _FakeSplitSearch(docs + docs[:5])
+        es.page_size = 4
+        res = es.splitSearch({'experiment_id': 'piControl, historical, amip'},
+                             limit=12)
+        self.assertEqual(es.numFound, 30)
+        self.assertEqual(sorted(d.instance_id for d in res),
+                         sorted(d['instance_id'] for d in docs))
+        self.assertEqual(
+            {r['experiment_id'] for r in es.requested if r['limit']},
+            {'piControl', 'historical', 'amip'})
+
+    def test_splitSearch01(self):
+        """Replicas are kept by split search, to be selected."""
+        docs = []
+        for i, d in enumerate(_sample_docs(12)):
+            d['experiment_id'] = ['piControl', 'historical'][i % 2]
+            d['variable_id'] = 'tas'
+            for node in ('node-a', 'node-b'):
+                docs.append(dict(d, id=f'{d["instance_id"]}|{node}',
+                                 data_node=node, replica=(node == 'node-a')))
+        es = _FakeSplitSearch(docs)
+        res = es.splitSearch({'experiment_id': 'piControl, historical'},
+                             limit=12)
+        self.assertEqual(es.numFound, 12)
+        self.assertEqual({d.data_node for d in res}, {'node-b'})
+        self.assertEqual([[r.data_node for r in d.replicas] for d in res],
+                         [['node-a']] * 12)
+
+        es.monitor.record('node-a', 0.1)
+        es.monitor.record('node-b', 1.0)
+        res = es.selectReplicas(res)
+        self.assertEqual(len(res), 12)
+        self.assertEqual({d.data_node for d in res}, {'node-a'})
+        self.assertEqual([[r.data_node for r in d.replicas] for d in res],
+                         [['node-b']] * 12)
+        self.assertEqual({len(r.replicas) for d in res for r in d.replicas},
+                         {0})
+
+    def test_splitSearch02(self):
+        """Split and unsplit runs of one query give the same results."""
+        docs = []
+        for i, d in enumerate(_sample_docs(12)):
+            d['experiment_id'] = ['piControl', 'historical'][i % 2]
+            d['variable_id'] = 'tas'
+            for node in ('node-a', 'node-b'):
+                docs.append(dict(d, id=f'{d["instance_id"]}|{node}',
+                                 data_node=node, replica=(node == 'node-a')))
+        params = {'experiment_id': 'piControl, historical'}
+        res = []
+        for limit, split in ((12, True), (100, False)):
+            es = _FakeSplitSearch(docs)
+            res.append(sorted(
+                (d.instance_id, d.data_node,
+                 [r.data_node for r in d.replicas])
+                for d in es.splitSearch(dict(params), limit=limit)))
+            self.assertEqual(es.numFound, 12)
+            self.assertEqual(
+                {r['experiment_id'] for r in es.requested
+                 if r['limit']} == {'piControl', 'historical'}, split)
+        self.assertEqual(res[0], res[1])
+        self.assertEqual({(node, tuple(r)) for _, node, r in res[0]},
+                         {('node-b', ('node-a',))})
+
+    def test_instances00(self):
+        """Instances do not share session, monitor, caches nor DDS memo."""
+        es1 = _FakeSearch(self.docs)
+        es2 = _FakeSearch(self.docs)
+        self.assertIsNot(es1.session, es2.session)
+        self.assertIsNot(es1.monitor, es2.monitor)
+        self.assertIsNot(es1.dds_memo, es2.dds_memo)
+        self.assertIsNot(esgfsearch.session.getSession(), es1.session)
+        d = next(es1.iterSearch())
+        self.assertIs(d._getSession(), es1.session)
+        self.assertIs(d._getMonitor(), es1.monitor)
+        self.assertIsNone(d._catalogCache())
+        self.assertIs(d._dds_memo, es1.dds_memo)
+        self.assertIsNone(d.__getstate__().get('_session'))
+        self.assertIsNone(d.__getstate__().get('_dds_memo'))
+
+    def test_doSync00(self):
+        """Incremental search."""
+        sync_file = Path('/tmp/test_esgfsearch_sync.sqlite')
+        if sync_file.exists():
+            sync_file.unlink()
+        docs = [_sync_doc('a', '20190101', '2019-01-01T00:00:00Z'),
+                _sync_doc('b', '20190101', '2019-01-02T00:00:00Z'),
+                _sync_doc('c', '20190101', '2019-01-03T00:00:00Z')]
+        es = _FakeSyncSearch(docs)
+        es.params['latest'] = 'true'
+        res = es.doSync(sync_file=sync_file)
+        self.assertEqual(res.added, {'a.v20190101', 'b.v20190101',
+                                     'c.v20190101'})
+        self.assertEqual(len(es.resolved), 3)
+
+        # nothing changed.
+        es = _FakeSyncSearch(docs)
+        es.params['latest'] = 'true'
+        res = es.doSync(sync_file=sync_file)
+        self.assertEqual(res, (set(), set(), set(), set()))
+        self.assertEqual(es.requested[0]['from'], '2019-01-03T00:00:00Z')
+        self.assertNotIn('latest', es.requested[0])
+        self.assertEqual(es.resolved, [])
+
+        # new version of 'a', 'b' is retracted, 'c' is re-published.
+        docs[0]['latest'] = False
+        docs[0]['_timestamp'] = '2019-02-01T00:00:00Z'
+        docs[1]['retracted'] = True
+        docs[1]['latest'] = False
+        docs[1]['_timestamp'] = '2019-02-01T00:00:00Z'
+        docs[2]['_timestamp'] = '2019-02-01T00:00:00Z'
+        docs.append(_sync_doc('a', '20190201', '2019-02-01T00:00:00Z'))
+        es = _FakeSyncSearch(docs)
+        es.params['latest'] = 'true'
+        res = es.doSync(sync_file=sync_file)
+        self.assertEqual(res.added, {'a.v20190201'})
+        self.assertEqual(res.updated, {'c.v20190101'})
+        self.assertEqual(res.retracted, {'b.v20190101'})
+        self.assertEqual(res.superseded, {'a.v20190101'})
+        self.assertEqual(sorted(es.resolved), ['a.v20190201', 'c.v20190101'])
+
+    def test_doSync01(self):
+        """State file is closed even if the search fails."""
+        sync_file = Path('/tmp/test_esgfsearch_sync01.sqlite')
+        if sync_file.exists():
+            sync_file.unlink()
+        closed = []
+
+        class _State(esgfsearch.syncstate.SyncState):
+            def close(self):
+                closed.append(self.file)
+                super().close()
+
+        class _Failing(_FakeSyncSearch):
+            def resolve(self, stages=None):
+                raise RuntimeError('resolve failed')
+
+        orig = esgfsearch.syncstate.SyncState
+        esgfsearch.syncstate.SyncState = _State
+        try:
+            es = _Failing([_sync_doc('a', '20190101',
+                                     '2019-01-01T00:00:00Z')])
+            with self.assertRaises(RuntimeError):
+                es.doSync(sync_file=sync_file)
+        finally:
+            esgfsearch.syncstate.SyncState = orig
+        self.assertEqual(closed, [sync_file])
+
+    def _federated_docs(self):
+        a = _sample_docs(5)
+        b = _sample_docs(8)[3:]
+        for doc in a:
+            doc['replica'] = True
+            doc['data_node'] = 'node-a'
+        for doc in b:
+            doc['replica'] = False
+            doc['data_node'] = 'node-b'
+        return a, b
+
+    def test_federated00(self):
+        """Results from index nodes are merged and deduplicated."""
+        a, b = self._federated_docs()
+        nodes = {'http://a/': (0.0, a), 'http://b/': (0.05, b),
+                 'http://c/': (0.0, None)}
+        es = _FakeFederatedSearch(nodes)
+        res = list(es.iterSearch(page_size=2))
+        self.assertEqual([d.instance_id for d in res],
+                         [d['instance_id'] for d in a + b[2:]])
+        self.assertEqual([d.data_node for d in res],
+                         ['node-a'] * 3 + ['node-b'] * 5)
+        self.assertEqual(es.numFound, 8)
+
+    def test_federated01(self):
+        """Results from the first node are used in 'first' mode."""
+        a, b = self._federated_docs()
+        nodes = {'http://a/': (0.0, a), 'http://b/': (0.5, b)}
+        es = _FakeFederatedSearch(nodes, federation='first')
+        t0 = time.time()
+        res = list(es.iterSearch(page_size=2))
+        self.assertLess(time.time() - t0, 0.5)
+        self.assertEqual([d.instance_id for d in res],
+                         [d['instance_id'] for d in a])
+
+    def test_federated02(self):
+        """Error is raised if all nodes fail."""
+        nodes = {'http://a/': (0.0, None), 'http://b/': (0.0, None)}
+        es = _FakeFederatedSearch(nodes)
+        with self.assertRaises(ConnectionError):
+            list(es.iterSearch())
+
+    def test_federated03(self):
+        """Slower nodes stop requesting pages in 'first' mode."""
+        a, b = self._federated_docs()
+        nodes = {'http://a/': (0.0, a), 'http://b/': (0.1, b * 4)}
+        es = _FakeFederatedSearch(nodes, federation='first')
+        res = list(es.iterSearch(page_size=2))
+        self.assertEqual(len(res), len(a))
+        time.sleep(0.3)
+        count = es.requested.count('http://b/')
+        self.assertLessEqual(count, 2)
+        time.sleep(0.3)
+        self.assertEqual(es.requested.count('http://b/'), count)
+
+
+class test_runPerNode(unittest.TestCase):
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.active = {}
+        self.peak = {}
+        self.peak_total = 0
+
+    def _task(self, arg):
+        node, val = arg
+        with self.lock:
+            self.active[node] = self.active.get(node, 0) + 1
+            self.peak[node] = max(self.peak.get(node, 0), self.active[node])
+            self.peak_total = max(self.peak_total,
+                                  sum(self.active.values()))
+        time.sleep(0.01)
+        with self.lock:
+            self.active[node] -= 1
+        return val * 2
+
+    def test_order(self):
+        """Results are in the same order as tasks."""
+        tasks = [(f'node{i % 3}', self._task, (f'node{i % 3}', i))
+                 for i in range(20)]
+        res = esgfsearch._runPerNode(tasks, 4, 2)
+        self.assertEqual(res, [i * 2 for i in range(20)])
+
+    def test_limits(self):
+        """Concurrency is limited in total and per node."""
+        tasks = [(f'node{i % 3}', self._task, (f'node{i % 3}', i))
+                 for i in range(30)]
+        esgfsearch._runPerNode(tasks, 4, 1)
+        self.assertLessEqual(self.peak_total, 3)
+        self.assertEqual(max(self.peak.values()), 1)
+        esgfsearch._runPerNode(tasks, 4, 3)
+        self.assertLessEqual(self.peak_total, 4)
+
+    def test_error(self):
+        """The first exception in workers is re-raised."""
+        def fail(arg):
+            raise ValueError(arg)
+        tasks = [('node0', self._task, ('node0', 1)),
+                 ('node1', fail, 'bad')]
+        with self.assertRaises(ValueError):
+            esgfsearch._runPerNode(tasks, 4, 2)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == "__main__":
+    main()
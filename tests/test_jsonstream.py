@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from cmiputil import jsonstream
+import unittest
+import json
+
+
+class test_ItemStream(unittest.TestCase):
+    def setUp(self):
+        self.docs = [{'id': f'a.{i}', 'size': 12345678 * i, 'latest': True,
+                      'title': 'café 気候 "quoted", [x]'}
+                     for i in range(20)]
+        self.data = json.dumps(
+            {'responseHeader': {'status': 0},
+             'response': {'numFound': 20, 'start': 0, 'docs': self.docs},
+             'facet_counts': {'facet_fields': {}}}).encode()
+
+    def _chunks(self, size):
+        return [self.data[i:i+size] for i in range(0, len(self.data), size)]
+
+    def test_chunks00(self):
+        """Same result regardless of chunk sizes."""
+        for size in (1, 2, 3, 7, 64, len(self.data)):
+            stream = jsonstream.ItemStream(self._chunks(size))
+            self.assertEqual(list(stream), self.docs, msg=f'size={size}')
+            self.assertEqual(stream.meta['response'],
+                             {'numFound': 20, 'start': 0})
+            self.assertIn('facet_counts', stream.meta)
+
+    def test_lazy00(self):
+        """Items are yielded before all chunks are read."""
+        read = []
+
+        def chunks():
+            for c in self._chunks(16):
+                read.append(c)
+                yield c
+
+        stream = iter(jsonstream.ItemStream(chunks()))
+        first = next(stream)
+        self.assertEqual(first, self.docs[0])
+        self.assertLess(len(read) * 16, len(self.data) / 2)
+
+    def test_nodocs00(self):
+        """No array at the path."""
+        stream = jsonstream.ItemStream([b'{"response": {"numFound": 0}}'])
+        self.assertEqual(list(stream), [])
+        self.assertEqual(stream.meta, {'response': {'numFound': 0}})
+
+    def test_invalid00(self):
+        """Truncated or invalid JSON raises ValueError."""
+        for data in (self.data[:-10], self.data + b'x', b'[1, 2]'):
+            stream = jsonstream.ItemStream([data])
+            with self.assertRaises(ValueError):
+                list(stream)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from cmiputil import metrics
+import unittest
+import json
+import threading
+
+
+class test_Metrics(unittest.TestCase):
+    def setUp(self):
+        self.m = metrics.Metrics()
+
+    def test_record00(self):
+        """Summaries per stage, per host and per both."""
+        for i in range(1, 11):
+            self.m.record('dds', 'a', latency=i / 10, nbytes=10)
+        self.m.record('dds', 'b', latency=5.0, retries=2, error=True)
+        self.m.record('search', 'a', nbytes=100, cache_hit=True)
+        res = self.m.asDict()
+        self.assertEqual(res['detail']['dds']['a'],
+                         {'requests': 10, 'bytes': 100, 'retries': 0,
+                          'errors': 0, 'cache_hits': 0,
+                          'p50': 0.5, 'p95': 1.0})
+        self.assertEqual(res['stages']['dds']['requests'], 11)
+        self.assertEqual(res['stages']['dds']['p95'], 5.0)
+        self.assertEqual(res['stages']['search']['requests'], 0)
+        self.assertEqual(res['stages']['search']['cache_hits'], 1)
+        self.assertIsNone(res['stages']['search']['p50'])
+        self.assertEqual(res['hosts']['a']['bytes'], 200)
+        self.assertEqual(res['hosts']['b']['errors'], 1)
+        self.assertEqual(json.loads(self.m.toJSON()), res)
+
+        self.m.clear()
+        self.assertEqual(self.m.asDict(),
+                         {'stages': {}, 'hosts': {}, 'detail': {}})
+
+    def test_samples00(self):
+        """Only the last max_samples latencies are kept."""
+        m = metrics.Metrics(max_samples=2)
+        for lat in (9.0, 1.0, 2.0):
+            m.record('dds', 'a', latency=lat)
+        self.assertEqual(m.asDict()['stages']['dds']['p95'], 2.0)
+
+    def test_hook00(self):
+        """Hooks are called with each record, errors are not raised."""
+        events = []
+
+        def _bad(event):
+            raise ValueError('bad hook')
+
+        self.m.addHook(events.append)
+        self.m.addHook(_bad)
+        self.m.record('dds', 'a', latency=0.1, url='http://a/x', status=200)
+        self.m.removeHook(events.append)
+        self.m.record('dds', 'a', latency=0.1)
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0]['url'], 'http://a/x')
+        self.assertEqual(events[0]['bytes'], 0)
+
+    def test_stage00(self):
+        """Stage is set per thread."""
+        res = {}
+
+        def _run(name):
+            with metrics.stage(name):
+                threading.Event().wait(0.01)
+                res[name] = metrics.currentStage()
+
+        threads = [threading.Thread(target=_run, args=(n,))
+                   for n in ('dds', 'catalog')]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(res, {'dds': 'dds', 'catalog': 'catalog'})
+        self.assertEqual(metrics.currentStage(), 'other')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from cmiputil import ratelimit
+import unittest
+import asyncio
+import threading
+import time
+
+
+class test_TokenBucket(unittest.TestCase):
+    def test_reserve00(self):
+        """Burst at once, then at rate."""
+        b = ratelimit.TokenBucket(rate=10, burst=3)
+        delays = [b.reserve() for i in range(5)]
+        self.assertEqual(delays[:3], [0, 0, 0])
+        self.assertAlmostEqual(delays[3], 0.1, places=2)
+        self.assertAlmostEqual(delays[4], 0.2, places=2)
+
+    def test_reserve01(self):
+        """No limit."""
+        b = ratelimit.TokenBucket(rate=0)
+        self.assertEqual([b.reserve() for i in range(100)], [0] * 100)
+
+    def test_aacquire00(self):
+        """Asynchronous wait."""
+        b = ratelimit.TokenBucket(rate=20, burst=1)
+
+        async def _main():
+            await asyncio.gather(*(b.aacquire() for i in range(4)))
+
+        t0 = time.monotonic()
+        asyncio.run(_main())
+        self.assertGreaterEqual(time.monotonic() - t0, 0.14)
+
+
+class test_FairScheduler(unittest.TestCase):
+    def test_fair00(self):
+        """Slots are granted round-robin over hosts."""
+        sched = ratelimit.FairScheduler(1)
+        order = []
+        sched.acquire('a')  # hold the only slot
+
+        def _request(host, i):
+            with sched.slot(host):
+                order.append((host, i))
+
+        threads = []
+        for host, i in [('a', 1), ('a', 2), ('a', 3), ('b', 1), ('c', 1)]:
+            t = threading.Thread(target=_request, args=(host, i))
+            t.start()
+            threads.append(t)
+            time.sleep(0.02)  # queue in this order
+        sched.release()
+        for t in threads:
+            t.join()
+        self.assertEqual(order,
+                         [('a', 1), ('b', 1), ('c', 1), ('a', 2), ('a', 3)])
+        self.assertEqual(sched.active, 0)
+
+    def test_limit00(self):
+        """At most max_active at once."""
+        sched = ratelimit.FairScheduler(3)
+        lock = threading.Lock()
+        active = [0, 0]  # current, maximum
+
+        def _request(i):
+            with sched.slot(f'host{i % 4}'):
+                with lock:
+                    active[0] += 1
+                    active[1] = max(active)
+                time.sleep(0.01)
+                with lock:
+                    active[0] -= 1
+
+        threads = [threading.Thread(target=_request, args=(i,))
+                   for i in range(20)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(active[1], 3)
+
+
+    def test_aacquire00(self):
+        """Coroutines share slots with threads, cancelled ones take none."""
+        sched = ratelimit.FairScheduler(2)
+        sched.acquire('a')  # held by a thread
+        sched.acquire('a')
+        active = [0, 0]  # current, maximum
+
+        async def _request(i):
+            await sched.aacquire(f'host{i % 3}')
+            try:
+                active[0] += 1
+                active[1] = max(active)
+                await asyncio.sleep(0.01)
+                active[0] -= 1
+            finally:
+                sched.release()
+
+        async def _main():
+            waiting = asyncio.ensure_future(sched.aacquire('b'))
+            tasks = [asyncio.ensure_future(_request(i)) for i in range(10)]
+            await asyncio.sleep(0.05)
+            self.assertEqual(active[1], 0)
+            waiting.cancel()
+            await asyncio.sleep(0)
+            # released from another thread.
+            for i in range(2):
+                threading.Thread(target=sched.release).start()
+            await asyncio.gather(*tasks)
+            with self.assertRaises(asyncio.CancelledError):
+                await waiting
+
+        asyncio.run(_main())
+        self.assertEqual(active[1], 2)
+        self.assertEqual(sched.active, 0)
+
+
+class test_RateLimiter(unittest.TestCase):
+    def test_hosts00(self):
+        """Buckets per host, with host_rates."""
+        rl = ratelimit.RateLimiter(rate=5, host_rates={'b.node:8080': 1})
+        self.assertIs(rl.bucket('http://a.node/x'),
+                      rl.bucket('http://a.node/y'))
+        self.assertEqual(rl.bucket('http://a.node/x').rate, 5)
+        self.assertEqual(rl.bucket('http://b.node:8080/x').rate, 1)
+        self.assertEqual(ratelimit.parseHostRates('b.node:8080: 1'),
+                         {'b.node:8080': 1.0})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from cmiputil import replica, esgfdatainfo
+import unittest
+
+
+def _dinfo(node, iid='CMIP6.a.v20190101'):
+    return esgfdatainfo.ESGFDataInfo(
+        {'id': f'{iid}|{node}', 'instance_id': iid, 'data_node': node})
+
+
+class test_NodeMonitor(unittest.TestCase):
+    def test_rank00(self):
+        """Live nodes by latency, then unknown, then failed."""
+        mon = replica.NodeMonitor()
+        mon.record('b', 0.2)
+        mon.record('a', 0.1)
+        mon.fail('c')
+        self.assertEqual(mon.rank(['c', 'd', 'b', 'a', 'e']),
+                         ['a', 'b', 'd', 'e', 'c'])
+        self.assertEqual(mon.state('a').latency, 0.1)
+        self.assertIsNone(mon.state('c').latency)
+
+    def test_expire00(self):
+        """Records expire after ttl."""
+        mon = replica.NodeMonitor(ttl=-1)
+        mon.fail('c')
+        self.assertIsNone(mon.state('c'))
+        self.assertEqual(mon.rank(['c', 'd']), ['c', 'd'])
+
+
+class test_selectReplicas(unittest.TestCase):
+    def test_select00(self):
+        """The fastest copy is kept, others are its replicas."""
+        mon = replica.NodeMonitor()
+        mon.record('fast', 0.1)
+        mon.record('slow', 1.0)
+        mon.fail('dead')
+        dinfo = [_dinfo('dead'), _dinfo('slow'), _dinfo('x', 'CMIP6.b'),
+                 _dinfo('fast')]
+        res = replica.selectReplicas(dinfo, mon)
+        self.assertEqual([d.data_node for d in res], ['fast', 'x'])
+        self.assertEqual([d.data_node for d in res[0].replicas],
+                         ['slow', 'dead'])
+        self.assertEqual(res[1].replicas, [])
+        self.assertNotIn('replicas', dict(res[0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from cmiputil import resultstore, esgfdatainfo, dds
+import unittest
+from pathlib import Path
+
+_dds_file = (Path(__file__).parent / 'fixtures' / 'standin' /
+             'aggregation.dds')
+
+
+class test_ResultStore(unittest.TestCase):
+    def setUp(self):
+        self.file = Path('/tmp/test_resultstore.sqlite')
+        if self.file.exists():
+            self.file.unlink()
+        self.store = resultstore.ResultStore(self.file)
+
+    def tearDown(self):
+        self.store.close()
+        self.file.unlink()
+
+    def _dinfo(self, i, source='MIROC6', exp='historical'):
+        return esgfdatainfo.ESGFDataInfo(
+            {'id': f'ds.r{i}i1p1f1|node', 'source_id': [source],
+             'experiment_id': [exp], 'variant_label': [f'r{i}i1p1f1'],
+             'url': [f'http://node/catalog/r{i}.xml#x|application/xml+'
+                     'thredds|THREDDS'],
+             'size': 100 * i})
+
+    def test_save00(self):
+        """Managed and resolved attributes are loaded back."""
+        d = self._dinfo(1)
+        d.mf_data_url = ['http://node/dodsC/a.nc']
+        d.agg_data_url = 'http://node/dodsC/agg'
+        d.data_url = d.agg_data_url
+        d.files = [{'filename': 'a.nc', 'size': 100}]
+        d.agg_dds = dds.parse_dataset(_dds_file.read_text())
+        d.mf_dds = [None]
+        d.local_files = [Path('/data/a.nc')]
+        self.store.save([d])
+
+        res = self.store.load()
+        self.assertEqual(len(res), 1)
+        r = res[0]
+        for a in ('id', 'source_id', 'cat_url', 'size', 'data_url',
+                  'agg_data_url', 'mf_data_url', 'files', 'local_files',
+                  'mf_dds'):
+            self.assertEqual(getattr(r, a), getattr(d, a), msg=a)
+        self.assertEqual(r.agg_dds.text, d.agg_dds.text)
+
+    def test_save01(self):
+        """Lazy attributes not resolved are not stored nor resolved."""
+        d = self._dinfo(1)
+        self.store.save([d])
+        self.assertFalse(d.isSet('data_url'))
+        r = self.store.load()[0]
+        self.assertFalse(r.isSet('data_url'))
+        self.assertFalse(r.isSet('agg_dds'))
+
+    def test_facets00(self):
+        """Load and count with facets."""
+        self.store.save([self._dinfo(1), self._dinfo(2, 'MRI-ESM2-0'),
+                         self._dinfo(3, exp='amip')])
+        self.assertEqual(self.store.count(), 3)
+        self.assertEqual(self.store.count({'source_id': 'MIROC6'}), 2)
+        self.assertEqual(
+            [d.variant_label for d in
+             self.store.load({'source_id': 'MIROC6, MRI-ESM2-0',
+                              'experiment_id': ['historical']})],
+            ['r1i1p1f1', 'r2i1p1f1'])
+        self.assertEqual(self.store.load({'source_id': 'CanESM5'}), [])
+
+    def test_append00(self):
+        """Appended results replace ones with the same id."""
+        self.store.save([self._dinfo(1), self._dinfo(2)])
+        self.store.save([self._dinfo(2, 'MRI-ESM2-0'), self._dinfo(3)],
+                        append=True)
+        self.assertEqual(self.store.count(), 3)
+        self.assertEqual(self.store.count({'source_id': 'MIROC6'}), 2)
+        self.store.save([self._dinfo(4)])
+        self.assertEqual([d.variant_label for d in self.store.load()],
+                         ['r4i1p1f1'])
+        self.store.clear()
+        self.assertEqual(self.store.count(), 0)
+
+    def test_iterLoad00(self):
+        """Results are loaded in batches, without holding the store."""
+        self.store.save([self._dinfo(i) for i in range(1, 6)])
+        fetch_size = resultstore.fetch_size
+        resultstore.fetch_size = 2
+        try:
+            it = self.store.iterLoad()
+            self.assertEqual(next(it).variant_label, 'r1i1p1f1')
+            self.assertEqual(self.store.count(), 5)
+            self.assertEqual([d.variant_label for d in it],
+                             [f'r{i}i1p1f1' for i in range(2, 6)])
+        finally:
+            resultstore.fetch_size = fetch_size
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from cmiputil import session, config
+import unittest
+import asyncio
+import threading
+import time
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Fail with 503 `fails` times, then return 200."""
+    fails = 0
+    delay = 0
+    count = 0
+
+    def do_GET(self):
+        cls = self.__class__
+        cls.count += 1
+        time.sleep(cls.delay)
+        if cls.count <= cls.fails:
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = b'ok'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class test_Session(unittest.TestCase):
+    def setUp(self):
+        _Handler.fails = 0
+        _Handler.delay = 0
+        _Handler.count = 0
+        self.server = HTTPServer(('127.0.0.1', 0), _Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}/'
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+        self.conf = config.Conf(None)
+        self.conf.read_dict({'Session': {'retries': 2,
+                                         'backoff_factor': 0,
+                                         'read_timeout': 0.2}})
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_init00(self):
+        """Default values."""
+        s = session.Session(None)
+        for k, v in session.session_default.items():
+            self.assertEqual(getattr(s, k), v)
+
+    def test_retry00(self):
+        """5xx is retried."""
+        _Handler.fails = 2
+        s = session.Session(conf=self.conf)
+        r = s.request('GET', self.url)
+        self.assertEqual(r.status, 200)
+        self.assertEqual(_Handler.count, 3)
+
+    def test_retry01(self):
+        """The last response is returned after retries."""
+        _Handler.fails = 5
+        s = session.Session(conf=self.conf)
+        r = s.request('GET', self.url)
+        self.assertEqual(r.status, 503)
+        self.assertEqual(_Handler.count, 3)
+
+    def test_timeout00(self):
+        """Read timeout raises after retries."""
+        _Handler.delay = 0.5
+        s = session.Session(conf=self.conf)
+        with self.assertRaises(session.urllib3.exceptions.MaxRetryError):
+            s.request('GET', self.url)
+
+    def test_arequest00(self):
+        """Asynchronous request is retried as well."""
+        _Handler.fails = 2
+        s = session.Session(conf=self.conf)
+
+        async def _main():
+            try:
+                return await s.arequest('GET', self.url)
+            finally:
+                await s.aclose()
+
+        r = asyncio.run(_main())
+        self.assertEqual((r.status, r.data), (200, b'ok'))
+        self.assertEqual(_Handler.count, 3)
+
+    def test_arequest01(self):
+        """Asynchronous requests are limited by max_requests."""
+        _Handler.delay = 0.02
+        conf = config.Conf(None)
+        conf.read_dict({'Session': {'max_requests': 2}})
+        s = session.Session(conf=conf)
+        scheduler = s.limiter.scheduler
+        active = []
+
+        async def _sample(task):
+            while not task.done():
+                active.append(scheduler.active)
+                await asyncio.sleep(0.002)
+
+        async def _main():
+            try:
+                task = asyncio.ensure_future(asyncio.gather(
+                    *(s.arequest('GET', self.url) for i in range(6))))
+                await _sample(task)
+                return await task
+            finally:
+                await s.aclose()
+
+        res = asyncio.run(_main())
+        self.assertEqual([r.status for r in res], [200] * 6)
+        self.assertEqual(max(active), 2)
+        self.assertEqual(scheduler.active, 0)
+
+    def test_adapter00(self):
+        """requests adapter shares the retry policy."""
+        import requests
+        _Handler.fails = 2
+        s = session.Session(conf=self.conf)
+        rs = requests.Session()
+        rs.mount('http://', s.requestsAdapter())
+        r = rs.get(self.url)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(_Handler.count, 3)
+
+    def test_limit00(self):
+        """Requests to one host are limited by rate."""
+        conf = config.Conf(None)
+        conf.read_dict({'Session': {'rate': 20, 'burst': 1}})
+        s = session.Session(conf=conf)
+        t0 = time.monotonic()
+        for i in range(5):
+            s.request('GET', self.url)
+        self.assertGreaterEqual(time.monotonic() - t0, 0.19)
+        self.assertEqual(s.limiter.bucket(self.url).rate, 20)
+
+    def test_limit01(self):
+        """Slot is held while the body is streamed."""
+        conf = config.Conf(None)
+        conf.read_dict({'Session': {'max_requests': 1}})
+        s = session.Session(conf=conf)
+        scheduler = s.limiter.scheduler
+
+        r = s.request('GET', self.url, preload_content=False)
+        self.assertEqual(scheduler.active, 1)
+        other = threading.Thread(target=s.request, args=('GET', self.url))
+        other.start()
+        other.join(0.2)
+        self.assertTrue(other.is_alive())
+        self.assertEqual(r.read(), b'ok')
+        other.join(5)
+        self.assertFalse(other.is_alive())
+        self.assertEqual(scheduler.active, 0)
+
+        r = s.request('GET', self.url, preload_content=False)
+        self.assertEqual(scheduler.active, 1)
+        r.release_conn()
+        r.release_conn()
+        self.assertEqual(scheduler.active, 0)
+
+    def test_shared00(self):
+        """Shared instance."""
+        s = session.Session(conf=self.conf)
+        session.setSession(s)
+        self.assertIs(session.getSession(), s)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from cmiputil import esgfsearch, dds
+from standin import StandinServer
+import benchmark
+import asyncio
+import tempfile
+import unittest
+from pathlib import Path
+from urllib.parse import urlparse
+
+
+def _search(server, retries=5, sections=None, **opts):
+    conffile = Path('/tmp/test_standin.conf')
+    opts['search_service'] = server.search_service
+    lines = (['[ESGFSearch]'] + [f'{k} = {v}' for k, v in opts.items()] +
+             ['[Session]', f'retries = {retries}', 'backoff_factor = 0'])
+    for sect, values in (sections or {}).items():
+        lines += [f'[{sect}]'] + [f'{k} = {v}' for k, v in values.items()]
+    conffile.write_text('\n'.join(lines))
+    return esgfsearch.ESGFSearch(conffile)
+
+
+class test_Standin(unittest.TestCase):
+    """End-to-end tests of ESGFSearch on the local stand-in server."""
+
+    def test_doSearch00(self):
+        """Search, catalogs and DDS."""
+        with StandinServer(datasets=12) as server:
+            es = _search(server, page_size=5)
+            es.doSearch(stages=('search', 'catalog', 'dds'))
+            self.assertEqual(es.numFound, 12)
+            self.assertEqual(len(es.datainfo), 12)
+            self.assertEqual(server.counts,
+                             {'search': 3, 'catalog': 12, 'dds': 36,
+                              'file': 0})
+            d = es.datainfo[11]
+            self.assertEqual(d.variant_label, 'r12i1p1f1')
+            self.assertTrue(d.data_url.startswith(server.url))
+            self.assertEqual(len(d.mf_data_url), 2)
+            self.assertIsInstance(d.agg_dds, dds.Dataset)
+            self.assertEqual(len(d.mf_dds), 2)
+
+    def test_ddsPolicy00(self):
+        """DDS of files are inferred, and not requested twice."""
+        with StandinServer(datasets=4) as server:
+            es = _search(server)
+            es.doSearch(stages=('search', 'catalog', 'dds'))
+            ref = [[d.text for d in di.mf_dds] for di in es.datainfo]
+            self.assertEqual(server.counts['dds'], 4 * 3)
+
+            es.datainfo[0].getDDS()
+            self.assertEqual(server.counts['dds'], 4 * 3)
+
+            for policy, count in (('aggregate-only', 1), ('first+last', 3)):
+                es = _search(server, dds_policy=policy)
+                server.counts['dds'] = 0
+                es.doSearch(stages=('search', 'catalog', 'dds'))
+                self.assertEqual(server.counts['dds'], 4 * count)
+                self.assertEqual(
+                    [[d.text for d in di.mf_dds] for di in es.datainfo], ref)
+
+            es = _search(server, dds_policy='aggregate-only')
+            server.counts['dds'] = 0
+
+            async def _main():
+                try:
+                    return await es.asearch(stages=('catalog', 'dds'))
+                finally:
+                    await es.session.aclose()
+            res = asyncio.run(_main())
+            self.assertEqual(server.counts['dds'], 4)
+            self.assertEqual([[d.text for d in di.mf_dds] for di in res], ref)
+
+            with self.assertRaises(ValueError):
+                es.datainfo[0].getDDS(policy='none')
+
+    def test_estimateBytes00(self):
+        """Bytes estimated from DDS of the aggregation and of files."""
+        with StandinServer(datasets=2) as server:
+            es = _search(server)
+            es.doSearch(stages=('search', 'catalog', 'dds'))
+            d = es.datainfo[0]
+            maps = (128 + 256) * 8
+            self.assertEqual(es.estimated_bytes[0],
+                             d.estimateBytes(aggregate=True))
+            self.assertEqual(d.estimateBytes(variables=['tas']),
+                             1980 * 128 * 256 * 4 + 1980 * 8 + maps)
+
+            # across the boundary of files, 1200 steps in the first.
+            sel = {'time': slice(1190, 1210)}
+            for agg in (True, False):
+                self.assertEqual(
+                    d.estimateBytes(agg, ['time', 'time_bnds'], sel),
+                    20 * 8 * 3)
+            self.assertEqual(
+                d.estimateBytes(False, ['tas'], sel),
+                d.estimateBytes(True, ['tas'], sel) + maps)
+
+    def test_catalogCache00(self):
+        """Known datasets are resolved without requests."""
+        cache_file = Path('/tmp/test_standin_catalog.sqlite')
+        if cache_file.exists():
+            cache_file.unlink()
+        sections = {'ESGFSearch.catalog_cache': {'enable': True,
+                                                 'file': cache_file}}
+        with StandinServer(datasets=6) as server:
+            es = _search(server, sections=sections)
+            es.doSearch(stages=('search', 'catalog'))
+            ref = [(d.data_url, d.mf_data_url) for d in es.datainfo]
+            self.assertEqual(server.counts['catalog'], 6)
+            self.assertEqual(len(es.catalog_cache), 6)
+
+            es = _search(server, sections=sections)
+            es.doSearch(stages=('search', 'catalog'))
+            self.assertEqual([(d.data_url, d.mf_data_url)
+                              for d in es.datainfo], ref)
+            self.assertEqual(server.counts['catalog'], 6)
+            self.assertEqual(
+                es.metrics.asDict()['stages']['catalog']['cache_hits'], 6)
+
+            d = es.datainfo[0]
+            d.invalidateCatalog()
+            self.assertEqual(len(es.catalog_cache), 5)
+            d.getDataURL()
+            self.assertEqual(server.counts['catalog'], 7)
+            es.catalog_cache.close()
+        cache_file.unlink()
+
+    def test_metrics00(self):
+        """Requests are recorded per stage and host."""
+        with StandinServer(datasets=6) as server:
+            es = _search(server, page_size=5)
+            es.doSearch(stages=('search', 'catalog', 'dds'))
+            res = es.metrics.asDict()
+            host = server.url[len('http://'):]
+            for st in ('search', 'catalog', 'dds'):
+                self.assertEqual(res['stages'][st]['requests'],
+                                 server.counts[st])
+                self.assertGreater(res['detail'][st][host]['bytes'], 0)
+                self.assertIsNotNone(res['detail'][st][host]['p95'])
+            self.assertEqual(res['hosts'][host]['errors'], 0)
+
+    def test_metrics01(self):
+        """Each instance records only its own requests."""
+        with StandinServer(datasets=6) as server:
+            es1 = _search(server, page_size=5)
+            es2 = _search(server, page_size=5)
+            es1.doSearch(stages=('search', 'catalog'))
+            res = es1.metrics.asDict()
+            self.assertEqual(res['stages']['catalog']['requests'], 6)
+            self.assertEqual(es2.metrics.asDict()['stages'], {})
+
+    def test_doSearch01(self):
+        """Failed requests are retried."""
+        with StandinServer(datasets=20, failure_rate=0.3, seed=1) as server:
+            es = _search(server, page_size=5)
+            es.doSearch(stages=('search', 'catalog'))
+            self.assertEqual(len(es.data_urls), 20)
+            self.assertGreater(sum(server.failures.values()), 0)
+
+    def test_files00(self):
+        """File-level search, without catalogs."""
+        with StandinServer(datasets=12) as server:
+            es = _search(server, aggregate=False, files_batch=5)
+            es.doSearch(stages=('search', 'files'))
+            self.assertEqual(server.counts,
+                             {'search': 1 + 3, 'catalog': 0, 'dds': 0,
+                              'file': 0})
+            for d in es.datainfo:
+                self.assertEqual(len(d.files), 2)
+                self.assertEqual(len(d.data_url), 2)
+
+    def test_replica00(self):
+        """The live replica is selected, and used on failure."""
+        with StandinServer(datasets=1) as server:
+            es = _search(server, retries=1)
+            es.doSearch(stages=('search',))
+            good = es.datainfo[0]
+            dead = es._newDataInfo(dict(good))
+            dead.data_node = 'dead.node'
+            dead.cat_url = good.cat_url.replace(server.url,
+                                                'http://127.0.0.1:9')
+            es.selectReplicas([dead, good])
+            self.assertEqual(es.datainfo, [good])
+            self.assertEqual(good.replicas, [dead])
+
+            dead.setReplicas([good])
+            self.assertTrue(dead.data_url.startswith(server.url))
+            self.assertEqual(dead.data_node, good.data_node)
+            self.assertEqual(server.counts['catalog'], 2)
+
+    def test_findLocalFiles00(self):
+        """Local files are found listing each directory once."""
+        with StandinServer(datasets=10) as server, \
+                tempfile.TemporaryDirectory() as tmp:
+            files = server.makeLocalFiles(tmp, step=2)
+            es = _search(server)
+            es.doSearch(stages=('search',))
+            es.metrics.clear()
+            es.findLocalFiles(base_dir=tmp)
+            res = [f for d in es.datainfo for f in d.local_files]
+            self.assertEqual(sorted(res), sorted(files))
+            self.assertEqual([len(d.local_files) for d in es.datainfo],
+                             [2, 0] * 5)
+            # base_dir and 5 common levels, then 5 levels of each
+            # existing member_id, not of missing ones.
+            self.assertEqual(
+                es.metrics.asDict()['stages']['local']['requests'],
+                6 + 5 * 5)
+
+    def test_download00(self):
+        """Files are downloaded, skipped, resumed and verified."""
+        sections = {'Download': {'chunk_size': 30000, 'max_workers': 4}}
+        with StandinServer(datasets=3) as server, \
+                tempfile.TemporaryDirectory() as tmp:
+            es = _search(server, sections=sections)
+            es.doSearch(stages=('search',))
+            res = es.download(base_dir=tmp)
+            self.assertEqual((res['downloaded'], res['failed']), (6, 0))
+            self.assertEqual(res['bytes'], 6 * 100000)
+            self.assertEqual(server.counts['file'], 6 * 4)
+            files = [f.path for f in res['files']]
+            self.assertEqual([f for d in es.datainfo for f in d.local_files],
+                             files)
+            for f in res['files']:
+                self.assertEqual(f.path.read_bytes(), server.fileContent(
+                    urlparse(f.url).path))
+
+            # skipped without requests
+            res = es.download(base_dir=tmp)
+            self.assertEqual(res['skipped'], 6)
+            self.assertEqual(server.counts['file'], 6 * 4)
+
+            # resumed from the end of .part
+            path, url = files[0], res['files'][0].url
+            part = path.with_name(path.name + '.part')
+            part.write_bytes(path.read_bytes()[:70000])
+            path.unlink()
+            res = es.download(base_dir=tmp)
+            self.assertEqual((res['downloaded'], res['bytes']), (1, 30000))
+            self.assertEqual(server.counts['file'], 6 * 4 + 1)
+            self.assertEqual(path.read_bytes(),
+                             server.fileContent(urlparse(url).path))
+            self.assertFalse(part.exists())
+
+            # broken .part is discarded
+            part.write_bytes(b'x' * 70000)
+            path.unlink()
+            res = es.download(base_dir=tmp)
+            self.assertEqual(res['failed'], 1)
+            self.assertIn('SHA256', res['files'][0].error)
+            self.assertFalse(part.exists() or path.exists())
+
+            # the whole file from servers without Range
+            server.ranges = False
+            res = es.download(base_dir=tmp)
+            self.assertEqual((res['downloaded'], res['bytes']), (1, 100000))
+            self.assertEqual(path.read_bytes(),
+                             server.fileContent(urlparse(url).path))
+
+    def test_benchmark00(self):
+        """Benchmark runs and reports all stages."""
+        res = benchmark.run(10)
+        self.assertEqual([r['stage'] for r in res], list(benchmark.stages))
+        for r in res[:3]:
+            self.assertEqual(r['errors'], 0)
+            self.assertEqual(r['count'], 10)
+            self.assertIsNotNone(r['p95'])
+
+
+class test_Async(unittest.TestCase):
+    """Asynchronous API on the local stand-in server."""
+
+    def _run(self, es, coro):
+        async def _main():
+            try:
+                return await coro
+            finally:
+                await es.session.aclose()
+        return asyncio.run(_main())
+
+    def test_asearch00(self):
+        """Same results as doSearch()."""
+        with StandinServer(datasets=23) as server:
+            es = _search(server, page_size=5)
+            es.doSearch(stages=('search', 'catalog', 'dds'))
+            ref = [(d.data_url, d.mf_data_url, str(d.mf_dds[1]))
+                   for d in es.datainfo]
+            counts = dict(server.counts)
+
+            es = _search(server, page_size=5)
+            res = self._run(es, es.asearch(stages=('catalog', 'dds')))
+            self.assertEqual(res, es.datainfo)
+            self.assertEqual(es.numFound, 23)
+            self.assertEqual([(d.data_url, d.mf_data_url, str(d.mf_dds[1]))
+                              for d in es.datainfo], ref)
+            self.assertEqual(server.counts,
+                             {k: v * 2 for k, v in counts.items()})
+
+    def test_asearch01(self):
+        """File-level search."""
+        with StandinServer(datasets=12) as server:
+            es = _search(server, aggregate=False, files_batch=5)
+            self._run(es, es.asearch(stages=('files',)))
+            self.assertEqual(server.counts['catalog'], 0)
+            for d in es.datainfo:
+                self.assertEqual(len(d.data_url), 2)
+
+    def test_timeout00(self):
+        """Each request is limited by timeout."""
+        with StandinServer(datasets=2, latency={'catalog': 1.0}) as server:
+            es = _search(server, retries=0)
+            with self.assertRaises(asyncio.TimeoutError):
+                self._run(es, es.asearch(stages=('catalog',), timeout=0.2))
+
+    def test_cancel00(self):
+        """Cancelled on timeout of the whole, leaving no tasks."""
+        with StandinServer(datasets=4, latency={'dds': 1.0}) as server:
+            es = _search(server)
+
+            async def _main():
+                with self.assertRaises(asyncio.TimeoutError):
+                    await asyncio.wait_for(es.asearch(stages=('dds',)), 0.3)
+                return asyncio.all_tasks()
+
+            tasks = self._run(es, _main())
+            self.assertEqual(len(tasks), 1)  # only _main()
+
+
+if __name__ == '__main__':
+    unittest.main()